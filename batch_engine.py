@@ -0,0 +1,181 @@
+# C:\excel-to-web\batch_engine.py
+
+import numpy as np
+from typing import Dict, Any, List, Optional, Tuple
+
+import logic
+
+# ================================================================
+# ВЕКТОРНЫЙ РАСЧЕТ ПАКЕТА ПРЕДЛОЖЕНИЙ (РУЧНАЯ СКИДКА, БЕЗ АКЦИЙ)
+# ================================================================
+# Все суммы считаются в целых копейках (int64), каждое округление
+# round_decimal (ROUND_HALF_UP до 0.01) воспроизводится явно:
+#   ruble_value = numerator / denominator  ->  _round_half_up(numerator, denominator)
+# Множители представлены точными целыми дробями:
+#   цена        = P / 100        (P - копейки)
+#   скидка      = (10000 - Dh) / 10000   (Dh - сотые доли процента)
+#   фиксация    = F / 100        (1.07 -> 107)
+#   НДС         = 12 / 10
+# Предложения, которые нельзя точно выразить в этих единицах (цена или скидка
+# с большим числом знаков, неположительная предоплата, риск переполнения,
+# аккаунты или месяцы вне int64),
+# помечаются и считаются по Decimal-пути logic.run_calculation.
+
+_VAT_NUM, _VAT_DEN = 12, 10
+_DISCOUNT_DEN = 10000
+_FIX_DEN = 100
+# Верхняя граница промежуточных произведений (int64 ~ 9.2e18)
+_MAX_INTERMEDIATE = 1e17
+_INT64_MIN, _INT64_MAX = int(np.iinfo(np.int64).min), int(np.iinfo(np.int64).max)
+
+_FIX_COEFF_HUNDREDTHS = {
+    months: int(coeff * _FIX_DEN) for months, coeff in logic.FIXATION_COEFFICIENT_MAP.items()
+}
+
+def _round_half_up(numerator: np.ndarray, denominator) -> np.ndarray:
+    """Целочисленное numerator / denominator с округлением ROUND_HALF_UP (от нуля)."""
+    magnitude = (np.abs(numerator) * 2 + denominator) // (2 * denominator)
+    return np.sign(numerator) * magnitude
+
+def _to_hundredths(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Переводит float в целые сотые. Вторым значением возвращает маску точности:
+    True, если x == сотые / 100 (тогда Decimal(str(x)) совпадает с ними ровно).
+    """
+    with np.errstate(invalid='ignore'):
+        scaled = np.round(values * 100)
+        exact = np.isfinite(values) & (scaled / 100 == values) & (np.abs(scaled) < 2 ** 53)
+    return np.where(exact, scaled, 0).astype(np.int64), exact
+
+def _fits_int64(data: Dict[str, Any], level_prices_info: List[Dict[str, Any]]) -> bool:
+    """Аккаунты и месяцы предложения помещаются в int64 (иначе np.array падает с OverflowError)."""
+    values = [item['accounts'] for item in level_prices_info]
+    values += [data.get('prepayment_months', 1) or 1, data.get('fixation_months', 0) or 0]
+    return all(_INT64_MIN <= int(value) <= _INT64_MAX for value in values)
+
+def calculate_price_summaries(quotes: List[Dict[str, Any]]) -> List[Optional[Dict[str, float]]]:
+    """
+    Считает price_summary для списка предложений одним проходом NumPy.
+
+    Args:
+        quotes: Список словарей {"data": входные данные, "levels": level_prices_info},
+            где level_prices_info - результат logic.find_price_tiers (не пустой).
+
+    Returns:
+        Список price_summary в том же порядке, значения совпадают с logic.run_calculation.
+        None - для предложений, которые нельзя посчитать точно в целых копейках.
+    """
+    if not quotes:
+        return []
+
+    # --- Плоские массивы по уровням и по предложениям ---
+    level_counts = np.array([len(quote["levels"]) for quote in quotes], dtype=np.int64)
+    segment_starts = np.concatenate(([0], np.cumsum(level_counts)[:-1]))
+    prices = np.array([item['price_without_vat_per_user'] for quote in quotes for item in quote["levels"]], dtype=np.float64)
+    prices_k, prices_exact = _to_hundredths(prices)
+    accounts = np.array([item['accounts'] for quote in quotes for item in quote["levels"]], dtype=np.int64)
+
+    is_ld = np.array(["ЛД" in quote["data"].get('service', '') for quote in quotes])
+    raw_months = np.array([quote["data"].get('prepayment_months', 1) or 1 for quote in quotes], dtype=np.int64)
+    discount = np.array([quote["data"].get('discount_percent', 0) or 0 for quote in quotes], dtype=np.float64)
+    discount_h, discount_exact = _to_hundredths(discount)
+    fixation_months = np.array([quote["data"].get('fixation_months', 0) or 0 for quote in quotes], dtype=np.int64)
+    fix_coeff = np.array([_FIX_COEFF_HUNDREDTHS.get(m, _FIX_DEN) for m in fixation_months.tolist()], dtype=np.int64)
+    discount_num = _DISCOUNT_DEN - discount_h
+
+    # --- Какие предложения можно посчитать точно ---
+    months = np.where(raw_months >= 1, raw_months, 1)
+    estimate = (
+        np.add.reduceat(np.abs(prices_k).astype(np.float64) * accounts, segment_starts)
+        * np.maximum(np.abs(discount_num), 1) * 200 * months
+    )
+    supported = (
+        np.logical_and.reduceat(prices_exact, segment_starts) & discount_exact
+        & (raw_months >= 1) & (estimate < _MAX_INTERMEDIATE)
+    )
+
+    level_discount_num = np.repeat(discount_num, level_counts)
+    level_fix_coeff = np.repeat(fix_coeff, level_counts)
+    level_amount = prices_k * accounts  # копейки, без округления (цена * аккаунты)
+
+    # --- Не-ЛД: округление по каждому уровню ---
+    list_level = _round_half_up(level_amount * _VAT_NUM, _VAT_DEN)
+    discounted_level = _round_half_up(_round_half_up(level_amount * level_discount_num, _DISCOUNT_DEN) * _VAT_NUM, _VAT_DEN)
+    fixed_level = _round_half_up(
+        _round_half_up(level_amount * level_discount_num * level_fix_coeff, _DISCOUNT_DEN * _FIX_DEN) * _VAT_NUM, _VAT_DEN
+    )
+    non_ld_list_monthly = np.add.reduceat(list_level, segment_starts)
+    non_ld_list_period = non_ld_list_monthly * months
+    non_ld_discounted_period = np.add.reduceat(discounted_level, segment_starts) * months
+    non_ld_fixed_period = np.add.reduceat(fixed_level, segment_starts) * months
+
+    # --- ЛД: месяц без НДС суммируется без округления, скидка - по цене первого уровня ---
+    base_monthly = np.add.reduceat(level_amount, segment_starts)
+    ld_list_period = _round_half_up(base_monthly * months * _VAT_NUM, _VAT_DEN)
+    ld_list_monthly = _round_half_up(base_monthly * _VAT_NUM, _VAT_DEN)
+    first_price = prices_k[segment_starts]
+    ld_with_discount = _round_half_up(first_price * discount_num, _DISCOUNT_DEN)
+    ld_discounted_period = _round_half_up(ld_with_discount * months * _VAT_NUM, _VAT_DEN)
+    ld_with_fix = _round_half_up(first_price * discount_num * fix_coeff, _DISCOUNT_DEN * _FIX_DEN)
+    ld_fixed_period = _round_half_up(ld_with_fix * months * _VAT_NUM, _VAT_DEN)
+
+    # --- Сборка итогов ---
+    list_period = np.where(is_ld, ld_list_period, non_ld_list_period)
+    list_monthly = np.where(is_ld, ld_list_monthly, _round_half_up(non_ld_list_period, months))
+    discounted_period = np.where(is_ld, ld_discounted_period, non_ld_discounted_period)
+    fixed_period = np.where(fixation_months > 0, np.where(is_ld, ld_fixed_period, non_ld_fixed_period), discounted_period)
+    discounted_monthly = _round_half_up(discounted_period, months)
+    fixed_monthly = _round_half_up(fixed_period, months)
+
+    # Копейки -> рубли: k / 100 дает тот же float, что и float(Decimal) от суммы в рублях
+    columns = {
+        "list_monthly": list_monthly, "list_period": list_period,
+        "discounted_monthly": discounted_monthly, "discounted_period": discounted_period,
+        "fixed_monthly": fixed_monthly, "fixed_period": fixed_period,
+    }
+    rubles = {name: (values / 100).tolist() for name, values in columns.items()}
+    return [
+        {name: rubles[name][i] for name in columns} if is_supported else None
+        for i, is_supported in enumerate(supported.tolist())
+    ]
+
+def run_batch_calculation(
+    batch: List[Dict[str, Any]],
+    price_index: logic.PriceIndex
+) -> List[Dict[str, Any]]:
+    """
+    Пакетный аналог logic.run_calculation для предложений без акций.
+
+    Args:
+        batch: Список входных данных (как data в run_calculation).
+        price_index: Индекс прайс-листа.
+
+    Returns:
+        Список результатов {"price_summary", "calculation_context"} в порядке batch,
+        совпадающих с logic.run_calculation(data, None, price_index=price_index).
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(batch)
+    vector_positions, vector_quotes = [], []
+    for position, data in enumerate(batch):
+        level_prices_info = logic.find_price_tiers(data, None, price_index)
+        if not level_prices_info:
+            results[position] = {"price_summary": None, "calculation_context": None}
+        elif not _fits_int64(data, level_prices_info):
+            results[position] = logic.run_calculation(data, None, price_index=price_index)
+        else:
+            vector_positions.append(position)
+            vector_quotes.append({"data": data, "levels": level_prices_info})
+
+    for position, quote, price_summary in zip(vector_positions, vector_quotes, calculate_price_summaries(vector_quotes)):
+        data, level_prices_info = quote["data"], quote["levels"]
+        if price_summary is None:
+            results[position] = logic.run_calculation(data, None, price_index=price_index)
+            continue
+        context = {
+            "service_name": data.get('service', 'N/A'), "prepayment_months": data.get('prepayment_months', 1) or 1,
+            "discount_percent": data.get('discount_percent', 0), "fixation_months": data.get('fixation_months', 0),
+            "total_users": sum(item['accounts'] for item in level_prices_info),
+            "levels": level_prices_info, "price_summary": price_summary
+        }
+        results[position] = {"price_summary": price_summary, "calculation_context": context}
+    return results
@@ -0,0 +1,61 @@
+# C:\excel-to-web\benchmarks\bench_offer_render.py
+#
+# Скорость генерации КП (документов в секунду): старый путь (новый DocxTemplate
+# на каждый документ) против кэша разобранного шаблона.
+#   python benchmarks/bench_offer_render.py [число документов]
+
+import io
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from docxtpl import DocxTemplate
+
+import document_generator
+import logic
+from main import build_pricing_data
+from data_loader import load_tables
+
+
+def sample_context(state):
+    prices = state.prices
+    data = {
+        "period": prices['Период'][0], "service": prices['Сервис'][0],
+        "levels": [{"level": prices['Уровень'][0], "accounts": int(prices['Аккаунтов'][0])}],
+        "prepayment_months": 12, "discount_percent": 5.0, "fixation_months": 6,
+    }
+    context = dict(logic.run_calculation(data, None, price_index=state.price_index)["calculation_context"])
+    context['current_date'] = "01.10.2025"
+    return context
+
+
+def render_uncached(context):
+    doc = DocxTemplate(str(document_generator.OFFER_TEMPLATE_PATH))
+    doc.render(context)
+    file_stream = io.BytesIO()
+    doc.save(file_stream)
+    return file_stream.getvalue()
+
+
+def documents_per_second(render, context, count):
+    render(context)  # прогрев
+    started = time.perf_counter()
+    for _ in range(count):
+        render(context)
+    return count / (time.perf_counter() - started)
+
+
+def main(count=200):
+    prices, promotions, _ = load_tables(ROOT / "data_export")
+    context = sample_context(build_pricing_data(prices, promotions, version=1, source="benchmark"))
+    before = documents_per_second(render_uncached, context, count)
+    after = documents_per_second(document_generator.render_offer_bytes, context, count)
+    print(f"До   (DocxTemplate на каждый документ): {before:8.1f} док/с")
+    print(f"После (кэш разобранного шаблона):       {after:8.1f} док/с  (x{after / before:.1f})")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
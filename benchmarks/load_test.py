@@ -0,0 +1,253 @@
+# C:\excel-to-web\benchmarks\load_test.py
+#
+# Нагрузочный тест: поднимает приложение локально в профиле, похожем на fly.toml
+# (один CPU через taskset, --limit-concurrency = hard_limit), и прогоняет смесь
+# запросов /, /get_levels_for_service, /get_all_promotions_for_selection,
+# /calculate и /download_offer, собранных из реального прайс-листа.
+# Для каждого уровня параллельности печатает p50/p95/p99 и пропускную способность.
+#
+#   python benchmarks/load_test.py                          # уровни 1 5 10 25 50, по 15 с
+#   python benchmarks/load_test.py --concurrency 10 25 --duration 30 --output load.json
+#   python benchmarks/load_test.py --url http://127.0.0.1:10000   # уже запущенный сервер
+#   python benchmarks/load_test.py --workers 2 --cpus 2      # serve.py с двумя воркерами на двух CPU
+
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tomllib
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import quote, urlsplit
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import data_loader
+from workload import sample_quotes
+
+# Доли запросов в смеси: в основном расчеты и подбор уровней, документы - реже
+DEFAULT_MIX = {"main_page": 5, "levels": 25, "promotions": 15, "calculate": 50, "download_offer": 5}
+
+# ================================================================
+# ФОРМЫ ЗАПРОСОВ ИЗ РЕАЛЬНОГО ПРАЙСА
+# ================================================================
+
+def build_request_shapes(rng: random.Random, count: int = 2000):
+    """Готовит наборы запросов каждого вида по данным data_export/."""
+    prices, promotions, _ = data_loader.load_tables(ROOT / "data_export")
+    if prices is None:
+        sys.exit("!!! Прайс-лист не загружен - нагрузочный тест невозможен.")
+    promotion_ids = sorted({promotion.order for promotion in promotions if promotion.order is not None})
+    quotes = sample_quotes(prices, rng, count)
+    for quote_body in quotes:
+        if promotion_ids and rng.random() < 0.3:
+            quote_body["promotion_id"] = rng.choice(promotion_ids)
+
+    services = sorted(prices.distinct('Сервис'))
+    return {
+        "main_page": [("GET", "/", None)],
+        "levels": [("GET", f"/get_levels_for_service/{quote(service, safe='')}", None) for service in services],
+        "promotions": [
+            ("POST", "/get_all_promotions_for_selection", {"service": q["service"], "levels": [l["level"] for l in q["levels"]]})
+            for q in quotes
+        ],
+        "calculate": [("POST", "/calculate", q) for q in quotes],
+        "download_offer": [("POST", "/download_offer", q) for q in quotes[:200]],
+    }
+
+# ================================================================
+# ЛОКАЛЬНЫЙ СЕРВЕР
+# ================================================================
+
+def fly_profile():
+    """hard_limit и число CPU из fly.toml (если файла нет - 25 соединений и 1 CPU)."""
+    try:
+        with open(ROOT / "fly.toml", "rb") as f:
+            config = tomllib.load(f)
+    except (OSError, tomllib.TOMLDecodeError):
+        config = {}
+    hard_limit = config.get("http_service", {}).get("concurrency", {}).get("hard_limit", 25)
+    cpus = (config.get("vm") or [{}])[0].get("cpus", 1)
+    return int(hard_limit), int(cpus)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_local_server(limit_concurrency: int, cpus: int, workers: int = 1):
+    port = _free_port()
+    command = [
+        sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+        "--limit-concurrency", str(limit_concurrency), "--log-level", "warning",
+    ]
+    if workers > 1:
+        # Лимит соединений fly.toml - на всю машину, делим его между воркерами
+        command = [
+            sys.executable, "serve.py", "--workers", str(workers), "--host", "127.0.0.1", "--port", str(port),
+            "--limit-concurrency", str(max(1, limit_concurrency // workers)), "--log-level", "warning",
+        ]
+    if shutil.which("taskset") and cpus:
+        command = ["taskset", "-c", ",".join(str(cpu) for cpu in range(cpus))] + command
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"!!! Сервер завершился при запуске (код {process.returncode}).")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            connection.request("GET", "/get_levels_for_service/warmup")
+            if connection.getresponse().status < 500:
+                return process, url
+        except OSError:
+            time.sleep(0.3)
+    process.kill()
+    sys.exit("!!! Сервер не запустился за 60 с.")
+
+# ================================================================
+# ПРОГОН
+# ================================================================
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    # Ближайший ранг: наименьшее значение, не меньше которого доля fraction выборки
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def run_level(url: str, shapes, mix, concurrency: int, duration: float, seed: int):
+    """Замкнутый цикл: concurrency потоков шлют запросы без пауз в течение duration секунд."""
+    target = urlsplit(url)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    samples = []  # (вид, статус, секунды)
+    samples_lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def worker(worker_number: int):
+        rng = random.Random(seed + worker_number)
+        connection = http.client.HTTPConnection(target.hostname, target.port, timeout=60)
+        local_samples = []
+        while time.monotonic() < stop_at:
+            kind = rng.choices(kinds, weights)[0]
+            method, path, body = rng.choice(shapes[kind])
+            payload = json.dumps(body, ensure_ascii=False).encode("utf-8") if body is not None else None
+            headers = {"Content-Type": "application/json"} if payload is not None else {}
+            started = time.perf_counter()
+            for attempt in range(2):
+                try:
+                    connection.request(method, path, body=payload, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    status = response.status
+                    if response.getheader("connection", "").lower() == "close":
+                        connection.close()
+                    break
+                except (OSError, http.client.HTTPException):
+                    # Сервер мог закрыть keep-alive соединение (например, после 500) - один повтор на новом
+                    status = 0
+                    connection.close()
+                    connection = http.client.HTTPConnection(target.hostname, target.port, timeout=60)
+            local_samples.append((kind, status, time.perf_counter() - started))
+        connection.close()
+        with samples_lock:
+            samples.extend(local_samples)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(concurrency)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    elapsed = time.perf_counter() - started
+    return summarize(samples, concurrency, elapsed)
+
+
+def summarize(samples, concurrency, elapsed):
+    def stats(selected):
+        latencies = sorted(seconds for _, status, seconds in selected if 200 <= status < 400)
+        return {
+            "requests": len(selected), "ok": len(latencies), "errors": len(selected) - len(latencies),
+            "throughput_rps": round(len(latencies) / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        }
+    by_kind = {}
+    for sample in samples:
+        by_kind.setdefault(sample[0], []).append(sample)
+    status_counts = {}
+    for _, status, _ in samples:
+        status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+    return {
+        "concurrency": concurrency, "seconds": round(elapsed, 2), "total": stats(samples),
+        "statuses": status_counts, "endpoints": {kind: stats(selected) for kind, selected in sorted(by_kind.items())},
+    }
+
+
+def print_level(result):
+    total = result["total"]
+    print(
+        f"  параллельность {result['concurrency']:>4}: {total['throughput_rps']:>8.1f} запр/с  "
+        f"p50 {total['p50_ms']:>8.1f} мс  p95 {total['p95_ms']:>8.1f} мс  p99 {total['p99_ms']:>8.1f} мс  "
+        f"ошибок {total['errors']} {result['statuses']}"
+    )
+    for kind, stats in result["endpoints"].items():
+        print(f"      {kind:<16} {stats['throughput_rps']:>8.1f} запр/с  p50 {stats['p50_ms']:>8.1f}  p95 {stats['p95_ms']:>8.1f}  p99 {stats['p99_ms']:>8.1f}  ошибок {stats['errors']}")
+
+
+def main_cli():
+    hard_limit, cpus = fly_profile()
+    parser = argparse.ArgumentParser(description="Нагрузочный тест калькулятора тарифов")
+    parser.add_argument("--url", help="адрес уже запущенного сервера (иначе поднимается локальный)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 5, 10, 25, 50])
+    parser.add_argument("--duration", type=float, default=15.0, help="секунд на каждый уровень")
+    parser.add_argument("--limit-concurrency", type=int, default=hard_limit, help="--limit-concurrency для uvicorn (из fly.toml)")
+    parser.add_argument("--cpus", type=int, default=cpus, help="сколько CPU отдать серверу (taskset), 0 - без ограничения")
+    parser.add_argument("--workers", type=int, default=1, help="число воркеров (serve.py), 1 - один процесс uvicorn")
+    parser.add_argument("--mix", type=json.loads, default=DEFAULT_MIX, help='доли запросов, JSON: {"calculate": 50, ...}')
+    parser.add_argument("--seed", type=int, default=20250901)
+    parser.add_argument("--output", type=Path, help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    shapes = build_request_shapes(random.Random(args.seed))
+    mix = {kind: weight for kind, weight in args.mix.items() if weight > 0 and kind in shapes}
+    process = None
+    url = args.url
+    if url is None:
+        process, url = start_local_server(args.limit_concurrency, args.cpus, args.workers)
+        print(f"✓ Локальный сервер {url} (limit-concurrency {args.limit_concurrency}, CPU {args.cpus or 'все'}, воркеров {args.workers}).")
+    try:
+        results = []
+        for concurrency in args.concurrency:
+            result = run_level(url, shapes, mix, concurrency, args.duration, args.seed)
+            print_level(result)
+            results.append(result)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    if args.output:
+        report = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"), "url": url, "mix": mix,
+            "duration_seconds": args.duration, "limit_concurrency": args.limit_concurrency,
+            "cpus": args.cpus, "workers": args.workers, "cpu_count": os.cpu_count(), "levels": results,
+        }
+        args.output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"✓ Результаты сохранены в '{args.output}'.")
+
+
+if __name__ == "__main__":
+    main_cli()
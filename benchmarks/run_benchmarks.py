@@ -0,0 +1,322 @@
+# C:\excel-to-web\benchmarks\run_benchmarks.py
+#
+# Набор бенчмарков на реальных данных data_export/ (pricelist.xlsx, promotions.xlsx)
+# и на синтетически увеличенных прайс-листах (x10, x100 - копии сервисов).
+# Результаты сохраняются в JSON, два прогона можно сравнить.
+#
+#   python benchmarks/run_benchmarks.py                     # масштабы 1, 10, 100
+#   python benchmarks/run_benchmarks.py --scales 1 10 --output before.json
+#   python benchmarks/run_benchmarks.py --compare before.json after.json
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime
+from pathlib import Path
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from importlib.metadata import PackageNotFoundError, version as package_version
+
+from dateutil.relativedelta import relativedelta
+
+import data_loader
+import document_generator
+import logic
+import main
+from price_store import PriceTable, PromotionRecord, PromotionTable
+from workload import sample_quotes
+
+DATA_DIR = ROOT / "data_export"
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+SAMPLE_SIZE = 500
+SEED = 20250901
+
+# ================================================================
+# ДАННЫЕ ДЛЯ ПРОГОНА
+# ================================================================
+
+def scale_tables(prices: PriceTable, promotions: PromotionTable, factor: int):
+    """Увеличивает прайс и акции в factor раз копиями сервисов с другими названиями."""
+    if factor <= 1:
+        return prices, promotions
+    suffixes = [""] + [f" [копия {copy_number}]" for copy_number in range(1, factor)]
+    columns = {}
+    for column in prices.columns:
+        if column == 'Сервис':
+            columns[column] = tuple(
+                sys.intern(service + suffix) if service is not None else None for suffix in suffixes for service in prices[column]
+            )
+        else:
+            columns[column] = prices[column] * factor
+    scaled_promotions = [
+        PromotionRecord(
+            promotion.service + suffix if promotion.service is not None else None, promotion.level, promotion.order,
+            promotion.months, promotion.discount, promotion.condition2,
+        )
+        for suffix in suffixes for promotion in promotions
+    ]
+    return PriceTable(columns, len(prices) * factor), PromotionTable(scaled_promotions, promotions.columns)
+
+
+def promotions_today(prices: PriceTable) -> datetime:
+    """"Сегодня" для прогона: месяц до самого позднего периода, чтобы акции были применимы."""
+    latest = max(main.parse_period_string(period) for period in prices.distinct('Период'))
+    return latest - relativedelta(months=1) + relativedelta(days=14)
+
+
+def sample_promotion_quotes(state: main.PricingData, period: str, rng: random.Random):
+    """Расчеты, для которых действительно находится акция (по каталогу акций)."""
+    services = {service.lower(): service for service in state.prices.distinct('Сервис')}
+    candidates = []
+    for (service_lower, promotion_id, months), entries in state.promotion_catalogue.items():
+        if service_lower not in services: continue
+        for entry in entries:
+            candidates.append((services[service_lower], promotion_id, int(months), entry["applicable_levels"]))
+    quotes = []
+    for service, promotion_id, months, levels in rng.sample(candidates, min(len(candidates), SAMPLE_SIZE * 4)):
+        data = main.CalculationInput(
+            period=period, service=service, promotion_id=promotion_id, prepayment_months=months,
+            levels=[{"level": level, "accounts": rng.randint(1, 5)} for level in levels],
+        )
+        promotion_info = main.find_applicable_promotion(data, state.promotion_catalogue)
+        if promotion_info and logic.find_price_tiers(data.dict(), None, state.price_index):
+            quotes.append((data, promotion_info))
+        if len(quotes) == SAMPLE_SIZE: break
+    return quotes
+
+# ================================================================
+# ИЗМЕРЕНИЯ
+# ================================================================
+
+def measure(name, scale, fn, items, repeat=5):
+    """Прогоняет fn по всем items repeat раз; время на одну операцию - медиана и лучший прогон."""
+    for item in items[:10]:  # прогрев
+        fn(item)
+    per_op = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for item in items:
+            fn(item)
+        per_op.append((time.perf_counter() - started) / len(items))
+    result = {
+        "name": name, "scale": scale, "ops": len(items), "repeat": repeat,
+        "median_us": statistics.median(per_op) * 1e6, "best_us": min(per_op) * 1e6,
+        "ops_per_sec": 1 / statistics.median(per_op),
+    }
+    print(f"  {name:<48} x{scale:<4} {result['median_us']:>12.1f} мкс  {result['ops_per_sec']:>12.1f} оп/с")
+    return result
+
+
+def bench_scale(scale, prices, promotions, quick):
+    results = []
+    rng = random.Random(SEED)
+    scaled_prices, scaled_promotions = scale_tables(prices, promotions, scale)
+    print(f"--- Масштаб x{scale}: строк прайса {len(scaled_prices)}, акций {len(scaled_promotions)}")
+
+    results.append(measure(
+        "build_pricing_data (индексы)", scale,
+        lambda _: main.build_pricing_data(scaled_prices, scaled_promotions, version=1, source="benchmark"),
+        [None], repeat=1 if quick else 3,
+    ))
+    state = main.build_pricing_data(scaled_prices, scaled_promotions, version=1, source="benchmark")
+
+    today = promotions_today(prices)
+    promo_period = logic_period(today + relativedelta(months=1))
+    plain_quotes = sample_quotes(prices, rng, SAMPLE_SIZE)
+    if quick: plain_quotes = plain_quotes[:100]
+
+    results.append(measure("find_price_tiers", scale, lambda q: logic.find_price_tiers(q, None, state.price_index), plain_quotes))
+    results.append(measure(
+        "run_calculation (без акции)", scale,
+        lambda q: logic.run_calculation(q, state.prices, price_index=state.price_index), plain_quotes,
+    ))
+
+    with mock.patch.object(main, "datetime", _fixed_datetime(today)):
+        promo_quotes = sample_promotion_quotes(state, promo_period, rng)
+        if quick: promo_quotes = promo_quotes[:100]
+        if promo_quotes:
+            results.append(measure(
+                "run_calculation (с акцией)", scale,
+                lambda item: logic.run_calculation(item[0].dict(), state.prices, promotion_info=item[1], price_index=state.price_index),
+                promo_quotes,
+            ))
+            results.append(measure(
+                "find_applicable_promotion", scale,
+                lambda item: main.find_applicable_promotion(item[0], state.promotion_catalogue), promo_quotes,
+            ))
+
+    selection_requests = [
+        main.PromotionAllRequest(service=service, levels=sorted(levels))
+        for service, levels in rng.sample(sorted(state.promotion_selection_map, key=str), min(len(state.promotion_selection_map), SAMPLE_SIZE))
+    ]
+    selection_requests += [main.PromotionAllRequest(service=q["service"], levels=[l["level"] for l in q["levels"]]) for q in plain_quotes[:100]]
+    loop = asyncio.new_event_loop()
+    with mock.patch.object(main, "current_data", state):
+        results.append(measure(
+            "get_all_promotions_for_selection", scale,
+            lambda request: loop.run_until_complete(main.get_all_promotions_for_selection(request)), selection_requests,
+        ))
+    loop.close()
+
+    # Холодный старт из снимка на увеличенных данных
+    with tempfile.TemporaryDirectory() as snapshot_root:
+        with mock.patch.dict(os.environ, {"DATA_SNAPSHOT_DIR": snapshot_root}):
+            data_loader.save_snapshot(DATA_DIR, "benchmark", scaled_prices, scaled_promotions)
+            def cold_start_from_snapshot(_):
+                tables = data_loader.load_snapshot(DATA_DIR, "benchmark")
+                return main.build_pricing_data(tables[0], tables[1], version=1, source="snapshot")
+            results.append(measure("load_data (снимок + индексы)", scale, cold_start_from_snapshot, [None], repeat=1 if quick else 3))
+    return results
+
+
+def bench_real_data_only(quick):
+    """Бенчмарки, не зависящие от масштаба прайса: старт из xlsx и формирование документа."""
+    results = []
+    print("--- Реальные данные")
+
+    def reload_from_xlsx(_):
+        with tempfile.TemporaryDirectory() as snapshot_root:
+            with mock.patch.dict(os.environ, {"DATA_SNAPSHOT_DIR": snapshot_root}):
+                main.reload_data()
+    def reload_from_snapshot(_):
+        main.reload_data()
+    with mock.patch.object(main, "DATA_DIR", DATA_DIR), mock.patch.object(main, "current_data", main.PricingData()):
+        results.append(measure("load_data (xlsx, холодный старт)", 1, reload_from_xlsx, [None], repeat=1 if quick else 3))
+        with tempfile.TemporaryDirectory() as snapshot_root:
+            with mock.patch.dict(os.environ, {"DATA_SNAPSHOT_DIR": snapshot_root}):
+                main.reload_data()
+                results.append(measure("load_data (снимок)", 1, reload_from_snapshot, [None], repeat=1 if quick else 3))
+        state = main.current_data
+
+    results.append(bench_worker_start(quick))
+
+    quote = sample_quotes(state.prices, random.Random(SEED), 1)[0]
+    context = dict(logic.run_calculation(quote, None, price_index=state.price_index)["calculation_context"])
+    context['current_date'] = "01.10.2025"
+    documents = [context] * (20 if quick else 100)
+    results.append(measure("create_offer_document", 1, document_generator.create_offer_document, documents, repeat=3))
+
+    def first_render(_):
+        with mock.patch.object(document_generator, "offer_template_cache", document_generator.OfferTemplateCache(document_generator.OFFER_TEMPLATE_PATH)):
+            document_generator.create_offer_document(context)
+    results.append(measure("create_offer_document (первый, без кэша)", 1, first_render, [None] * 5, repeat=3))
+    return results
+
+
+def bench_worker_start(quick):
+    """
+    Старт рабочего процесса: новый интерпретатор, import main и загрузка данных из снимка.
+    Кроме времени записывает пиковую память процесса и импортирован ли pandas.
+    Пик берется из VmHWM (/proc/self/status): ru_maxrss в Linux наследует пик
+    родителя через fork+exec и показал бы память самого бенчмарка.
+    """
+    script = (
+        "import resource, sys, main; main.reload_data(); "
+        "status = open('/proc/self/status').read() if sys.platform.startswith('linux') else ''; "
+        "hwm = [line.split()[1] for line in status.splitlines() if line.startswith('VmHWM:')]; "
+        "print(hwm[0] if hwm else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, 'pandas' in sys.modules)"
+    )
+    data_loader.load_tables(DATA_DIR)  # снимок должен быть готов до замеров
+    timings, peak_rss_kb, pandas_loaded = [], 0, False
+    for _ in range(2 if quick else 5):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+        timings.append(time.perf_counter() - started)
+        rss_kb, pandas_flag = output.strip().splitlines()[-1].split()
+        peak_rss_kb, pandas_loaded = max(peak_rss_kb, int(rss_kb)), pandas_flag == "True"
+    result = {
+        "name": "worker_start (import main + снимок)", "scale": 1, "ops": 1, "repeat": len(timings),
+        "median_us": statistics.median(timings) * 1e6, "best_us": min(timings) * 1e6,
+        "ops_per_sec": 1 / statistics.median(timings),
+        "max_rss_mb": round(peak_rss_kb / 1024, 1), "pandas_imported": pandas_loaded,
+    }
+    print(f"  {result['name']:<48} x1    {result['median_us']:>12.1f} мкс  пик памяти {result['max_rss_mb']} МБ, pandas: {pandas_loaded}")
+    return result
+
+
+def logic_period(moment: datetime) -> str:
+    return f"{data_loader.RU_MONTHS_MAP[moment.month]}.{moment.year % 100:02d}"
+
+
+def _fixed_datetime(today: datetime):
+    class FixedDateTime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return today
+    return FixedDateTime
+
+# ================================================================
+# ОТЧЕТ
+# ================================================================
+
+def environment_info():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"), "commit": commit,
+        "python": platform.python_version(), "pandas": _installed_version("pandas"), "numpy": _installed_version("numpy"),
+        "platform": platform.platform(), "cpu_count": os.cpu_count(),
+    }
+
+
+def _installed_version(package: str) -> str:
+    try:
+        return package_version(package)
+    except PackageNotFoundError:
+        return ""
+
+
+def compare(old_path: Path, new_path: Path) -> None:
+    old = {(r["name"], r["scale"]): r for r in json.loads(old_path.read_text(encoding="utf-8"))["results"]}
+    new = json.loads(new_path.read_text(encoding="utf-8"))["results"]
+    print(f"{'бенчмарк':<48} {'масштаб':>7} {'было, мкс':>12} {'стало, мкс':>12} {'ускорение':>10}")
+    for result in new:
+        before = old.get((result["name"], result["scale"]))
+        if before is None: continue
+        speedup = before["median_us"] / result["median_us"] if result["median_us"] else float("inf")
+        print(f"{result['name']:<48} {'x' + str(result['scale']):>7} {before['median_us']:>12.1f} {result['median_us']:>12.1f} {speedup:>9.2f}x")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Бенчмарки калькулятора тарифов")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--quick", action="store_true", help="меньше операций и повторов (для быстрой проверки)")
+    parser.add_argument("--output", type=Path, help="куда сохранить JSON (по умолчанию benchmarks/results/)")
+    parser.add_argument("--compare", type=Path, nargs=2, metavar=("OLD", "NEW"), help="сравнить два сохраненных прогона")
+    args = parser.parse_args()
+    # CalculationInput.dict() (как в main.py) дает DeprecationWarning в pydantic 2 - не засоряем отчет
+    warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    prices, promotions, _ = data_loader.load_tables(DATA_DIR)
+    if prices is None:
+        sys.exit("!!! Прайс-лист не загружен - бенчмарки невозможны.")
+    results = bench_real_data_only(args.quick)
+    for scale in args.scales:
+        results.extend(bench_scale(scale, prices, promotions, args.quick))
+
+    output = args.output or RESULTS_DIR / f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({"environment": environment_info(), "results": results}, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"✓ Результаты сохранены в '{output}'.")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,41 @@
+# C:\excel-to-web\benchmarks\workload.py
+#
+# Общие для бенчмарков и нагрузочного теста формы запросов по реальному прайсу.
+
+import random
+from typing import Any, Dict, List
+
+from price_store import PriceTable
+
+
+def sample_quotes(prices: PriceTable, rng: random.Random, count: int) -> List[Dict[str, Any]]:
+    """
+    Случайные расчеты, для которых в прайсе есть цены: число аккаунтов берется
+    из реальных ступеней уровня, иногда - больше максимальной (берется верхняя ступень).
+    """
+    accounts_by_key = {}
+    for service, period, level, accounts in zip(prices['Сервис'], prices['Период'], prices['Уровень'], prices['Аккаунтов']):
+        if service is None or period is None or level is None: continue
+        accounts_by_key.setdefault((service, period, level), set()).add(int(accounts))
+    tiers = {key: sorted(accounts) for key, accounts in sorted(accounts_by_key.items())}
+    levels_by_service = {}
+    for service, period, level in tiers:
+        levels_by_service.setdefault((service, period), []).append(level)
+    keys = sorted(levels_by_service)
+
+    quotes = []
+    for _ in range(count):
+        service, period = rng.choice(keys)
+        levels = sorted(levels_by_service[(service, period)])
+        chosen = rng.sample(levels, min(len(levels), rng.randint(1, 3)))
+        level_inputs = []
+        for level in chosen:
+            level_tiers = tiers[(service, period, level)]
+            accounts = level_tiers[-1] + rng.randint(1, 3) if rng.random() < 0.1 else rng.choice(level_tiers)
+            level_inputs.append({"level": level, "accounts": accounts})
+        quotes.append({
+            "period": period, "service": service, "levels": level_inputs,
+            "prepayment_months": rng.randint(1, 12), "discount_percent": rng.choice([0.0, 0.0, 5.0, 10.0, 12.5]),
+            "fixation_months": rng.choice([0, 0, 3, 6, 12]),
+        })
+    return quotes
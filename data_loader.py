@@ -0,0 +1,174 @@
+# C:\excel-to-web\data_loader.py
+
+import hashlib
+import os
+import pickle
+import sys
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Tuple
+
+from price_store import PriceTable, PromotionTable
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# ================================================================
+# ЧТЕНИЕ И НОРМАЛИЗАЦИЯ ИСХОДНЫХ ФАЙЛОВ
+# ================================================================
+# pandas импортируется только здесь и только при разборе xlsx: рабочий
+# процесс получает готовые PriceTable/PromotionTable из снимка.
+
+PRICELIST_FILENAME = "pricelist.xlsx"
+PROMOTIONS_FILENAME = "promotions.xlsx"
+
+RU_MONTHS_MAP = { 1: 'янв', 2: 'фев', 3: 'мар', 4: 'апр', 5: 'май', 6: 'июн', 7: 'июл', 8: 'авг', 9: 'сен', 10: 'окт', 11: 'ноя', 12: 'дек' }
+
+def read_pricelist(filepath: Path) -> "pd.DataFrame":
+    """Читает pricelist.xlsx и приводит столбцы к виду, который ждет logic.py ("окт.25" и т.д.)."""
+    import pandas as pd
+    string_columns = { 'Сервис': str, 'Уровень': str, 'Минут': str }
+    df_prices = pd.read_excel(filepath, dtype=string_columns)
+    df_prices.dropna(axis=1, how='all', inplace=True)
+    df_prices.dropna(axis=0, how='all', inplace=True)
+    df_prices.columns = df_prices.columns.str.strip()
+    for col in ['Сервис', 'Уровень']:
+        if col in df_prices.columns: df_prices[col] = df_prices[col].str.strip()
+    if 'Период' in df_prices.columns:
+        df_prices['Период'] = pd.to_datetime(df_prices['Период'], errors='coerce')
+        df_prices.dropna(subset=['Период'], inplace=True)
+        # "окт.25": месяц по-русски + две последние цифры года (векторно, без apply)
+        periods = df_prices['Период'].dt
+        df_prices['Период'] = periods.month.map(RU_MONTHS_MAP) + '.' + (periods.year % 100).astype(str).str.zfill(2)
+    if 'Аккаунтов' in df_prices.columns:
+        df_prices['Аккаунтов'] = pd.to_numeric(df_prices['Аккаунтов'], errors='coerce').fillna(0).astype(int)
+    if 'Минут' in df_prices.columns:
+        df_prices['Минут'] = df_prices['Минут'].astype(str).str.replace(r'\.0$', '', regex=True)
+    return df_prices
+
+def read_promotions(filepath: Path) -> "pd.DataFrame":
+    """Читает promotions.xlsx и нормализует текстовые и числовые столбцы."""
+    import pandas as pd
+    df_promotions = pd.read_excel(filepath)
+    df_promotions.columns = df_promotions.columns.str.strip()
+    for col in ['ТП', 'Уровень', 'Приказ', 'Условие2']:
+        if col in df_promotions.columns: df_promotions[col] = df_promotions[col].astype(str).str.strip()
+    if 'Условие1' in df_promotions.columns: df_promotions['Условие1'] = pd.to_numeric(df_promotions['Условие1'], errors='coerce').fillna(0.0)
+    if 'Месяцев' in df_promotions.columns: df_promotions['Месяцев'] = pd.to_numeric(df_promotions['Месяцев'], errors='coerce').fillna(0).astype(int)
+    return df_promotions
+
+def price_table_from_frame(df_prices: "pd.DataFrame") -> PriceTable:
+    return PriceTable.from_records(df_prices.to_dict('records'), columns=list(df_prices.columns))
+
+def promotion_table_from_frame(df_promotions: "pd.DataFrame") -> PromotionTable:
+    return PromotionTable.from_records(df_promotions.to_dict('records'), columns=list(df_promotions.columns))
+
+# ================================================================
+# СНИМОК ДАННЫХ ДЛЯ БЫСТРОГО СТАРТА
+# ================================================================
+# Разбор xlsx через openpyxl - самая долгая часть старта. Готовые
+# PriceTable/PromotionTable сохраняются в pickle-снимок, ключ которого - хэши
+# исходных файлов плюс версия формата. Пока xlsx не меняются, старт читает
+# только снимок (без импорта pandas); любое изменение файла дает новый ключ и пересборку.
+
+SNAPSHOT_FORMAT_VERSION = 2
+SNAPSHOT_FILENAME = "data_snapshot.pkl"
+
+def _file_sha256(filepath: Path) -> str:
+    if not filepath.exists():
+        return "missing"
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def snapshot_dir(data_dir: Path) -> Path:
+    return Path(os.environ.get("DATA_SNAPSHOT_DIR", data_dir / ".snapshot"))
+
+def source_key(data_dir: Path) -> str:
+    """Ключ актуальности снимка: хэши xlsx + версия формата снимка."""
+    return "|".join([
+        f"v{SNAPSHOT_FORMAT_VERSION}",
+        _file_sha256(data_dir / PRICELIST_FILENAME), _file_sha256(data_dir / PROMOTIONS_FILENAME),
+    ])
+
+def load_snapshot(data_dir: Path, key: str) -> Optional[Tuple[PriceTable, PromotionTable]]:
+    """Возвращает (prices, promotions) из снимка, если он есть и соответствует ключу."""
+    snapshot_path = snapshot_dir(data_dir) / SNAPSHOT_FILENAME
+    try:
+        with open(snapshot_path, 'rb') as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"--- ПРЕДУПРЕЖДЕНИЕ: снимок данных '{snapshot_path}' поврежден и будет пересобран: {e}")
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get("key") != key:
+        return None
+    return snapshot["prices"], snapshot["promotions"]
+
+def save_snapshot(data_dir: Path, key: str, prices: PriceTable, promotions: PromotionTable) -> None:
+    """Атомарно записывает снимок (через временный файл); ошибки записи не мешают работе."""
+    target_dir = snapshot_dir(data_dir)
+    snapshot_path = target_dir / SNAPSHOT_FILENAME
+    try:
+        target_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = snapshot_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({"key": key, "prices": prices, "promotions": promotions}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, snapshot_path)
+    except OSError as e:
+        print(f"--- ПРЕДУПРЕЖДЕНИЕ: не удалось сохранить снимок данных '{snapshot_path}': {e}")
+
+def load_tables(data_dir: Path) -> Tuple[Optional[PriceTable], PromotionTable, str]:
+    """
+    Загружает прайс-лист и акции: из свежего снимка, а если его нет - из xlsx
+    (с пересборкой снимка). Возвращает (prices, promotions, источник).
+    Ошибки обрабатываются как раньше: нет прайса -> None, нет акций -> пустая PromotionTable.
+    """
+    key = source_key(data_dir)
+    snapshot = load_snapshot(data_dir, key)
+    if snapshot is not None:
+        prices, promotions = snapshot
+        print(f"✓ Прайс-лист и акции загружены из снимка '{snapshot_dir(data_dir) / SNAPSHOT_FILENAME}'.")
+        return prices, promotions, "snapshot"
+
+    # --- 1. Загрузка прайс-листа ---
+    filepath_prices = data_dir / PRICELIST_FILENAME
+    try:
+        prices = price_table_from_frame(read_pricelist(filepath_prices))
+        print(f"✓ Прайс-лист '{filepath_prices}' успешно загружен и обработан.")
+    except Exception as e:
+        print(f"!!! КРИТИЧЕСКАЯ ОШИБКА при чтении прайс-листа: {e}")
+        prices = None
+
+    # --- 2. Загрузка акций ---
+    filepath_promos = data_dir / PROMOTIONS_FILENAME
+    promotions_ok = True
+    try:
+        promotions = promotion_table_from_frame(read_promotions(filepath_promos))
+        print(f"✓ Акции из файла '{filepath_promos}' успешно загружены.")
+    except FileNotFoundError:
+        print(f"--- ПРЕДУПРЕЖДЕНИЕ: Файл с акциями '{filepath_promos}' не найден. Акции не будут доступны.")
+        promotions = PromotionTable()
+    except Exception as e:
+        print(f"!!! КРИТИЧЕСКАЯ ОШИБКА при чтении файла акций: {e}")
+        promotions = PromotionTable()
+        promotions_ok = False
+
+    # Снимок сохраняем только для успешно прочитанных данных
+    if prices is not None and promotions_ok:
+        save_snapshot(data_dir, key, prices, promotions)
+    return prices, promotions, "xlsx"
+
+
+if __name__ == "__main__":
+    # Предварительная сборка снимка (например, при сборке Docker-образа):
+    #   python data_loader.py [путь к data_export]
+    target = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).resolve().parent / "data_export"
+    started = time.perf_counter()
+    prices, _, source = load_tables(target)
+    if prices is None:
+        sys.exit(1)
+    print(f"✓ Снимок данных готов ({source}, {time.perf_counter() - started:.3f} с).")
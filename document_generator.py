@@ -1,8 +1,162 @@
 # document_generator.py
 
 from docxtpl import DocxTemplate
-from typing import Dict, Any
+from jinja2 import Environment, Template
+from pathlib import Path
+from typing import Dict, Any, Optional
 import io
+import os
+import re
+import threading
+
+OFFER_TEMPLATE_PATH = Path(__file__).resolve().parent / "templates_docx" / "offer_template.docx"
+
+# ================================================================
+# КЭШ РАЗОБРАННОГО ШАБЛОНА
+# ================================================================
+# DocxTemplate на каждый вызов заново распаковывает .docx, чистит XML под jinja
+# (patch_xml) и компилирует jinja-шаблоны - это почти все время генерации.
+# Здесь это делается один раз на файл шаблона (повторно - при смене mtime/размера):
+# скомпилированные шаблоны тела, колонтитулов, сносок и свойств документа
+# хранятся в кэше, а документ python-docx разбирается один раз на поток.
+# При каждом рендере все шаблонные части документа заменяются целиком из
+# скомпилированных шаблонов, поэтому предыдущий рендер не влияет на следующий.
+
+# Подготовленный шаблон опирается на внутренние методы и атрибуты DocxTemplate
+# (проверено с docxtpl 0.20.2, версия закреплена в requirements.txt). Если в
+# установленной версии чего-то из этого нет, используется обычный рендер DocxTemplate.
+_DOCXTPL_INTERNALS = (
+    "init_docx", "get_xml", "get_part_xml", "get_headers_footers", "get_headers_footers_encoding",
+    "HEADER_URI", "FOOTER_URI", "patch_xml", "resolve_listing", "fix_tables", "fix_docpr_ids",
+    "map_tree", "map_headers_footers_xml", "reset_replacements", "save",
+)
+_DOCXTPL_INSTANCE_ATTRIBUTES = ("docx", "is_rendered", "is_saved")
+
+_FOOTNOTES_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.footnotes+xml"
+
+def _compile_part(src_xml: str) -> Template:
+    # Та же подготовка, что в DocxTemplate.render_xml_part, но без компиляции на каждый вызов
+    return Template(re.sub(r"<w:p([ >])", r"\n<w:p\1", src_xml))
+
+
+class _PreparedOfferTemplate(DocxTemplate):
+    """DocxTemplate с заранее скомпилированными jinja-шаблонами всех частей документа."""
+
+    def __init__(self, template_bytes: bytes) -> None:
+        missing = [name for name in _DOCXTPL_INTERNALS if not hasattr(DocxTemplate, name)]
+        super().__init__(io.BytesIO(template_bytes))
+        missing += [name for name in _DOCXTPL_INSTANCE_ATTRIBUTES if not hasattr(self, name)]
+        if missing:
+            raise AttributeError(f"в DocxTemplate нет {', '.join(missing)}")
+        self.init_docx()
+        self.body_template = _compile_part(self.patch_xml(self.get_xml()))
+        self.header_templates = self._compile_headers_footers(self.HEADER_URI)
+        self.footer_templates = self._compile_headers_footers(self.FOOTER_URI)
+        self.footnote_templates = [
+            (part, _compile_part(self.patch_xml(part.blob.decode("utf-8") if isinstance(part.blob, bytes) else part.blob)))
+            for part in self.docx.part.package.parts if part.content_type == _FOOTNOTES_CONTENT_TYPE
+        ]
+        properties_env = Environment()
+        self.property_templates = {
+            prop: properties_env.from_string(getattr(self.docx.core_properties, prop))
+            for prop in ("author", "comments", "identifier", "language", "subject", "title")
+        }
+
+    def _compile_headers_footers(self, uri):
+        compiled = []
+        for rel_key, part in self.get_headers_footers(uri):
+            xml = self.get_part_xml(part)
+            compiled.append((rel_key, self.get_headers_footers_encoding(xml), _compile_part(self.patch_xml(xml))))
+        return compiled
+
+    def _render_compiled(self, template: Template, part, context: Dict[str, Any]) -> str:
+        # Повторяет постобработку DocxTemplate.render_xml_part
+        self.current_rendering_part = part
+        dst_xml = re.sub(r"\n<w:p([ >])", r"<w:p\1", template.render(context))
+        dst_xml = dst_xml.replace("{_{", "{{").replace("}_}", "}}").replace("{_%", "{%").replace("%_}", "%}")
+        return self.resolve_listing(dst_xml)
+
+    def render_to(self, context: Dict[str, Any], stream) -> None:
+        """Рендерит документ по контексту и записывает его сразу в stream."""
+        self.pic_map = {}
+        self.docx_ids_index = 1000
+        self.is_saved = False
+        self.reset_replacements()
+
+        tree = self.fix_tables(self._render_compiled(self.body_template, self.docx._part, context))
+        self.fix_docpr_ids(tree)
+        self.map_tree(tree)
+        for rel_key, encoding, template in self.header_templates + self.footer_templates:
+            part = self.docx._part.rels[rel_key].target_part
+            self.map_headers_footers_xml(rel_key, self._render_compiled(template, part, context).encode(encoding))
+        for prop, template in self.property_templates.items():
+            setattr(self.docx.core_properties, prop, template.render(context))
+        for part, template in self.footnote_templates:
+            part._blob = self._render_compiled(template, part, context).encode("utf-8")
+
+        self.is_rendered = True
+        self.save(stream)
+
+
+class _PlainOfferTemplate:
+    """Обычный рендер DocxTemplate на каждый вызов - запасной вариант для несовместимой версии docxtpl."""
+
+    def __init__(self, template_bytes: bytes) -> None:
+        self.template_bytes = template_bytes
+
+    def render_to(self, context: Dict[str, Any], stream) -> None:
+        doc = DocxTemplate(io.BytesIO(self.template_bytes))
+        doc.render(context)
+        doc.save(stream)
+
+
+def _prepare_template(template_bytes: bytes):
+    try:
+        return _PreparedOfferTemplate(template_bytes)
+    except AttributeError as e:
+        print(f"--- ПРЕДУПРЕЖДЕНИЕ: кэш шаблона КП несовместим с установленной версией docxtpl ({e}), используется обычный рендер.")
+        return _PlainOfferTemplate(template_bytes)
+
+
+class OfferTemplateCache:
+    """
+    Кэш шаблона КП: исходные байты и скомпилированные части читаются один раз
+    и перечитываются, если у файла изменились mtime или размер.
+    """
+
+    def __init__(self, template_path: Path):
+        self.template_path = Path(template_path)
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._template_bytes: Optional[bytes] = None
+        self._local = threading.local()
+        self.loads = 0
+
+    def _current_bytes(self):
+        stat = os.stat(self.template_path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if stamp != self._stamp:
+                with open(self.template_path, "rb") as f:
+                    self._template_bytes = f.read()
+                self._stamp = stamp
+                self.loads += 1
+            return self._stamp, self._template_bytes
+
+    def get(self):
+        """Возвращает подготовленный шаблон текущего потока (актуальный по mtime файла)."""
+        stamp, template_bytes = self._current_bytes()
+        prepared = getattr(self._local, "prepared", None)
+        if prepared is None or prepared[0] != stamp:
+            prepared = (stamp, _prepare_template(template_bytes))
+            self._local.prepared = prepared
+        return prepared[1]
+
+offer_template_cache = OfferTemplateCache(OFFER_TEMPLATE_PATH)
+
+# ================================================================
+# ГЕНЕРАЦИЯ ДОКУМЕНТА
+# ================================================================
 
 def create_offer_document(context: Dict[str, Any]) -> io.BytesIO:
     """
@@ -15,18 +169,26 @@ def create_offer_document(context: Dict[str, Any]) -> io.BytesIO:
         Объект io.BytesIO, содержащий сгенерированный документ в памяти.
     """
     try:
-        # Убедись, что у тебя есть папка templates_docx и в ней лежит твой шаблон
-        # Если твой файл называется offer_template.dotx, то все верно
-        doc = DocxTemplate("templates_docx/offer_template.docx")
-
-        doc.render(context)
-
         file_stream = io.BytesIO()
-        doc.save(file_stream)
+        offer_template_cache.get().render_to(context, file_stream)
         file_stream.seek(0)
-        
+
         return file_stream
 
     except Exception as e:
         print(f"!!! ОШИБКА при генерации DOCX: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def render_offer_bytes(context: Dict[str, Any]) -> Optional[bytes]:
+    """
+    То же, что create_offer_document, но возвращает готовые байты документа.
+    Используется в пуле воркеров: результат должен передаваться между процессами.
+    """
+    file_stream = create_offer_document(context)
+    return file_stream.getvalue() if file_stream is not None else None
+
+
+def warm_up() -> bool:
+    """Прогрев воркера пула: разбор и компиляция шаблона до первого запроса."""
+    offer_template_cache.get()
+    return True
@@ -0,0 +1,1171 @@
+# C:\excel-to-web\formula_engine.py
+
+import math
+import re
+import threading
+from datetime import date, datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from dateutil.relativedelta import relativedelta
+
+# ================================================================
+# ДВИЖОК ФОРМУЛ EXCEL: РАЗБОР, КОМПИЛЯЦИЯ, ГРАФ ЗАВИСИМОСТЕЙ
+# ================================================================
+# Формулы листов calc.xlsm (formulas_map.txt) разбираются один раз в дерево,
+# дерево компилируется в замыкание Python, а ссылки формулы дают ребра графа
+# зависимостей между ячейками. CompiledWorkbook - неизменяемая часть (формулы,
+# константы, граф, топологический порядок), WorkbookState - значения для одного
+# набора входных данных: после set_inputs грязными становятся только ячейки ниже
+# по графу, и пересчитываются только они (и только по запросу).
+#
+# Значения ячеек: None (пусто), float/int, str, bool, CellError. Даты хранятся,
+# как в Excel, серийными числами (дни от 30.12.1899).
+
+CellKey = Tuple[str, int, int]  # (лист, строка, столбец), нумерация с 1
+RangeKey = Tuple[str, int, int, int, int]  # (лист, строка1, столбец1, строка2, столбец2)
+
+
+class CellError:
+    """Значение-ошибка Excel (#N/A, #VALUE!, ...)."""
+    __slots__ = ('code',)
+
+    def __init__(self, code: str):
+        self.code = code
+
+    def __eq__(self, other):
+        return isinstance(other, CellError) and other.code == self.code
+
+    def __hash__(self):
+        return hash(self.code)
+
+    def __repr__(self):
+        return self.code
+
+    def __reduce__(self):
+        return (CellError, (self.code,))
+
+
+ERROR_NA = CellError('#N/A')
+ERROR_VALUE = CellError('#VALUE!')
+ERROR_REF = CellError('#REF!')
+ERROR_NAME = CellError('#NAME?')
+ERROR_DIV0 = CellError('#DIV/0!')
+ERROR_NUM = CellError('#NUM!')
+ERROR_CODES = ('#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!', '#N/A')
+
+
+class FormulaSyntaxError(ValueError):
+    pass
+
+
+class _ErrorSignal(Exception):
+    """Ошибка в аргументе: прерывает вычисление формулы до IFERROR или до ячейки."""
+    def __init__(self, error: CellError):
+        self.error = error
+
+
+# --- Адреса ---
+def column_index(letters: str) -> int:
+    index = 0
+    for char in letters.upper():
+        index = index * 26 + ord(char) - 64
+    return index
+
+
+def column_letters(index: int) -> str:
+    letters = ""
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+_CELL_RE = re.compile(r'\$?([A-Za-z]{1,3})\$?(\d+)')
+
+
+def parse_cell(address: str) -> Tuple[int, int]:
+    """'$E$7' -> (7, 5)."""
+    match = _CELL_RE.fullmatch(address.strip())
+    if not match:
+        raise ValueError(f"Некорректный адрес ячейки: {address}")
+    return int(match.group(2)), column_index(match.group(1))
+
+
+def cell_address(row: int, col: int) -> str:
+    return f"{column_letters(col)}{row}"
+
+
+# --- Даты (серийные номера Excel) ---
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+
+
+def to_serial(value: datetime) -> float:
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    delta = value - _EXCEL_EPOCH
+    serial = delta.days + delta.seconds / 86400
+    return int(serial) if serial == int(serial) else serial
+
+
+def from_serial(serial: float) -> datetime:
+    return _EXCEL_EPOCH + timedelta(days=float(serial))
+
+
+# ================================================================
+# РАЗБОР ФОРМУЛ
+# ================================================================
+
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<string>"(?:[^"]|"")*")
+  | (?P<error>\#(?:NULL!|DIV/0!|VALUE!|REF!|NAME\?|NUM!|N/A))
+  | (?P<sheet>(?:'(?:[^']|'')+'|[^\W\d][\w.]*)!)
+  | (?P<table>[^\W\d][\w.]*\[(?:[^\[\]]|\[[^\[\]]*\])*\])
+  | (?P<cell>\$?[A-Za-z]{1,3}\$?\d+(?![\w(\[]))
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<func>[^\W\d][\w.]*(?=\())
+  | (?P<name>[^\W\d][\w.]*)
+  | (?P<op><>|<=|>=|[-+*/^&=<>%:,()])
+""", re.VERBOSE)
+
+
+def _tokenize(text: str) -> List[Tuple[str, str]]:
+    tokens, position = [], 0
+    while position < len(text):
+        match = _TOKEN_RE.match(text, position)
+        if not match:
+            raise FormulaSyntaxError(f"Неожиданный символ '{text[position]}' в позиции {position}")
+        kind = match.lastgroup
+        if kind != 'ws':
+            tokens.append((kind, match.group()))
+        position = match.end()
+    return tokens
+
+
+_COMPARISON_OPS = ('=', '<>', '<', '>', '<=', '>=')
+
+
+class _Parser:
+    """
+    Рекурсивный спуск с приоритетами Excel: ':' > унарный минус > % > ^ > * / > + - > & > сравнения.
+    Узлы дерева - кортежи: ('num', x), ('str', s), ('bool', b), ('err', код), ('blank',),
+    ('ref', лист|None, адрес), ('range', ref, ref), ('name', имя), ('table', текст),
+    ('call', ФУНКЦИЯ, [аргументы]), ('neg', x), ('pct', x), ('bin', оператор, a, b).
+    """
+
+    def __init__(self, tokens: List[Tuple[str, str]]):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self) -> Tuple[Optional[str], Optional[str]]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self) -> Tuple[str, str]:
+        token = self.peek()
+        if token[0] is None:
+            raise FormulaSyntaxError("Неожиданный конец формулы")
+        self.position += 1
+        return token
+
+    def expect(self, value: str) -> None:
+        kind, text = self.take()
+        if kind != 'op' or text != value:
+            raise FormulaSyntaxError(f"Ожидалось '{value}', получено '{text}'")
+
+    def at_op(self, *values: str) -> bool:
+        kind, text = self.peek()
+        return kind == 'op' and text in values
+
+    def parse(self):
+        node = self.comparison()
+        if self.position != len(self.tokens):
+            raise FormulaSyntaxError(f"Лишний фрагмент '{self.peek()[1]}'")
+        return node
+
+    def _binary(self, operand, operators):
+        node = operand()
+        while self.at_op(*operators):
+            operator = self.take()[1]
+            node = ('bin', operator, node, operand())
+        return node
+
+    def comparison(self):
+        return self._binary(self.concat, _COMPARISON_OPS)
+
+    def concat(self):
+        return self._binary(self.additive, ('&',))
+
+    def additive(self):
+        return self._binary(self.term, ('+', '-'))
+
+    def term(self):
+        return self._binary(self.power, ('*', '/'))
+
+    def power(self):
+        return self._binary(self.unary, ('^',))
+
+    def unary(self):
+        if self.at_op('-'):
+            self.take()
+            return ('neg', self.unary())
+        if self.at_op('+'):
+            self.take()
+            return self.unary()
+        return self.postfix()
+
+    def postfix(self):
+        node = self.range()
+        while self.at_op('%'):
+            self.take()
+            node = ('pct', node)
+        return node
+
+    def range(self):
+        node = self.primary()
+        while self.at_op(':'):
+            self.take()
+            right = self.primary()
+            if node[0] != 'ref' or right[0] != 'ref':
+                raise FormulaSyntaxError("Диапазон поддерживается только между адресами ячеек")
+            node = ('range', node, right)
+        return node
+
+    def primary(self):
+        kind, text = self.take()
+        if kind == 'number':
+            return ('num', float(text))
+        if kind == 'string':
+            return ('str', text[1:-1].replace('""', '"'))
+        if kind == 'error':
+            return ('err', text)
+        if kind == 'cell':
+            return ('ref', None, text)
+        if kind == 'sheet':
+            sheet = text[:-1]
+            if sheet.startswith("'"):
+                sheet = sheet[1:-1].replace("''", "'")
+            cell_kind, cell_text = self.take()
+            if cell_kind != 'cell':
+                raise FormulaSyntaxError(f"После имени листа '{sheet}' ожидался адрес ячейки")
+            return ('ref', sheet, cell_text)
+        if kind == 'table':
+            return ('table', text)
+        if kind == 'func':
+            return self.call(text)
+        if kind == 'name':
+            if text.upper() in ('TRUE', 'FALSE'):
+                return ('bool', text.upper() == 'TRUE')
+            return ('name', text)
+        if kind == 'op' and text == '(':
+            node = self.comparison()
+            self.expect(')')
+            return node
+        raise FormulaSyntaxError(f"Неожиданный фрагмент '{text}'")
+
+    def call(self, name: str):
+        self.expect('(')
+        arguments = []
+        if self.at_op(')'):
+            self.take()
+        else:
+            while True:
+                if self.at_op(',', ')'):
+                    arguments.append(('blank',))
+                else:
+                    arguments.append(self.comparison())
+                if self.at_op(','):
+                    self.take()
+                    continue
+                self.expect(')')
+                break
+        function_name = name.upper()
+        for prefix in ('_XLFN.', '_XLWS.'):
+            if function_name.startswith(prefix):
+                function_name = function_name[len(prefix):]
+        return ('call', function_name, arguments)
+
+
+def parse_formula(text: str):
+    """Текст формулы ('=...') -> дерево разбора."""
+    if text.startswith('='):
+        text = text[1:]
+    return _Parser(_tokenize(text)).parse()
+
+
+# ================================================================
+# ПРИВЕДЕНИЕ ТИПОВ И СРАВНЕНИЕ ПО ПРАВИЛАМ EXCEL
+# ================================================================
+
+class RangeValue:
+    """Значение-диапазон: ячейки читаются из состояния только при обращении."""
+    __slots__ = ('state', 'sheet', 'row1', 'col1', 'row2', 'col2')
+
+    def __init__(self, state: "WorkbookState", sheet: str, row1: int, col1: int, row2: int, col2: int):
+        self.state, self.sheet = state, sheet
+        self.row1, self.col1, self.row2, self.col2 = row1, col1, row2, col2
+
+    @property
+    def height(self) -> int:
+        return self.row2 - self.row1 + 1
+
+    @property
+    def width(self) -> int:
+        return self.col2 - self.col1 + 1
+
+    def cell(self, row_offset: int, col_offset: int) -> Any:
+        return self.state.get((self.sheet, self.row1 + row_offset, self.col1 + col_offset))
+
+    def values(self) -> Iterator[Any]:
+        for row in range(self.row1, self.row2 + 1):
+            for col in range(self.col1, self.col2 + 1):
+                yield self.state.get((self.sheet, row, col))
+
+
+def _scalar(value: Any) -> Any:
+    if isinstance(value, RangeValue):
+        if value.height == 1 and value.width == 1:
+            return value.cell(0, 0)
+        raise _ErrorSignal(ERROR_VALUE)
+    return value
+
+
+def to_number(value: Any) -> float:
+    value = _scalar(value)
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    if value is None:
+        return 0
+    if isinstance(value, CellError):
+        raise _ErrorSignal(value)
+    try:
+        return float(str(value).strip().replace(',', '.').replace('\xa0', '').replace(' ', ''))
+    except ValueError:
+        raise _ErrorSignal(ERROR_VALUE)
+
+
+def to_text(value: Any) -> str:
+    value = _scalar(value)
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, CellError):
+        raise _ErrorSignal(value)
+    if isinstance(value, float):
+        if value == int(value) and abs(value) < 1e15:
+            return str(int(value))
+        return format(value, '.15g')
+    return str(value)
+
+
+def to_bool(value: Any) -> bool:
+    value = _scalar(value)
+    if isinstance(value, CellError):
+        raise _ErrorSignal(value)
+    if value is None:
+        return False
+    if isinstance(value, str):
+        if value.upper() in ('TRUE', 'FALSE'):
+            return value.upper() == 'TRUE'
+        raise _ErrorSignal(ERROR_VALUE)
+    return bool(value)
+
+
+def _type_rank(value: Any) -> int:
+    if isinstance(value, bool):
+        return 2
+    if isinstance(value, str):
+        return 1
+    return 0
+
+
+def compare(left: Any, right: Any) -> int:
+    """-1/0/1. Пусто равно 0, "" и FALSE; строки без учета регистра; числа < текст < логические."""
+    left, right = _scalar(left), _scalar(right)
+    for value in (left, right):
+        if isinstance(value, CellError):
+            raise _ErrorSignal(value)
+    if left is None:
+        left = "" if isinstance(right, str) else (False if isinstance(right, bool) else 0)
+    if right is None:
+        right = "" if isinstance(left, str) else (False if isinstance(left, bool) else 0)
+    left_rank, right_rank = _type_rank(left), _type_rank(right)
+    if left_rank != right_rank:
+        return -1 if left_rank < right_rank else 1
+    if isinstance(left, str):
+        left, right = left.lower(), right.lower()
+    return (left > right) - (left < right)
+
+
+def _normalize_number(value: float) -> float:
+    """Excel хранит 15 значащих цифр: 0.1+0.2 должно быть равно 0.3 при округлении и сравнении."""
+    return float(format(value, '.15g')) if isinstance(value, float) else value
+
+
+def round_half_up(value: float, digits: int) -> float:
+    exponent = Decimal(1).scaleb(-digits)
+    rounded = Decimal(format(value, '.15g')).quantize(exponent, rounding=ROUND_HALF_UP)
+    return float(rounded)
+
+
+# ================================================================
+# ФУНКЦИИ EXCEL
+# ================================================================
+# Обычная функция получает уже вычисленные аргументы (значения или RangeValue)
+# первым параметром - состояние. IF/IFERROR/IFS/AND/OR компилируются отдельно
+# (ленивые аргументы). GETPIVOTDATA читает данные из привязанного источника.
+
+def _flatten(arguments: Iterable[Any]) -> Iterator[Tuple[Any, bool]]:
+    """(значение, из_диапазона)."""
+    for argument in arguments:
+        if isinstance(argument, RangeValue):
+            for value in argument.values():
+                yield value, True
+        else:
+            yield argument, False
+
+
+def _fn_sum(state, *arguments):
+    total = 0
+    for value, from_range in _flatten(arguments):
+        if isinstance(value, CellError):
+            raise _ErrorSignal(value)
+        if from_range:
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                total += value
+        elif value is not None:
+            total += to_number(value)
+    return total
+
+
+def _fn_round(state, value, digits=0):
+    return round_half_up(to_number(value), int(to_number(digits)))
+
+
+def _fn_concatenate(state, *arguments):
+    return "".join(to_text(argument) for argument in arguments)
+
+
+def _fn_concat(state, *arguments):
+    return "".join(to_text(value) for value, _ in _flatten(arguments))
+
+
+def _fn_char(state, code):
+    return chr(int(to_number(code)))
+
+
+def _fn_isnumber(state, value):
+    value = value.cell(0, 0) if isinstance(value, RangeValue) and value.height == value.width == 1 else value
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _wildcard_pattern(text: str) -> "re.Pattern":
+    pattern = ""
+    escaped = False
+    for char in text:
+        if escaped:
+            pattern += re.escape(char)
+            escaped = False
+        elif char == '~':
+            escaped = True
+        elif char == '*':
+            pattern += '.*'
+        elif char == '?':
+            pattern += '.'
+        else:
+            pattern += re.escape(char)
+    return re.compile(pattern, re.IGNORECASE | re.DOTALL)
+
+
+def _fn_search(state, find_text, within_text, start=1):
+    find_text, within_text = to_text(find_text), to_text(within_text)
+    start = int(to_number(start))
+    if start < 1 or start > len(within_text) + 1:
+        raise _ErrorSignal(ERROR_VALUE)
+    match = _wildcard_pattern(find_text).search(within_text, start - 1)
+    if match is None:
+        raise _ErrorSignal(ERROR_VALUE)
+    return match.start() + 1
+
+
+def _date_part(value) -> datetime:
+    number = to_number(value)
+    if number < 0:
+        raise _ErrorSignal(ERROR_NUM)
+    return from_serial(number)
+
+
+def _fn_year(state, value):
+    return _date_part(value).year
+
+
+def _fn_month(state, value):
+    return _date_part(value).month
+
+
+def _fn_day(state, value):
+    return _date_part(value).day
+
+
+def _fn_date(state, year, month, day):
+    year, month, day = int(to_number(year)), int(to_number(month)), int(to_number(day))
+    if year < 1900:
+        year += 1900
+    start = datetime(year, 1, 1) + relativedelta(months=month - 1)
+    return to_serial(start + timedelta(days=day - 1))
+
+
+def _fn_eomonth(state, start, months):
+    first_of_month = _date_part(start).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    end = first_of_month + relativedelta(months=int(to_number(months)) + 1) - timedelta(days=1)
+    return to_serial(end)
+
+
+def _fn_today(state):
+    return to_serial(datetime.combine(state.today(), datetime.min.time()))
+
+
+_RU_DATE_CODES = (('ГГГГ', '%Y'), ('ДД', '%d'), ('ММ', '%m'), ('yyyy', '%Y'), ('dd', '%d'), ('mm', '%m'))
+
+
+def _fn_text(state, value, format_text):
+    """TEXT для форматов, встречающихся в книге: проценты, "# ##0,00"/"#,##0.00", "0.00", даты ДД.ММ.ГГГГ."""
+    format_text = to_text(format_text)
+    value = _scalar(value)
+    if isinstance(value, str):
+        try:
+            value = to_number(value)
+        except _ErrorSignal:
+            return value
+    number = to_number(value)
+    if any(code in format_text for code, _ in _RU_DATE_CODES):
+        pattern = format_text
+        for code, directive in _RU_DATE_CODES:
+            pattern = pattern.replace(code, directive)
+        return from_serial(number).strftime(pattern)
+    percent = format_text.endswith('%')
+    if percent:
+        number *= 100
+        format_text = format_text[:-1]
+    decimal_separator = ',' if ',' in format_text and ('# ' in format_text or format_text.startswith('0,')) else '.'
+    integer_part, _, fraction_part = format_text.partition(decimal_separator)
+    decimals = len(fraction_part)
+    grouped = '#' in integer_part and (' ' in integer_part or ',' in integer_part)
+    rounded = round_half_up(number, decimals)
+    text = f"{abs(rounded):,.{decimals}f}" if grouped else f"{abs(rounded):.{decimals}f}"
+    group_separator = ' ' if ' ' in integer_part else ','
+    text = text.replace(',', '\0').replace('.', decimal_separator).replace('\0', group_separator)
+    return ("-" if rounded < 0 else "") + text + ("%" if percent else "")
+
+
+def _lookup_matches(lookup_value: Any, candidate: Any) -> bool:
+    if isinstance(candidate, CellError) or candidate is None:
+        return False
+    if isinstance(lookup_value, str) and isinstance(candidate, str):
+        if '*' in lookup_value or '?' in lookup_value:
+            return _wildcard_pattern(lookup_value).fullmatch(candidate) is not None
+        return lookup_value.lower() == candidate.lower()
+    if isinstance(lookup_value, str) != isinstance(candidate, str) or isinstance(lookup_value, bool) != isinstance(candidate, bool):
+        return False
+    return lookup_value == candidate
+
+
+def _lookup_position(lookup_value: Any, candidates: Iterable[Any], exact: bool) -> Optional[int]:
+    lookup_value = _scalar(lookup_value)
+    if isinstance(lookup_value, CellError):
+        raise _ErrorSignal(lookup_value)
+    if lookup_value is None:
+        lookup_value = 0
+    found = None
+    for position, candidate in enumerate(candidates):
+        if exact:
+            if _lookup_matches(lookup_value, candidate):
+                return position
+        elif candidate is not None and _type_rank(candidate) == _type_rank(lookup_value) and not isinstance(candidate, CellError):
+            # Приблизительный поиск: последний элемент, не больший искомого (данные отсортированы)
+            if compare(candidate, lookup_value) <= 0:
+                found = position
+            else:
+                break
+    return found
+
+
+def _fn_vlookup(state, lookup_value, table, column, range_lookup=True):
+    if not isinstance(table, RangeValue):
+        raise _ErrorSignal(ERROR_VALUE)
+    column = int(to_number(column))
+    if column < 1:
+        raise _ErrorSignal(ERROR_VALUE)
+    if column > table.width:
+        raise _ErrorSignal(ERROR_REF)
+    exact = not to_bool(range_lookup) if range_lookup is not None else False
+    row = _lookup_position(lookup_value, (table.cell(offset, 0) for offset in range(table.height)), exact)
+    if row is None:
+        raise _ErrorSignal(ERROR_NA)
+    return table.cell(row, column - 1)
+
+
+def _fn_hlookup(state, lookup_value, table, row, range_lookup=True):
+    if not isinstance(table, RangeValue):
+        raise _ErrorSignal(ERROR_VALUE)
+    row = int(to_number(row))
+    if row < 1:
+        raise _ErrorSignal(ERROR_VALUE)
+    if row > table.height:
+        raise _ErrorSignal(ERROR_REF)
+    exact = not to_bool(range_lookup) if range_lookup is not None else False
+    column = _lookup_position(lookup_value, (table.cell(0, offset) for offset in range(table.width)), exact)
+    if column is None:
+        raise _ErrorSignal(ERROR_NA)
+    return table.cell(row - 1, column)
+
+
+_CRITERION_RE = re.compile(r'^(<=|>=|<>|<|>|=)?(.*)$', re.DOTALL)
+
+
+def _criterion(criterion: Any) -> Callable[[Any], bool]:
+    criterion = _scalar(criterion)
+    if isinstance(criterion, CellError):
+        raise _ErrorSignal(criterion)
+    if not isinstance(criterion, str):
+        return lambda value: value is not None and not isinstance(value, CellError) and _lookup_matches(criterion, value)
+    operator, operand = _CRITERION_RE.match(criterion).groups()
+    try:
+        operand_value: Any = float(operand)
+    except ValueError:
+        operand_value = operand
+    if operator in (None, '=') and isinstance(operand_value, str):
+        if operand_value == "":
+            return lambda value: value is None or value == ""
+        return lambda value: isinstance(value, str) and _lookup_matches(operand_value, value)
+    if operator in (None, '='):
+        return lambda value: isinstance(value, (int, float)) and not isinstance(value, bool) and value == operand_value
+    if operator == '<>':
+        return lambda value: not (value is not None and not isinstance(value, CellError) and _lookup_matches(operand_value, value))
+
+    def check(value):
+        if value is None or isinstance(value, CellError) or _type_rank(value) != _type_rank(operand_value):
+            return False
+        result = compare(value, operand_value)
+        return {'<': result < 0, '>': result > 0, '<=': result <= 0, '>=': result >= 0}[operator]
+    return check
+
+
+def _fn_sumifs(state, sum_range, *criteria):
+    if not isinstance(sum_range, RangeValue) or len(criteria) % 2:
+        raise _ErrorSignal(ERROR_VALUE)
+    checks = []
+    for criteria_range, criterion in zip(criteria[::2], criteria[1::2]):
+        if not isinstance(criteria_range, RangeValue) or (criteria_range.height, criteria_range.width) != (sum_range.height, sum_range.width):
+            raise _ErrorSignal(ERROR_VALUE)
+        checks.append((list(criteria_range.values()), _criterion(criterion)))
+    total = 0
+    for position, value in enumerate(sum_range.values()):
+        if all(check(values[position]) for values, check in checks):
+            if isinstance(value, CellError):
+                raise _ErrorSignal(value)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                total += value
+    return total
+
+
+FUNCTIONS: Dict[str, Callable] = {
+    'SUM': _fn_sum, 'ROUND': _fn_round, 'CONCATENATE': _fn_concatenate, 'CONCAT': _fn_concat,
+    'CHAR': _fn_char, 'ISNUMBER': _fn_isnumber, 'SEARCH': _fn_search,
+    'YEAR': _fn_year, 'MONTH': _fn_month, 'DAY': _fn_day, 'DATE': _fn_date, 'EOMONTH': _fn_eomonth,
+    'TODAY': _fn_today, 'TEXT': _fn_text, 'VLOOKUP': _fn_vlookup, 'HLOOKUP': _fn_hlookup, 'SUMIFS': _fn_sumifs,
+}
+
+# Функции, результат которых зависит не только от ячеек (пересчитываются всегда)
+VOLATILE_FUNCTIONS = frozenset({'TODAY'})
+
+# Функции, получающие ошибку аргумента как значение (ISNUMBER(SEARCH(...)) -> FALSE)
+ERROR_TOLERANT_FUNCTIONS = frozenset({'ISNUMBER'})
+
+
+# ================================================================
+# КОМПИЛЯЦИЯ
+# ================================================================
+
+class _Compiler:
+    """Компилирует дерево одной формулы в замыкание и собирает ее ссылки."""
+
+    def __init__(self, workbook: "CompiledWorkbook", sheet: str, row: int, col: int):
+        self.workbook, self.sheet, self.row, self.col = workbook, sheet, row, col
+        self.refs: Set[CellKey] = set()
+        self.ranges: Set[RangeKey] = set()
+        self.volatile = False
+
+    # --- Ссылки ---
+    def _sheet(self, name: Optional[str]) -> str:
+        if name is None:
+            return self.sheet
+        canonical = self.workbook.sheet_names.get(name.lower())
+        if canonical is None:
+            raise _CompileError(ERROR_REF)
+        return canonical
+
+    def _reference(self, sheet: str, row1: int, col1: int, row2: int, col2: int):
+        if (row1, col1) == (row2, col2):
+            key = (sheet, row1, col1)
+            self.refs.add(key)
+            return lambda state: state.get(key)
+        row1, row2 = min(row1, row2), max(row1, row2)
+        col1, col2 = min(col1, col2), max(col1, col2)
+        self.ranges.add((sheet, row1, col1, row2, col2))
+        return lambda state: RangeValue(state, sheet, row1, col1, row2, col2)
+
+    def _table(self, text: str):
+        table_name, _, spec = text.partition('[')
+        table = self.workbook.tables.get(table_name.lower())
+        if table is None:
+            raise _CompileError(ERROR_REF)
+        sheet, header_row, first_col, last_row, columns = table
+        parts = re.findall(r'\[([^\[\]]*)\]', '[' + spec) if spec.startswith('[') else [spec[:-1]]
+        this_row = any(part.lower() == '#this row' for part in parts)
+        column_names = [part for part in parts if not part.startswith('#')]
+        try:
+            col_offsets = [columns.index(name) for name in column_names] or [0, len(columns) - 1]
+        except ValueError:
+            raise _CompileError(ERROR_REF)
+        col1, col2 = first_col + min(col_offsets), first_col + max(col_offsets)
+        if this_row:
+            if not header_row < self.row <= last_row:
+                raise _CompileError(ERROR_VALUE)
+            return self._reference(sheet, self.row, col1, self.row, col2)
+        return self._reference(sheet, header_row + 1, col1, last_row, col2)
+
+    # --- Узлы ---
+    def compile(self, node):
+        kind = node[0]
+        if kind in ('num', 'str', 'bool'):
+            value = node[1]
+            if kind == 'num' and value == int(value):
+                value = int(value)
+            return lambda state: value
+        if kind == 'blank':
+            return lambda state: None
+        if kind == 'err':
+            error = CellError(node[1])
+            return lambda state: error
+        if kind == 'ref':
+            row, col = parse_cell(node[2])
+            return self._reference(self._sheet(node[1]), row, col, row, col)
+        if kind == 'range':
+            left, right = node[1], node[2]
+            sheet = self._sheet(left[1])
+            row1, col1 = parse_cell(left[2])
+            row2, col2 = parse_cell(right[2])
+            return self._reference(sheet, row1, col1, row2, col2)
+        if kind == 'name':
+            target = self.workbook.defined_names.get(node[1].lower())
+            if target is None:
+                raise _CompileError(ERROR_NAME)
+            return self._reference(*target)
+        if kind == 'table':
+            return self._table(node[1])
+        if kind == 'neg':
+            operand = self.compile(node[1])
+            return lambda state: -to_number(operand(state))
+        if kind == 'pct':
+            operand = self.compile(node[1])
+            return lambda state: to_number(operand(state)) / 100
+        if kind == 'bin':
+            return self._binary(node[1], self.compile(node[2]), self.compile(node[3]))
+        if kind == 'call':
+            return self._call(node[1], node[2])
+        raise _CompileError(ERROR_VALUE)
+
+    def _binary(self, operator: str, left, right):
+        if operator == '&':
+            return lambda state: to_text(left(state)) + to_text(right(state))
+        if operator in _COMPARISON_OPS:
+            test = {
+                '=': lambda result: result == 0, '<>': lambda result: result != 0,
+                '<': lambda result: result < 0, '>': lambda result: result > 0,
+                '<=': lambda result: result <= 0, '>=': lambda result: result >= 0,
+            }[operator]
+            return lambda state: test(compare(_normalize_number(_scalar(left(state))), _normalize_number(_scalar(right(state)))))
+        if operator == '+':
+            return lambda state: to_number(left(state)) + to_number(right(state))
+        if operator == '-':
+            return lambda state: to_number(left(state)) - to_number(right(state))
+        if operator == '*':
+            return lambda state: to_number(left(state)) * to_number(right(state))
+
+        if operator == '/':
+            def divide(state):
+                numerator, denominator = to_number(left(state)), to_number(right(state))
+                if denominator == 0:
+                    raise _ErrorSignal(ERROR_DIV0)
+                return numerator / denominator
+            return divide
+
+        def power(state):
+            try:
+                return to_number(left(state)) ** to_number(right(state))
+            except (ZeroDivisionError, OverflowError):
+                raise _ErrorSignal(ERROR_NUM)
+        return power
+
+    def _call(self, name: str, argument_nodes: list):
+        if name == 'GETPIVOTDATA':
+            return self._getpivotdata(argument_nodes)
+        arguments = [self.compile(node) for node in argument_nodes]
+        if name == 'IF':
+            if not 2 <= len(arguments) <= 3:
+                raise _CompileError(ERROR_VALUE)
+            condition, if_true = arguments[0], arguments[1]
+            if_false = arguments[2] if len(arguments) == 3 else (lambda state: False)
+            return lambda state: (if_true if to_bool(condition(state)) else if_false)(state)
+        if name == 'IFERROR':
+            if len(arguments) != 2:
+                raise _CompileError(ERROR_VALUE)
+            value, fallback = arguments
+
+            def iferror(state):
+                try:
+                    result = _scalar(value(state))
+                except _ErrorSignal:
+                    return fallback(state)
+                return fallback(state) if isinstance(result, CellError) else result
+            return iferror
+        if name == 'IFS':
+            if not arguments or len(arguments) % 2:
+                raise _CompileError(ERROR_VALUE)
+            pairs = list(zip(arguments[::2], arguments[1::2]))
+
+            def ifs(state):
+                for condition, value in pairs:
+                    if to_bool(condition(state)):
+                        return value(state)
+                raise _ErrorSignal(ERROR_NA)
+            return ifs
+        if name in ('AND', 'OR'):
+            combine = all if name == 'AND' else any
+
+            def logical(state):
+                values = []
+                for value, from_range in _flatten(argument(state) for argument in arguments):
+                    if isinstance(value, CellError):
+                        raise _ErrorSignal(value)
+                    if from_range and (value is None or isinstance(value, str)):
+                        continue
+                    values.append(to_bool(value))
+                if not values:
+                    raise _ErrorSignal(ERROR_VALUE)
+                return combine(values)
+            return logical
+
+        function = FUNCTIONS.get(name)
+        if function is None:
+            raise _CompileError(ERROR_NAME)
+        if name in VOLATILE_FUNCTIONS:
+            self.volatile = True
+        if name in ERROR_TOLERANT_FUNCTIONS:
+            def tolerant(state):
+                values = []
+                for argument in arguments:
+                    try:
+                        values.append(argument(state))
+                    except _ErrorSignal as e:
+                        values.append(e.error)
+                return function(state, *values)
+            return tolerant
+        return lambda state: function(state, *[argument(state) for argument in arguments])
+
+    def _getpivotdata(self, argument_nodes: list):
+        """GETPIVOTDATA("поле", сводная, "фильтр1", значение1, ...): сводная - имя, привязанное к источнику данных."""
+        if len(argument_nodes) < 2 or len(argument_nodes) % 2:
+            raise _CompileError(ERROR_VALUE)
+        pivot_node = argument_nodes[1]
+        if pivot_node[0] != 'name':
+            raise _CompileError(ERROR_REF)
+        pivot_name = pivot_node[1].lower()
+        data_field = self.compile(argument_nodes[0])
+        filters = [(self.compile(field), self.compile(item)) for field, item in zip(argument_nodes[2::2], argument_nodes[3::2])]
+
+        def getpivotdata(state):
+            pivot = state.pivots.get(pivot_name)
+            if pivot is None:
+                raise _ErrorSignal(ERROR_REF)
+            field_name = to_text(data_field(state))
+            items = {}
+            for field, item in filters:
+                item_value = _scalar(item(state))
+                if isinstance(item_value, CellError):
+                    raise _ErrorSignal(item_value)
+                items[to_text(field(state))] = item_value
+            return pivot.get(field_name, items)
+        return getpivotdata
+
+
+class _CompileError(Exception):
+    """Формулу нельзя связать с книгой (неизвестное имя, функция, лист): ячейка получает ошибку."""
+    def __init__(self, error: CellError):
+        self.error = error
+
+
+class CompiledFormula:
+    __slots__ = ('text', 'function', 'refs', 'ranges', 'volatile')
+
+    def __init__(self, text: str, function: Callable, refs: Tuple[CellKey, ...], ranges: Tuple[RangeKey, ...], volatile: bool):
+        self.text, self.function, self.refs, self.ranges, self.volatile = text, function, refs, ranges, volatile
+
+
+class PivotSource:
+    """Источник данных для GETPIVOTDATA: get(поле данных, {поле: значение}) -> значение или CellError."""
+
+    def get(self, data_field: str, items: Dict[str, Any]) -> Any:
+        raise NotImplementedError
+
+
+# ================================================================
+# КНИГА: ФОРМУЛЫ, КОНСТАНТЫ И ГРАФ ЗАВИСИМОСТЕЙ
+# ================================================================
+
+class CompiledWorkbook:
+    """
+    Неизменяемая скомпилированная книга. constants - значения ячеек без формул,
+    formulas - {(лист, строка, столбец): текст формулы}, defined_names - {имя: RangeKey},
+    tables - {имя: (лист, строка заголовка, первый столбец, последняя строка, [столбцы])}.
+    Формулы, которые не удалось разобрать или связать, дают ошибку (#NAME? и т.п.)
+    и перечислены в compile_errors.
+    """
+
+    def __init__(
+        self,
+        constants: Dict[CellKey, Any],
+        formulas: Dict[CellKey, str],
+        defined_names: Optional[Dict[str, RangeKey]] = None,
+        tables: Optional[Dict[str, tuple]] = None,
+    ):
+        self.constants = constants
+        self.sheet_names = {key[0].lower(): key[0] for key in list(constants) + list(formulas)}
+        self.defined_names = {name.lower(): target for name, target in (defined_names or {}).items()}
+        self.tables = {name.lower(): table for name, table in (tables or {}).items()}
+        self.compile_errors: Dict[CellKey, str] = {}
+        self.formulas: Dict[CellKey, CompiledFormula] = {}
+        for key, text in formulas.items():
+            self.formulas[key] = self._compile(key, text)
+        self._build_graph()
+
+    def _compile(self, key: CellKey, text: str) -> CompiledFormula:
+        compiler = _Compiler(self, *key)
+        try:
+            function = compiler.compile(parse_formula(text))
+        except FormulaSyntaxError as e:
+            self.compile_errors[key] = f"синтаксис: {e}"
+            function = _constant_error(ERROR_NAME)
+        except _CompileError as e:
+            self.compile_errors[key] = f"не удалось связать: {e.error.code}"
+            function = _constant_error(e.error)
+        return CompiledFormula(text, function, tuple(compiler.refs), tuple(compiler.ranges), compiler.volatile)
+
+    def _build_graph(self) -> None:
+        """Предшественники-формулы каждой формулы, обратные ребра и топологический порядок."""
+        formula_rows: Dict[str, Dict[int, List[int]]] = {}
+        for sheet, row, col in self.formulas:
+            formula_rows.setdefault(sheet, {}).setdefault(row, []).append(col)
+
+        self.precedents: Dict[CellKey, Tuple[CellKey, ...]] = {}
+        dependents: Dict[CellKey, Set[CellKey]] = {}
+        self._ref_dependents: Dict[CellKey, Set[CellKey]] = {}
+        self._range_dependents: List[Tuple[RangeKey, CellKey]] = []
+        for key, formula in self.formulas.items():
+            precedents = {ref for ref in formula.refs if ref in self.formulas}
+            for ref in formula.refs:
+                self._ref_dependents.setdefault(ref, set()).add(key)
+            for sheet, row1, col1, row2, col2 in formula.ranges:
+                self._range_dependents.append(((sheet, row1, col1, row2, col2), key))
+                rows = formula_rows.get(sheet, {})
+                for row in (range(row1, row2 + 1) if row2 - row1 < len(rows) else [r for r in rows if row1 <= r <= row2]):
+                    for col in rows.get(row, ()):
+                        if col1 <= col <= col2:
+                            precedents.add((sheet, row, col))
+            self.precedents[key] = tuple(precedents)
+            for precedent in precedents:
+                dependents.setdefault(precedent, set()).add(key)
+        self.dependents: Dict[CellKey, Tuple[CellKey, ...]] = {key: tuple(cells) for key, cells in dependents.items()}
+
+        # Топологический порядок (итеративный DFS); ячейки в циклах получают ранг по порядку обхода
+        self.rank: Dict[CellKey, int] = {}
+        visiting: Set[CellKey] = set()
+        for root in self.formulas:
+            if root in self.rank:
+                continue
+            stack = [(root, iter(self.precedents[root]))]
+            visiting.add(root)
+            while stack:
+                key, remaining = stack[-1]
+                for precedent in remaining:
+                    if precedent not in self.rank and precedent not in visiting:
+                        visiting.add(precedent)
+                        stack.append((precedent, iter(self.precedents[precedent])))
+                        break
+                else:
+                    stack.pop()
+                    visiting.discard(key)
+                    self.rank[key] = len(self.rank)
+
+        volatile = {key for key, formula in self.formulas.items() if formula.volatile}
+        self.volatile: frozenset = frozenset(self.downstream(volatile) | volatile)
+
+    def dependents_of(self, key: CellKey) -> Tuple[CellKey, ...]:
+        """Формулы, напрямую читающие ячейку key (для констант - по ссылкам и диапазонам)."""
+        if key in self.formulas:
+            return self.dependents.get(key, ())
+        sheet, row, col = key
+        cells = set(self._ref_dependents.get(key, ()))
+        for (range_sheet, row1, col1, row2, col2), dependent in self._range_dependents:
+            if range_sheet == sheet and row1 <= row <= row2 and col1 <= col <= col2:
+                cells.add(dependent)
+        return tuple(cells)
+
+    def downstream(self, keys: Iterable[CellKey]) -> Set[CellKey]:
+        """Все формулы, зависящие (транзитивно) от ячеек keys."""
+        result: Set[CellKey] = set()
+        stack = list(keys)
+        while stack:
+            for dependent in self.dependents_of(stack.pop()):
+                if dependent not in result:
+                    result.add(dependent)
+                    stack.append(dependent)
+        return result
+
+    def upstream(self, keys: Iterable[CellKey]) -> Set[CellKey]:
+        """Формулы keys и все формулы, от которых они зависят."""
+        result: Set[CellKey] = set()
+        stack = [key for key in keys if key in self.formulas]
+        while stack:
+            key = stack.pop()
+            if key in result:
+                continue
+            result.add(key)
+            stack.extend(self.precedents[key])
+        return result
+
+    def sheet_formulas(self, sheet: str) -> List[CellKey]:
+        return sorted((key for key in self.formulas if key[0] == sheet), key=lambda key: (key[1], key[2]))
+
+
+def _constant_error(error: CellError):
+    return lambda state: error
+
+
+# ================================================================
+# СОСТОЯНИЕ: ВХОДНЫЕ ДАННЫЕ И ВЫЧИСЛЕННЫЕ ЗНАЧЕНИЯ
+# ================================================================
+
+class WorkbookState:
+    """
+    Значения книги для одного набора входных данных. Формула вычисляется при первом
+    обращении и запоминается; set_inputs сбрасывает только формулы ниже по графу.
+    Не потокобезопасно: одно состояние - один запрос (или одна сессия под блокировкой).
+    """
+
+    def __init__(
+        self,
+        workbook: CompiledWorkbook,
+        pivots: Optional[Dict[str, PivotSource]] = None,
+        values: Optional[Dict[CellKey, Any]] = None,
+        today: Callable[[], date] = date.today,
+    ):
+        self.workbook = workbook
+        self.pivots = {name.lower(): pivot for name, pivot in (pivots or {}).items()}
+        self.inputs: Dict[CellKey, Any] = {}
+        self.values: Dict[CellKey, Any] = dict(values or {})
+        for key in workbook.volatile:
+            self.values.pop(key, None)
+        self.today = today
+        self.evaluations = 0  # сколько формул вычислено этим состоянием
+        self._in_progress: Set[CellKey] = set()
+
+    def copy(self) -> "WorkbookState":
+        state = WorkbookState(self.workbook, None, self.values, self.today)
+        state.pivots, state.inputs = self.pivots, dict(self.inputs)
+        return state
+
+    def get(self, key: CellKey) -> Any:
+        if key in self.values:
+            return self.values[key]
+        if key in self.inputs:
+            return self.inputs[key]
+        if key in self.workbook.formulas:
+            return self._evaluate_cell(key)
+        return self.workbook.constants.get(key)
+
+    def _evaluate_cell(self, key: CellKey) -> Any:
+        if key in self._in_progress:
+            return 0  # циклическая ссылка: как Excel без итераций
+        self._in_progress.add(key)
+        try:
+            value = _scalar(self.workbook.formulas[key].function(self))
+            if value is None:
+                value = 0  # формула, ссылающаяся на пустую ячейку, в Excel дает 0
+            elif isinstance(value, float):
+                if math.isnan(value) or math.isinf(value):
+                    value = ERROR_NUM
+                elif value == int(value) and abs(value) < 1e15:
+                    value = int(value)
+        except _ErrorSignal as e:
+            value = e.error
+        except RecursionError:
+            value = ERROR_VALUE
+        finally:
+            self._in_progress.discard(key)
+        self.values[key] = value
+        self.evaluations += 1
+        return value
+
+    def set_inputs(self, changes: Dict[CellKey, Any]) -> Set[CellKey]:
+        """Задает значения ячеек-констант; возвращает формулы, ставшие грязными."""
+        for key in changes:
+            if key in self.workbook.formulas:
+                raise ValueError(f"Ячейка {key[0]}!{cell_address(key[1], key[2])} содержит формулу и не может быть входной.")
+        changed = [key for key, value in changes.items() if self.get(key) != value or type(self.get(key)) is not type(value)]
+        for key in changed:
+            self.inputs[key] = changes[key]
+        dirty = self.workbook.downstream(changed)
+        for key in dirty:
+            self.values.pop(key, None)
+        return dirty
+
+    def evaluate(self, keys: Iterable[CellKey]) -> Dict[CellKey, Any]:
+        """
+        Значения ячеек keys. Невычисленные формулы-предшественники считаются
+        в топологическом порядке, поэтому рекурсия остается неглубокой.
+        """
+        keys = list(keys)
+        pending = {key for key in self.workbook.upstream(key for key in keys if key not in self.values) if key not in self.values}
+        for key in sorted(pending, key=self.workbook.rank.__getitem__):
+            if key not in self.values:
+                self._evaluate_cell(key)
+        return {key: self.get(key) for key in keys}
+
+
+class WorkbookModel:
+    """
+    Скомпилированная книга, привязанная к источникам сводных таблиц (данным
+    текущей версии). Базовые значения (входные данные из файла) вычисляются один
+    раз; new_state() дает копию, в которой пересчитывается только измененное.
+    """
+
+    def __init__(self, workbook: CompiledWorkbook, pivots: Dict[str, PivotSource], today: Callable[[], date] = date.today):
+        self.workbook = workbook
+        self.pivots = pivots
+        self.today = today
+        self._base = WorkbookState(workbook, pivots, today=today)
+        self._lock = threading.Lock()
+
+    def warm_up(self, keys: Iterable[CellKey]) -> None:
+        """Вычисляет базовые значения ячеек keys (и всего, от чего они зависят)."""
+        with self._lock:
+            self._base.evaluate(keys)
+
+    def new_state(self) -> WorkbookState:
+        with self._lock:
+            return self._base.copy()
@@ -1,9 +1,17 @@
 # C:\excel-to-web\logic.py
 
-import pandas as pd
 from typing import Dict, Any, List, Optional, Tuple
 from decimal import Decimal, ROUND_HALF_UP
 import re
+from bisect import bisect_left
+
+import time
+
+import metrics
+from price_store import PriceTable, is_missing
+
+_FIND_PRICE_TIERS_STAGE = metrics.stage("run_calculation.find_price_tiers")
+_DECIMAL_ARITHMETIC_STAGE = metrics.stage("run_calculation.decimal_arithmetic")
 
 # --- Утилиты и константы ---
 _quantizer = Decimal('0.01')
@@ -37,30 +45,75 @@ def _parse_combo_level(level_string: str) -> List[str]:
             temp_string = temp_string.replace(upper_known_level, "", 1)
     return found_levels if not temp_string.strip() and found_levels else [level_string]
 
+# --- Индекс прайс-листа ---
+class PriceIndex:
+    """
+    Предрасчитанный индекс прайс-листа для быстрого поиска тарифа.
+
+    Ключ - (Сервис, Уровень, Период), значение - отсортированный по возрастанию
+    кортеж "Аккаунтов" и параллельный ему кортеж цен "Стоимость без НДС".
+    Для повторяющихся значений "Аккаунтов" берется первая строка файла.
+    """
+    __slots__ = ('_buckets',)
+
+    def __init__(self, buckets: Dict[Tuple[str, str, str], Tuple[Tuple[int, ...], Tuple[float, ...]]]):
+        self._buckets = buckets
+
+    @classmethod
+    def from_table(cls, prices_table: Optional[PriceTable]) -> 'PriceIndex':
+        """Строит индекс по PriceTable (или любой таблице со столбцами по имени и .columns)."""
+        grouped: Dict[Tuple[str, str, str], Dict[int, float]] = {}
+        if prices_table is not None and len(prices_table):
+            prices = prices_table['Стоимость без НДС'] if 'Стоимость без НДС' in prices_table.columns else [0.0] * len(prices_table)
+            for service, level, period, accounts, price in zip(
+                prices_table['Сервис'], prices_table['Уровень'], prices_table['Период'], prices_table['Аккаунтов'], prices
+            ):
+                if is_missing(service) or is_missing(level) or is_missing(period) or is_missing(accounts): continue
+                grouped.setdefault((service, level, period), {}).setdefault(int(accounts), price)
+        buckets = {}
+        for key, tiers in grouped.items():
+            accounts_sorted = tuple(sorted(tiers))
+            buckets[key] = (accounts_sorted, tuple(tiers[a] for a in accounts_sorted))
+        return cls(buckets)
+
+    # Прежнее имя: DataFrame прайс-листа тоже подходит (столбцы по имени и .columns)
+    from_dataframe = from_table
+
+    def find_price(self, service: str, level: str, period: str, accounts: int) -> Optional[float]:
+        """
+        Возвращает цену тира: точное совпадение по количеству аккаунтов,
+        либо максимальный тир, если аккаунтов больше, чем есть в прайсе.
+        """
+        bucket = self._buckets.get((service, level, period))
+        if bucket is None: return None
+        accounts_sorted, prices = bucket
+        pos = bisect_left(accounts_sorted, accounts)
+        if pos < len(accounts_sorted) and accounts_sorted[pos] == accounts:
+            return prices[pos]
+        if accounts > accounts_sorted[-1]:
+            return prices[-1]
+        return None
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
 # --- Функция поиска ---
-def find_price_tiers(data: Dict[str, Any], df_prices: pd.DataFrame) -> List[Dict[str, Any]]:
+def find_price_tiers(
+    data: Dict[str, Any],
+    df_prices: Optional[PriceTable],
+    price_index: Optional[PriceIndex] = None
+) -> List[Dict[str, Any]]:
+    if price_index is None:
+        price_index = PriceIndex.from_table(df_prices)
     level_prices_info = []
     for level_input in data.get('levels', []):
         accounts = level_input.get('accounts', 0)
         if accounts <= 0: continue
-        possible_tiers = df_prices[
-            (df_prices['Сервис'] == data['service']) &
-            (df_prices['Уровень'] == level_input['level']) &
-            (df_prices['Период'] == data['period'])
-        ]
-        if possible_tiers.empty: continue
-        found_row = None
-        exact_match = possible_tiers[possible_tiers['Аккаунтов'] == accounts]
-        if not exact_match.empty:
-            found_row = exact_match.iloc[0]
-        else:
-            max_accounts_in_tier = possible_tiers['Аккаунтов'].max()
-            if accounts > max_accounts_in_tier:
-                found_row = possible_tiers.loc[possible_tiers['Аккаунтов'].idxmax()]
-        if found_row is not None:
+        price = price_index.find_price(data['service'], level_input['level'], data['period'], accounts)
+        if price is not None:
             level_prices_info.append({
                 "level_name": level_input['level'], "accounts": accounts,
-                "price_without_vat_per_user": found_row.get('Стоимость без НДС', 0.0),
+                "price_without_vat_per_user": price,
             })
     return level_prices_info
 
@@ -121,47 +174,82 @@ def _parse_condition2(condition: str) -> Optional[Tuple[int, Decimal]]:
         return int(numbers[0]), Decimal(numbers[1]) / Decimal('100')
     return None
 
+def _parse_condition2_windows(condition: str) -> List[Tuple[int, Decimal]]:
+    """
+    Разбирает "Условие2" в список льготных окон (месяцев, скидка), идущих подряд.
+    Обычная запись "2 мес. со скидкой 99%" дает одно окно (как _parse_condition2),
+    запись "1 мес. со скидкой 99%, 2 мес. со скидкой 50%" - два окна.
+    """
+    if not isinstance(condition, str) or '%' not in condition: return []
+    pairs = re.findall(r'(\d+)\s*мес[^\d%]*?(\d+)\s*%', condition)
+    if len(pairs) >= 2:
+        return [(int(months), Decimal(percent) / Decimal('100')) for months, percent in pairs]
+    single_window = _parse_condition2(condition)
+    return [single_window] if single_window else []
+
+def _promotion_month_segments(
+    prepayment_months: int,
+    base_discount_multiplier: Decimal,
+    windows: List[Tuple[int, Decimal]]
+) -> List[Tuple[int, Decimal]]:
+    """
+    Делит период предоплаты на отрезки с одинаковым множителем скидки:
+    сначала льготные окна из "Условие2", затем базовая скидка "Условие1".
+    Возвращает [(количество месяцев, множитель), ...].
+    """
+    segments, months_left = [], max(prepayment_months, 0)
+    for window_months, window_discount in windows:
+        month_count = min(max(window_months, 0), months_left)
+        if month_count:
+            segments.append((month_count, Decimal('1') - window_discount))
+        months_left -= month_count
+    if months_left:
+        segments.append((months_left, base_discount_multiplier))
+    return segments
+
 def _calculate_discounted_price_with_promotion(
     level_prices_info: List[Dict[str, Any]], 
     data: Dict[str, Any],
     promotion_details: Dict[str, Any],
     applicable_promo_levels: List[str],
-    is_ld_service: bool
+    is_ld_service: bool,
+    month_prices: Optional[Dict[Tuple[Decimal, Decimal, bool], Decimal]] = None
 ) -> Decimal:
-    
+    """
+    Стоимость периода по акции. Месячная цена уровня бывает лишь нескольких видов
+    (в льготном окне и после него), поэтому каждая считается один раз и умножается
+    на число месяцев. Округление по каждому уровню - как при помесячном расчете.
+    month_prices - общий кэш месячных цен (цена уровня, множитель, ЛД) для расчета
+    нескольких акций по одним и тем же тирам.
+    """
     promo_representative = promotion_details
-    total_period_price_with_vat = Decimal('0')
     prepayment_months = int(promo_representative.get('Месяцев', data.get('prepayment_months', 1)))
     base_discount_multiplier = Decimal('1') - Decimal(str(promo_representative.get('Условие1', 0)))
-    special_condition = _parse_condition2(promo_representative.get('Условие2'))
+    windows = _parse_condition2_windows(promo_representative.get('Условие2'))
     promo_levels_set = {level.lower() for level in applicable_promo_levels}
-    
-    for month_num in range(1, prepayment_months + 1):
-        price_this_month_with_vat = Decimal('0')
-        for level in level_prices_info:
-            level_name = level['level_name']
-            accounts = Decimal(str(level['accounts']))
-            price_per_user_wo_vat = Decimal(str(level['price_without_vat_per_user']))
-            
-            current_discount_multiplier = Decimal('1')
-            if level_name.lower() in promo_levels_set:
-                current_discount_multiplier = base_discount_multiplier
-                if special_condition:
-                    special_months, special_discount = special_condition
-                    if month_num <= special_months:
-                        current_discount_multiplier = Decimal('1') - special_discount
-            
-            price_for_level_with_discount_wo_vat = (price_per_user_wo_vat * accounts) * current_discount_multiplier
-            rounded_price_wo_vat = round_decimal(price_for_level_with_discount_wo_vat)
-            
-            if not is_ld_service:
-                price_for_level_final = round_decimal(rounded_price_wo_vat * VAT_RATE)
-            else:
-                price_for_level_final = rounded_price_wo_vat
-            
-            price_this_month_with_vat += price_for_level_final
-        
-        total_period_price_with_vat += price_this_month_with_vat
+
+    def level_month_price(price_for_level_wo_vat: Decimal, discount_multiplier: Decimal) -> Decimal:
+        key = (price_for_level_wo_vat, discount_multiplier, is_ld_service)
+        if month_prices is not None and key in month_prices:
+            return month_prices[key]
+        rounded_price_wo_vat = round_decimal(price_for_level_wo_vat * discount_multiplier)
+        month_price = rounded_price_wo_vat if is_ld_service else round_decimal(rounded_price_wo_vat * VAT_RATE)
+        if month_prices is not None:
+            month_prices[key] = month_price
+        return month_price
+
+    promo_level_prices, regular_month_price = [], Decimal('0')
+    for level in level_prices_info:
+        price_for_level_wo_vat = Decimal(str(level['price_without_vat_per_user'])) * Decimal(str(level['accounts']))
+        if level['level_name'].lower() in promo_levels_set:
+            promo_level_prices.append(price_for_level_wo_vat)
+        else:
+            regular_month_price += level_month_price(price_for_level_wo_vat, Decimal('1'))
+
+    total_period_price_with_vat = regular_month_price * Decimal(max(prepayment_months, 0))
+    for month_count, discount_multiplier in _promotion_month_segments(prepayment_months, base_discount_multiplier, windows):
+        promo_month_price = sum((level_month_price(price, discount_multiplier) for price in promo_level_prices), Decimal('0'))
+        total_period_price_with_vat += promo_month_price * Decimal(month_count)
 
     if is_ld_service:
         total_period_price_with_vat = round_decimal(total_period_price_with_vat * VAT_RATE)
@@ -169,38 +257,54 @@ def _calculate_discounted_price_with_promotion(
     return round_decimal(total_period_price_with_vat)
 
 # --- ГЛАВНАЯ ФУНКЦИЯ-ДИСПЕТЧЕР ---
-def run_calculation(
-    data: Dict[str, Any], 
-    df_prices: pd.DataFrame,
-    promotion_info: Optional[Dict[str, Any]] = None
-) -> Dict[str, Any]:
-    
-    is_ld_service = "ЛД" in data.get('service', '')
+def effective_prepayment_months(data: Dict[str, Any], promotion_info: Optional[Dict[str, Any]]) -> int:
+    """Период предоплаты расчета: из запроса, а для акции - "Месяцев" из акции."""
     prepayment_months = data.get('prepayment_months', 1) or 1
-    fixation_months = data.get('fixation_months', 0)
-    
     if promotion_info:
         promotion_details = promotion_info.get("details")
         if promotion_details and promotion_details.get('Месяцев'):
             prepayment_months = int(promotion_details['Месяцев'])
-    
+    return prepayment_months
+
+def list_monthly_term(item: Dict[str, Any], is_ld_service: bool) -> Decimal:
+    """Вклад уровня в месячную стоимость по прейскуранту (для не-ЛД - уже с НДС и округлением)."""
+    price = Decimal(str(item['price_without_vat_per_user'])) * Decimal(str(item['accounts']))
+    return price if is_ld_service else round_decimal(price * VAT_RATE)
+
+def price_summary_from_periods(
+    list_monthly: Decimal, list_period: Decimal, discounted_period: Decimal, fixed_period: Decimal, D_prepayment_months: Decimal
+) -> Dict[str, float]:
+    return {
+        "list_monthly": float(list_monthly),
+        "list_period": float(list_period),
+        "discounted_monthly": float(round_decimal(discounted_period / D_prepayment_months)),
+        "discounted_period": float(round_decimal(discounted_period)),
+        "fixed_monthly": float(round_decimal(fixed_period / D_prepayment_months)),
+        "fixed_period": float(round_decimal(fixed_period))
+    }
+
+def _calculate_price_summary(
+    level_prices_info: List[Dict[str, Any]],
+    data: Dict[str, Any],
+    promotion_info: Optional[Dict[str, Any]],
+    is_ld_service: bool,
+    prepayment_months: int,
+    fixation_months: int,
+    month_prices: Optional[Dict[Tuple[Decimal, Decimal, bool], Decimal]] = None
+) -> Dict[str, float]:
+    """Decimal-расчет итогов (прейскурант, скидка/акция, фиксация) по найденным ценам уровней."""
     D_prepayment_months = Decimal(str(prepayment_months))
-    
-    level_prices_info = find_price_tiers(data, df_prices)
-    if not level_prices_info:
-        return {"price_summary": None, "calculation_context": None}
 
     # --- РАСЧЕТ ПО ПРЕЙСКУРАНТУ ---
     list_monthly_base = Decimal('0')
     for item in level_prices_info:
-        price = Decimal(str(item['price_without_vat_per_user'])) * Decimal(str(item['accounts']))
-        list_monthly_base += price if is_ld_service else round_decimal(price * VAT_RATE)
+        list_monthly_base += list_monthly_term(item, is_ld_service)
     list_period = round_decimal(list_monthly_base * D_prepayment_months * VAT_RATE) if is_ld_service else list_monthly_base * D_prepayment_months
     
     # --- РАСЧЕТ СО СКИДКОЙ ---
     if promotion_info:
         discounted_period = _calculate_discounted_price_with_promotion(
-            level_prices_info, data, promotion_info["details"], promotion_info["applicable_levels"], is_ld_service
+            level_prices_info, data, promotion_info["details"], promotion_info["applicable_levels"], is_ld_service, month_prices
         )
     else:
         if is_ld_service:
@@ -235,20 +339,73 @@ def run_calculation(
         # 2. Применяем НДС и ОКРУГЛЯЕМ. Это дает нам правильную месячную цену.
         final_list_monthly = round_decimal(base_monthly_wo_vat * VAT_RATE)
 
-    price_summary = {
-        "list_monthly": float(final_list_monthly),
-        "list_period": float(list_period),
-        "discounted_monthly": float(round_decimal(discounted_period / D_prepayment_months)),
-        "discounted_period": float(round_decimal(discounted_period)),
-        "fixed_monthly": float(round_decimal(fixed_period / D_prepayment_months)),
-        "fixed_period": float(round_decimal(fixed_period))
-    }
+    price_summary = price_summary_from_periods(final_list_monthly, list_period, discounted_period, fixed_period, D_prepayment_months)
     # ===== КОНЕЦ БЛОКА ИЗМЕНЕНИЙ =====
-    
+    return price_summary
+
+def build_calculation_result(
+    data: Dict[str, Any],
+    level_prices_info: List[Dict[str, Any]],
+    price_summary: Dict[str, float],
+    prepayment_months: int,
+    fixation_months: int
+) -> Dict[str, Any]:
+    """Результат в формате run_calculation: итоги и контекст для документа."""
     context = {
         "service_name": data.get('service', 'N/A'), "prepayment_months": prepayment_months,
         "discount_percent": data.get('discount_percent', 0), "fixation_months": fixation_months,
         "total_users": sum(item['accounts'] for item in level_prices_info),
         "levels": level_prices_info, "price_summary": price_summary
     }
-    return {"price_summary": price_summary, "calculation_context": context}
\ No newline at end of file
+    return {"price_summary": price_summary, "calculation_context": context}
+
+def run_calculation(
+    data: Dict[str, Any], 
+    df_prices: Optional[PriceTable],
+    promotion_info: Optional[Dict[str, Any]] = None,
+    price_index: Optional[PriceIndex] = None
+) -> Dict[str, Any]:
+    
+    is_ld_service = "ЛД" in data.get('service', '')
+    prepayment_months = effective_prepayment_months(data, promotion_info)
+    fixation_months = data.get('fixation_months', 0)
+    
+    # Время этапов меряется вручную (а не через stage_timer): это самый горячий путь
+    started = time.perf_counter()
+    level_prices_info = find_price_tiers(data, df_prices, price_index)
+    tiers_found = time.perf_counter()
+    _FIND_PRICE_TIERS_STAGE.observe(tiers_found - started)
+    if not level_prices_info:
+        return {"price_summary": None, "calculation_context": None}
+
+    price_summary = _calculate_price_summary(
+        level_prices_info, data, promotion_info, is_ld_service, prepayment_months, fixation_months
+    )
+    _DECIMAL_ARITHMETIC_STAGE.observe(time.perf_counter() - tiers_found)
+    return build_calculation_result(data, level_prices_info, price_summary, prepayment_months, fixation_months)
+
+
+def run_variant_calculations(
+    data: Dict[str, Any],
+    variants: List[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]],
+    price_index: PriceIndex
+) -> Optional[List[Dict[str, float]]]:
+    """
+    Итоги нескольких вариантов одного предложения: вариант - (изменения ввода, акция).
+    Тиры от вариантов не зависят и ищутся один раз, месячные цены уровней в окнах
+    акций считаются один раз на все акции. price_summary каждого варианта - как у
+    run_calculation для data с этими изменениями. None - тарифы не найдены.
+    """
+    is_ld_service = "ЛД" in data.get('service', '')
+    level_prices_info = find_price_tiers(data, None, price_index)
+    if not level_prices_info:
+        return None
+    month_prices: Dict[Tuple[Decimal, Decimal, bool], Decimal] = {}
+    summaries = []
+    for changes, promotion_info in variants:
+        variant_data = dict(data, **changes)
+        summaries.append(_calculate_price_summary(
+            level_prices_info, variant_data, promotion_info, is_ld_service,
+            effective_prepayment_months(variant_data, promotion_info), variant_data.get('fixation_months', 0), month_prices
+        ))
+    return summaries
@@ -1,21 +1,50 @@
 # C:\excel-to-web\main.py
 
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi import FastAPI, Request, HTTPException, Query
+from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, PlainTextResponse, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel
-import pandas as pd
-from typing import List, Union, Optional, Dict, Any
-from datetime import datetime
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError
+from typing import List, Union, Optional, Dict, Any, Tuple
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+import asyncio
+import hashlib
+import io
 import json
+import os
+import secrets
+import shutil
+import signal
+import time
+import threading
+import zipfile
+from collections import deque
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from urllib.parse import quote
 from pathlib import Path
 from dateutil.relativedelta import relativedelta # <-- ВОТ ДОБАВЛЕННЫЙ ИМПОРТ
 
 # --- НАШИ МОДУЛИ ---
 import logic
+import batch_engine
+import whatif
+import data_loader
+import workbook_model
+import support_rating
+import version_comparison
+import quote_optimizer
+from calc_cache import CalculationCache
+from render_pool import RenderPool, RenderPoolBusy
+from pdf_converter import PdfConverter, PdfConverterUnavailable
 import document_generator
+import metrics
+from metrics import stage_timer
+from price_store import PriceTable, PromotionTable
 
 # --- Модели данных ---
 class LevelInput(BaseModel):
@@ -31,20 +60,129 @@ class CalculationInput(BaseModel):
     fixation_months: int = 0
     promotion_id: Optional[Union[int, str]] = None
 
+class QuoteOptimizationInput(BaseModel):
+    """Предложение для подбора: допустимые периоды предоплаты и фиксации (None - все), сколько вариантов вернуть."""
+    period: str
+    service: str
+    levels: List[LevelInput]
+    discount_percent: float = 0.0
+    prepayment_months: Optional[List[int]] = None
+    fixation_months: Optional[List[int]] = None
+    top: int = 10
+
+class WhatIfUpdate(BaseModel):
+    """Изменения для сессии "что если": только изменившиеся поля (в levels - только изменившиеся уровни)."""
+    levels: Optional[List[LevelInput]] = None
+    prepayment_months: Optional[int] = None
+    discount_percent: Optional[float] = None
+    fixation_months: Optional[int] = None
+    promotion_id: Optional[Union[int, str]] = None
+
 class PromotionAllRequest(BaseModel):
     service: str
     levels: List[str]
+
+class RatingProduct(BaseModel):
+    service: str
+    levels: List[LevelInput]
+
+class RatingSide(BaseModel):
+    period: str
+    products: List[RatingProduct]
+
+class RatingAmendment(BaseModel):
+    """Поправка к договору для расчета РС: продукты клиента до (current) и после (changed) изменения."""
+    current: RatingSide
+    changed: RatingSide
+
+class VersionChoice(BaseModel):
+    service: str
+    level: str
+
+class VersionComparisonInput(BaseModel):
+    """Две версии (сервис + уровень) для сравнения функций и цены в периоде."""
+    period: str
+    accounts: int = 1
+    left: VersionChoice
+    right: VersionChoice
+
+class SheetInput(BaseModel):
+    """Значения входных ячеек листа книги: {"E3": "Главный Бухгалтер ПРОФ", "E6": 3}."""
+    inputs: Dict[str, Any] = {}
     
 # --- Инициализация ---
 app = FastAPI()
+app.add_middleware(metrics.MetricsMiddleware)
 
 BASE_DIR = Path(__file__).resolve().parent
 app.mount("/static", StaticFiles(directory=BASE_DIR / "static"), name="static")
 templates = Jinja2Templates(directory=BASE_DIR / "templates")
 
-# --- Глобальные переменные ---
-df_prices = None
-df_promotions = None
+# --- Данные прайс-листа и акций ---
+@dataclass(frozen=True)
+class PricingData:
+    """
+    Неизменяемый снимок загруженных данных и построенных по ним индексов.
+    При перезагрузке собирается новый объект и подменяется целиком, поэтому
+    запрос, взявший current_data в начале, до конца работает с согласованными данными.
+    """
+    version: int = 0
+    prices: Optional[PriceTable] = None
+    promotions: Optional[PromotionTable] = None
+    price_index: Optional[logic.PriceIndex] = None
+    promotion_catalogue: Dict[Tuple[str, str, int], List[Dict[str, Any]]] = field(default_factory=dict)
+    promotion_selection_map: Dict[Tuple[str, frozenset], Dict[str, Any]] = field(default_factory=dict)
+    main_page: Optional["CachedBody"] = None
+    levels_by_service: Dict[str, "CachedBody"] = field(default_factory=dict)
+    sheets: Optional["LazySheetModel"] = None
+    versions: Optional[version_comparison.VersionMatrix] = None
+    source: str = ""
+    loaded_at: Optional[datetime] = None
+
+@dataclass(frozen=True)
+class CachedBody:
+    """Готовое тело ответа и его ETag (хэш содержимого)."""
+    body: bytes
+    etag: str
+
+def _cached_body(body: bytes) -> CachedBody:
+    return CachedBody(body=body, etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+
+EMPTY_LEVELS_BODY = _cached_body(b"[]")
+
+current_data = PricingData()
+
+# Кэш результатов расчета для /calculate и /download_offer
+calculation_cache = CalculationCache(
+    maxsize=int(os.environ.get("CALC_CACHE_MAXSIZE", "1024")),
+    ttl_seconds=float(os.environ.get("CALC_CACHE_TTL_SECONDS", "300")),
+)
+
+# Сессии "что если" (/calculate/whatif): промежуточные результаты расчета для живых итогов.
+# Хранятся в памяти процесса: при нескольких воркерах (serve.py) запрос может попасть
+# в воркер без этой сессии - тогда 404, и клиент открывает сессию заново.
+whatif_sessions = CalculationCache(
+    maxsize=int(os.environ.get("WHATIF_SESSIONS_MAXSIZE", "1024")),
+    ttl_seconds=float(os.environ.get("WHATIF_SESSION_TTL_SECONDS", "1800")),
+)
+
+# Пул формирования документов: генерация DOCX не блокирует event loop
+offer_render_pool = RenderPool(
+    max_workers=int(os.environ.get("OFFER_RENDER_WORKERS", "2")),
+    max_queue=int(os.environ.get("OFFER_RENDER_QUEUE", "8")),
+    timeout_seconds=float(os.environ.get("OFFER_RENDER_TIMEOUT_SECONDS", "30")),
+    mode=os.environ.get("OFFER_RENDER_MODE", "process"),
+)
+
+# Конвертер DOCX -> PDF (необязательный): пул долгоживущих unoserver/LibreOffice
+pdf_converter = PdfConverter(
+    command=os.environ.get("UNOSERVER_COMMAND") or shutil.which("unoserver"),
+    workers=int(os.environ.get("PDF_WORKERS", "1")),
+    base_port=int(os.environ.get("PDF_UNOSERVER_PORT", "2003")),
+    max_queue=int(os.environ.get("PDF_QUEUE", "4")),
+    timeout_seconds=float(os.environ.get("PDF_TIMEOUT_SECONDS", "60")),
+    cache_maxsize=int(os.environ.get("PDF_CACHE_MAXSIZE", "64")),
+)
 
 # --- Вспомогательные функции ---
 MONTH_MAP = {
@@ -64,57 +202,363 @@ def parse_period_string(period_str: str) -> datetime:
     except (ValueError, IndexError):
         return datetime(1900, 1, 1)
 
-@app.on_event("startup")
-def load_data():
-    global df_prices, df_promotions
-    DATA_DIR = BASE_DIR / "data_export"
+DATA_DIR = BASE_DIR / "data_export"
+PRICE_REQUIRED_COLUMNS = ['Сервис', 'Уровень', 'Аккаунтов', 'Стоимость без НДС', 'Период']
+PROMOTION_REQUIRED_COLUMNS = ['ТП', 'Уровень', 'Приказ', 'Месяцев', 'Условие1']
+
+# Период опроса data_export/ на изменения (0 - наблюдатель выключен)
+DATA_WATCH_INTERVAL_SECONDS = float(os.environ.get("DATA_WATCH_INTERVAL_SECONDS", "0"))
+# Токен для POST /admin/reload (не задан - эндпоинт выключен)
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+_reload_lock = threading.Lock()
+# Многопроцессный режим (serve.py): pid родительского процесса, который загрузил
+# данные до fork и перезагружает их сам (по SIGHUP), затем перезапуская воркеры
+supervisor_pid: Optional[int] = None
+
+DATA_LOAD_SECONDS = metrics.registry.gauge("tariff_data_load_duration_seconds", "Длительность последней успешной загрузки данных")
+DATA_RELOADS = metrics.registry.counter("tariff_data_reloads_total", "Загрузки данных по результату", ("status",))
+_watcher_stop = threading.Event()
 
-    # --- 1. Загрузка прайс-листа ---
-    filepath_prices = DATA_DIR / "pricelist.xlsx"
+# --- Метаданные страниц: считаются один раз на версию данных ---
+LEVEL_DISPLAY_ORDER = ["Эксперт", "Оптимальный", "Оптимальный Плюс", "Минимальный", "Базовый"]
+# Браузер и прокси каждый раз перепроверяют страницу (ETag/Last-Modified) и получают 304, пока данные не изменились
+METADATA_CACHE_CONTROL = os.environ.get("METADATA_CACHE_CONTROL", "public, no-cache")
+
+def _level_sort_key(level_name: str):
+    return (LEVEL_DISPLAY_ORDER.index(level_name) if level_name in LEVEL_DISPLAY_ORDER else float('inf'), level_name)
+
+def _main_page_context(prices: PriceTable) -> Dict[str, Any]:
+    """Списки для главной страницы; KeyError, если в прайсе нет нужного столбца."""
+    services = sorted({service for service, level in zip(prices['Сервис'], prices['Уровень']) if service is not None and level is not None})
+    levels = sorted(prices.distinct('Уровень'), key=_level_sort_key)
+    periods = sorted(prices.distinct('Период'), key=parse_period_string)
+    fixation_map_for_json = {key: float(value) for key, value in logic.FIXATION_COEFFICIENT_MAP.items()}
+    return {"services": services, "levels": levels, "periods": periods, "fixation_map_json": json.dumps(fixation_map_for_json)}
+
+def build_main_page(prices: Optional[PriceTable]) -> Optional[CachedBody]:
+    """Готовый HTML главной страницы (шаблон не зависит от запроса). None - показать страницу ошибки."""
+    if prices is None or not len(prices):
+        return None
     try:
-        string_columns = { 'Сервис': str, 'Уровень': str, 'Минут': str }
-        df_prices = pd.read_excel(filepath_prices, dtype=string_columns)
-        df_prices.dropna(axis=1, how='all', inplace=True)
-        df_prices.dropna(axis=0, how='all', inplace=True)
-        df_prices.columns = df_prices.columns.str.strip()
-        for col in ['Сервис', 'Уровень']:
-            if col in df_prices.columns: df_prices[col] = df_prices[col].str.strip()
-        if 'Период' in df_prices.columns:
-            df_prices['Период'] = pd.to_datetime(df_prices['Период'], errors='coerce')
-            df_prices.dropna(subset=['Период'], inplace=True)
-            RU_MONTHS_MAP = { 1: 'янв', 2: 'фев', 3: 'мар', 4: 'апр', 5: 'май', 6: 'июн', 7: 'июл', 8: 'авг', 9: 'сен', 10: 'окт', 11: 'ноя', 12: 'дек' }
-            df_prices['Период'] = df_prices['Период'].apply( lambda dt: f"{RU_MONTHS_MAP[dt.month]}.{str(dt.year)[-2:]}" )
-        if 'Аккаунтов' in df_prices.columns:
-            df_prices['Аккаунтов'] = pd.to_numeric(df_prices['Аккаунтов'], errors='coerce').fillna(0).astype(int)
-        if 'Минут' in df_prices.columns:
-            df_prices['Минут'] = df_prices['Минут'].astype(str).str.replace(r'\.0$', '', regex=True)
-        print(f"✓ Прайс-лист '{filepath_prices}' успешно загружен и обработан.")
-    except Exception as e:
-        print(f"!!! КРИТИЧЕСКАЯ ОШИБКА при чтении прайс-листа: {e}")
-        df_prices = None
+        context = _main_page_context(prices)
+    except KeyError:
+        return None
+    return _cached_body(templates.get_template("index.html").render(context).encode("utf-8"))
+
+def build_levels_by_service(prices: Optional[PriceTable]) -> Dict[str, CachedBody]:
+    """
+    Готовые ответы /get_levels_for_service: для каждого сервиса - уровни с минутами
+    (первая строка уровня в прайсе), отсортированные в порядке LEVEL_DISPLAY_ORDER.
+    """
+    if prices is None or not all(col in prices.columns for col in ['Сервис', 'Уровень', 'Минут']):
+        return {}
+    levels_by_service = {}
+    for service, level, minutes in zip(prices['Сервис'], prices['Уровень'], prices['Минут']):
+        if service is None or level is None: continue
+        levels_by_service.setdefault(service, {}).setdefault(level, {'Уровень': level, 'Минут': minutes})
+    return {
+        service: _cached_body(JSONResponse(sorted(levels.values(), key=lambda item: _level_sort_key(item['Уровень']))).body)
+        for service, levels in levels_by_service.items()
+    }
+
+def _is_not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            return parsedate_to_datetime(if_modified_since) >= last_modified.replace(microsecond=0)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def _conditional_response(request: Request, cached: CachedBody, media_type: str, loaded_at: Optional[datetime]) -> Response:
+    """Ответ с ETag/Last-Modified/Cache-Control; при совпадении валидаторов - 304 без тела."""
+    last_modified = loaded_at.astimezone(timezone.utc) if loaded_at else None
+    headers = {"ETag": cached.etag, "Cache-Control": METADATA_CACHE_CONTROL}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    if _is_not_modified(request, cached.etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cached.body, media_type=media_type, headers=headers)
+
+# Скомпилированная книга calc.xlsm не зависит от версии прайса: компилируется один раз
+# на процесс при первом запросе к /sheets, к каждой версии данных привязывается заново.
+# Компиляция (~0.5 с и ~60 МБ) не нужна процессам, которые листы не считают, поэтому
+# при загрузке данных книга не читается; PRELOAD_WORKBOOK=1 - собрать сразу (в serve.py -
+# в родителе до fork, воркеры получат книгу готовой).
+PRELOAD_WORKBOOK = os.environ.get("PRELOAD_WORKBOOK", "0") == "1"
+_compiled_workbook: Optional[Tuple[workbook_model.WorkbookSource, workbook_model.CompiledWorkbook]] = None
+_compiled_workbook_lock = threading.Lock()
+
+def build_sheet_model(prices: Optional[PriceTable]) -> Optional[workbook_model.SheetModel]:
+    """Листы книги, привязанные к прайсу этой версии; None - книги или прайса нет."""
+    global _compiled_workbook
+    if prices is None or not all(col in prices.columns for col in PRICE_REQUIRED_COLUMNS):
+        return None
+    with _compiled_workbook_lock:
+        if _compiled_workbook is None:
+            source = workbook_model.load_workbook_source(BASE_DIR, DATA_DIR)
+            if source is None:
+                return None
+            _compiled_workbook = (source, workbook_model.compile_workbook(source))
+        source, compiled = _compiled_workbook
+    return workbook_model.SheetModel(compiled, source, prices)
+
+class LazySheetModel:
+    """Листы книги для одной версии данных: SheetModel собирается при первом get()."""
 
-    # --- 2. Загрузка акций ---
-    filepath_promos = DATA_DIR / "promotions.xlsx"
+    def __init__(self, prices: Optional[PriceTable]):
+        self._prices = prices
+        self._lock = threading.Lock()
+        self._built = False
+        self._model: Optional[workbook_model.SheetModel] = None
+
+    def get(self) -> Optional[workbook_model.SheetModel]:
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self._model = build_sheet_model(self._prices)
+                    self._built = True
+        return self._model
+
+def build_pricing_data(prices: Optional[PriceTable], promotions: Optional[PromotionTable], version: int, source: str) -> PricingData:
+    """Строит индексы по загруженным таблицам и упаковывает все в PricingData."""
+    has_price_columns = prices is not None and all(col in prices.columns for col in PRICE_REQUIRED_COLUMNS)
+    has_promotion_columns = promotions is not None and all(col in promotions.columns for col in PROMOTION_REQUIRED_COLUMNS)
+    sheets = LazySheetModel(prices)
+    if PRELOAD_WORKBOOK:
+        sheets.get()
+    return PricingData(
+        version=version,
+        prices=prices,
+        promotions=promotions,
+        price_index=logic.PriceIndex.from_table(prices) if has_price_columns else None,
+        promotion_catalogue=build_promotion_catalogue(promotions) if has_promotion_columns else {},
+        promotion_selection_map=build_promotion_selection_map(promotions) if has_promotion_columns else {},
+        main_page=build_main_page(prices),
+        levels_by_service=build_levels_by_service(prices),
+        sheets=sheets,
+        versions=version_comparison.load_version_matrix(DATA_DIR),
+        source=source,
+        loaded_at=datetime.now(),
+    )
+
+def validate_pricing_data(new_data: PricingData) -> List[str]:
+    """Возвращает список проблем; пустой список - данные можно публиковать."""
+    problems = []
+    if new_data.prices is None or not len(new_data.prices):
+        problems.append("Прайс-лист не загружен или пуст.")
+    else:
+        missing = [col for col in PRICE_REQUIRED_COLUMNS if col not in new_data.prices.columns]
+        if missing: problems.append(f"В прайс-листе нет столбцов: {', '.join(missing)}.")
+        elif not len(new_data.price_index): problems.append("В прайс-листе нет ни одного тарифа.")
+    if new_data.promotions is not None and len(new_data.promotions):
+        missing = [col for col in PROMOTION_REQUIRED_COLUMNS if col not in new_data.promotions.columns]
+        if missing: problems.append(f"В файле акций нет столбцов: {', '.join(missing)}.")
+    return problems
+
+def _load_tables_isolated(data_dir: Path):
+    """
+    Читает xlsx в отдельном процессе, чтобы разбор openpyxl не отнимал GIL
+    у обработчиков запросов во время горячей перезагрузки.
+    """
     try:
-        df_promotions = pd.read_excel(filepath_promos)
-        df_promotions.columns = df_promotions.columns.str.strip()
-        for col in ['ТП', 'Уровень', 'Приказ', 'Условие2']:
-            if col in df_promotions.columns: df_promotions[col] = df_promotions[col].astype(str).str.strip()
-        if 'Условие1' in df_promotions.columns: df_promotions['Условие1'] = pd.to_numeric(df_promotions['Условие1'], errors='coerce').fillna(0.0)
-        if 'Месяцев' in df_promotions.columns: df_promotions['Месяцев'] = pd.to_numeric(df_promotions['Месяцев'], errors='coerce').fillna(0).astype(int)
-        print(f"✓ Акции из файла '{filepath_promos}' успешно загружены.")
-    except FileNotFoundError:
-        print(f"--- ПРЕДУПРЕЖДЕНИЕ: Файл с акциями '{filepath_promos}' не найден. Акции не будут доступны.")
-        df_promotions = pd.DataFrame()
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            return executor.submit(data_loader.load_tables, data_dir).result()
     except Exception as e:
-        print(f"!!! КРИТИЧЕСКАЯ ОШИБКА при чтении файла акций: {e}")
-        df_promotions = pd.DataFrame()
+        print(f"--- ПРЕДУПРЕЖДЕНИЕ: не удалось загрузить данные в отдельном процессе ({e}), загружаем в текущем.")
+        return data_loader.load_tables(data_dir)
+
+def reload_data(isolated: bool = False) -> Dict[str, Any]:
+    """
+    Загружает и проверяет данные, затем атомарно подменяет current_data.
+    Если новые данные не прошли проверку, а рабочие уже есть - остаются прежние.
+    """
+    global current_data
+    with _reload_lock:
+        started = time.perf_counter()
+        prices, promotions, source = _load_tables_isolated(DATA_DIR) if isolated else data_loader.load_tables(DATA_DIR)
+        new_data = build_pricing_data(prices, promotions, current_data.version + 1, source)
+        problems = validate_pricing_data(new_data)
+        elapsed = time.perf_counter() - started
+
+        if problems and current_data.prices is not None:
+            DATA_RELOADS.inc(("rejected",))
+            print(f"!!! Новые данные отклонены, продолжаем работать с версией {current_data.version}: {' '.join(problems)}")
+            return {"status": "rejected", "version": current_data.version, "problems": problems}
+
+        current_data = new_data
+        # Старые результаты относятся к прежним данным (ключ кэша содержит версию, очистка освобождает память)
+        calculation_cache.clear()
+        DATA_RELOADS.inc(("reloaded" if not problems else "loaded_with_errors",))
+        DATA_LOAD_SECONDS.set(elapsed)
+
+        rows = len(prices) if prices is not None else 0
+        print(f"✓ Данные (версия {new_data.version}) готовы за {elapsed:.3f} с (источник: {source}; строк прайса: {rows}, акций: {len(promotions)}).")
+        return {"status": "reloaded" if not problems else "loaded_with_errors", "version": new_data.version,
+                "source": source, "seconds": round(elapsed, 3), "problems": problems}
+
+def _data_files_signature() -> Tuple:
+    signature = []
+    for filename in (data_loader.PRICELIST_FILENAME, data_loader.PROMOTIONS_FILENAME,
+                     version_comparison.MATRIX_FILENAME, version_comparison.DESCRIPTIONS_FILENAME):
+        try:
+            stat = (DATA_DIR / filename).stat()
+            signature.append((filename, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append((filename, None, None))
+    return tuple(signature)
+
+class DataFilesWatcher:
+    """
+    Опрос data_export/: changed() возвращает True, когда файлы изменились
+    и не менялись в течение одного интервала опроса (запись завершена).
+    """
+
+    def __init__(self):
+        self._loaded_signature = _data_files_signature()
+        self._pending_signature = None
+
+    def changed(self) -> bool:
+        signature = _data_files_signature()
+        if signature == self._loaded_signature:
+            self._pending_signature = None
+        elif signature != self._pending_signature:
+            self._pending_signature = signature
+        else:
+            self._loaded_signature, self._pending_signature = signature, None
+            return True
+        return False
+
+def _watch_data_files(interval: float) -> None:
+    """Фоновый наблюдатель за data_export/: перезагружает данные после изменения файлов."""
+    watcher = DataFilesWatcher()
+    while not _watcher_stop.wait(interval):
+        if watcher.changed():
+            try:
+                reload_data(isolated=True)
+            except Exception as e:
+                print(f"!!! ОШИБКА горячей перезагрузки данных: {e}")
+
+@app.on_event("startup")
+def load_data():
+    if supervisor_pid is not None:
+        return  # Данные загружены родителем до fork; перезагрузкой и наблюдателем управляет serve.py
+    reload_data()
+    if DATA_WATCH_INTERVAL_SECONDS > 0 and not _watcher_stop.is_set():
+        threading.Thread(target=_watch_data_files, args=(DATA_WATCH_INTERVAL_SECONDS,), name="data-watcher", daemon=True).start()
+
+@app.on_event("startup")
+def warm_up_offer_render_pool():
+    # Воркеры поднимаются в фоне, чтобы не задерживать холодный старт
+    def warm_up():
+        try:
+            offer_render_pool.warm_up(document_generator.warm_up)
+        except Exception as e:
+            print(f"--- ПРЕДУПРЕЖДЕНИЕ: не удалось прогреть пул формирования документов: {e}")
+    threading.Thread(target=warm_up, name="render-pool-warm-up", daemon=True).start()
+
+@app.on_event("startup")
+def warm_up_pdf_converter():
+    if not pdf_converter.available:
+        print("--- ПРЕДУПРЕЖДЕНИЕ: unoserver не найден, формирование КП в PDF недоступно.")
+        return
+    def warm_up():
+        try:
+            pdf_converter.warm_up(document_generator.OFFER_TEMPLATE_PATH.read_bytes())
+            print("✓ Конвертер PDF запущен и прогрет.")
+        except Exception as e:
+            print(f"--- ПРЕДУПРЕЖДЕНИЕ: не удалось запустить конвертер PDF: {e}")
+    threading.Thread(target=warm_up, name="pdf-converter-warm-up", daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    _watcher_stop.set()
+    offer_render_pool.shutdown()
+    pdf_converter.shutdown()
+
+# --- Каталог акций ---
+def build_promotion_catalogue(promotions: PromotionTable) -> Dict[Tuple[str, str, int], List[Dict[str, Any]]]:
+    """
+    Готовит акции к быстрому поиску: строки группируются по ключу
+    (сервис в нижнем регистре, Приказ, Месяцев), а "комбо" уровни
+    разбираются один раз. Порядок строк внутри группы сохраняется.
+    """
+    catalogue = {}
+    if promotions is None:
+        return catalogue
+    for promotion in promotions:
+        if promotion.service is None: continue
+        required_levels = logic._parse_combo_level(promotion.level)
+        required_levels_lower_set = frozenset(level.lower() for level in required_levels)
+        key = (promotion.service.lower(), promotion.order, promotion.months)
+        catalogue.setdefault(key, []).append({
+            "details": promotion.as_details(),
+            "applicable_levels": required_levels,
+            "required_levels_lower_set": required_levels_lower_set,
+            "requires_main_level": len(required_levels) > 1 and MAIN_LEVEL_NAME.lower() in required_levels_lower_set,
+        })
+    return catalogue
+
+def build_promotion_selection_map(promotions: PromotionTable) -> Dict[Tuple[str, frozenset], Dict[str, Any]]:
+    """
+    Заранее собирает ответы для /get_all_promotions_for_selection.
+    Ключ - (сервис в нижнем регистре, frozenset уровней в нижнем регистре),
+    значение - готовый promotions_map для акций, предназначенных
+    В ТОЧНОСТИ для этого набора уровней.
+    """
+    rows_by_selection = {}
+    if promotions is None:
+        return {}
+    for row in promotions:
+        if row.service is None: continue
+        promo_levels = logic._parse_combo_level(row.level)
+        key = (row.service.lower(), frozenset(level.lower() for level in promo_levels))
+        rows_by_selection.setdefault(key, []).append(row)
+
+    selection_map = {}
+    for key, rows in rows_by_selection.items():
+        rows_by_promo = {}
+        for row in rows:
+            if row.order is None: continue
+            rows_by_promo.setdefault(row.order, []).append(row)
+
+        promotions_map = {}
+        for promo_name in sorted(rows_by_promo):
+            group = rows_by_promo[promo_name]
+            promo_levels = list(dict.fromkeys(row.level for row in group))
+
+            variants, seen_months = [], set()
+            for row in group:
+                if row.months in seen_months: continue
+                seen_months.add(row.months)
+                variants.append({
+                    "months": int(row.months),
+                    "discount_percent": row.discount * 100,
+                    "condition2": row.condition2
+                })
+
+            variants.sort(key=lambda x: x['months'])
+
+            promotions_map[promo_name] = {
+                "id": promo_name,
+                "name": promo_name,
+                "applicable_levels": promo_levels,
+                "variants": variants
+            }
+        if promotions_map:
+            selection_map[key] = promotions_map
+    return selection_map
 
 # --- ===== НАЧАЛО ЗАМЕНЫ ===== ---
 # --- ОБНОВЛЕННАЯ ЦЕНТРАЛИЗОВАННАЯ ФУНКЦИЯ ПОИСКА АКЦИИ ---
 def find_applicable_promotion(
     data: CalculationInput, 
-    df_promotions: pd.DataFrame
+    promotion_catalogue: Dict[Tuple[str, str, int], List[Dict[str, Any]]]
 ) -> Optional[Dict[str, Any]]:
     """
     Ищет НАИБОЛЕЕ подходящую акцию с учетом стандартных и "комбо" уровней,
@@ -143,7 +587,7 @@ def find_applicable_promotion(
         return None # Просто молча не находим акцию
     # --- КОНЕЦ БЛОКА ИЗМЕНЕНИЙ ---
 
-    if df_promotions is None or df_promotions.empty or data.promotion_id is None or data.promotion_id == 'no_promotion':
+    if not promotion_catalogue or data.promotion_id is None or data.promotion_id == 'no_promotion':
         return None
 
     user_active_levels_set = {
@@ -152,44 +596,30 @@ def find_applicable_promotion(
     if not user_active_levels_set:
         return None
 
-    service_lower = data.service.lower()
-    
     # 1. Находим ВСЕ варианты для данной акции и периода предоплаты
-    candidate_promos = df_promotions[
-        (df_promotions['ТП'].str.lower() == service_lower) &
-        (df_promotions['Приказ'] == data.promotion_id) &
-        (df_promotions['Месяцев'] == data.prepayment_months)
-    ]
-    
-    if candidate_promos.empty:
+    candidate_promos = promotion_catalogue.get((data.service.lower(), data.promotion_id, data.prepayment_months))
+    if not candidate_promos:
         return None
 
     best_match = None
     max_matched_levels = 0
 
-    # 2. Итерируемся по всем вариантам и ищем лучший
-    for _, promo_row in candidate_promos.iterrows():
-        promo_level_str = promo_row.get('Уровень', '')
-        
-        required_levels = logic._parse_combo_level(promo_level_str)
-        required_levels_lower_set = {level.lower() for level in required_levels}
-
+    # 2. Перебираем варианты (уровни уже разобраны) и ищем лучший
+    for candidate in candidate_promos:
+        required_levels_lower_set = candidate["required_levels_lower_set"]
         if not required_levels_lower_set.issubset(user_active_levels_set):
             continue
 
-        is_combo = len(required_levels) > 1
-        if is_combo:
-            main_level_in_promo = MAIN_LEVEL_NAME.lower() in required_levels_lower_set
-            if main_level_in_promo and (MAIN_LEVEL_NAME.lower() not in user_active_levels_set):
-                 continue
+        if candidate["requires_main_level"] and (MAIN_LEVEL_NAME.lower() not in user_active_levels_set):
+            continue
         
         # 3. Сравниваем, насколько хорош этот вариант
         current_match_count = len(required_levels_lower_set)
         if current_match_count > max_matched_levels:
             max_matched_levels = current_match_count
             best_match = {
-                "details": promo_row.to_dict(),
-                "applicable_levels": required_levels
+                "details": dict(candidate["details"]),
+                "applicable_levels": list(candidate["applicable_levels"])
             }
             
     return best_match
@@ -198,116 +628,102 @@ def find_applicable_promotion(
 
 # --- Маршруты (Endpoints) ---
 
+@app.post("/admin/reload")
+async def admin_reload(request: Request):
+    """
+    Горячая перезагрузка прайс-листа и акций без перезапуска сервера.
+    Загрузка и проверка идут в фоне (отдельный процесс), обработка запросов
+    продолжается на прежних данных до атомарной подмены.
+    """
+    if not ADMIN_TOKEN or request.headers.get("x-admin-token") != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Доступ запрещен.")
+    if supervisor_pid is not None:
+        # Несколько воркеров: данные перезагружает родитель, результат - в его журнале
+        os.kill(supervisor_pid, signal.SIGHUP)
+        return JSONResponse(status_code=202, content={"status": "scheduled", "version": current_data.version})
+    result = await run_in_threadpool(reload_data, True)
+    if result["status"] == "rejected":
+        raise HTTPException(status_code=422, detail=result)
+    return result
+
+@app.get("/admin/data_status")
+async def admin_data_status():
+    state = current_data
+    return {
+        "version": state.version, "source": state.source,
+        "loaded_at": state.loaded_at.isoformat() if state.loaded_at else None,
+        "price_rows": len(state.prices) if state.prices is not None else 0,
+        "promotion_rows": len(state.promotions) if state.promotions is not None else 0,
+        "worker_pid": os.getpid(),
+    }
+
+def _collect_runtime_metrics():
+    """Значения, которые читаются в момент запроса /metrics: данные, кэш, пулы."""
+    state = current_data
+    cache_stats = calculation_cache.stats()
+    render_stats = offer_render_pool.stats()
+    pdf_stats = pdf_converter.stats()
+    return [
+        ("tariff_data_version", "gauge", "Версия загруженных данных", [({}, state.version)]),
+        ("tariff_data_rows", "gauge", "Число строк загруженных данных", [
+            ({"table": "prices"}, len(state.prices) if state.prices is not None else 0),
+            ({"table": "promotions"}, len(state.promotions) if state.promotions is not None else 0),
+        ]),
+        ("tariff_data_loaded_timestamp_seconds", "gauge", "Время загрузки данных (unix)",
+         [({}, state.loaded_at.timestamp() if state.loaded_at else 0)]),
+        ("tariff_calculation_cache_entries", "gauge", "Записей в кэше расчетов", [({}, cache_stats["size"])]),
+        ("tariff_calculation_cache_requests_total", "counter", "Обращения к кэшу расчетов",
+         [({"result": "hit"}, cache_stats["hits"]), ({"result": "miss"}, cache_stats["misses"])]),
+        ("tariff_calculation_cache_evictions_total", "counter", "Вытеснения из кэша расчетов", [({}, cache_stats["evictions"])]),
+        ("tariff_render_pool_in_flight", "gauge", "Документы в работе или в очереди пула", [({}, render_stats["in_flight"])]),
+        ("tariff_render_pool_tasks_total", "counter", "Задачи пула формирования документов", [
+            ({"result": "finished"}, render_stats["finished"]), ({"result": "rejected"}, render_stats["rejected"]),
+            ({"result": "timed_out"}, render_stats["timed_out"]),
+        ]),
+        ("tariff_pdf_conversions_total", "counter", "Конвертации в PDF",
+         [({"result": "ok"}, pdf_stats["conversions"]), ({"result": "failed"}, pdf_stats["failures"])]),
+        ("tariff_pdf_cache_requests_total", "counter", "Обращения к кэшу PDF",
+         [({"result": "hit"}, pdf_stats["cache"]["hits"]), ({"result": "miss"}, pdf_stats["cache"]["misses"])]),
+    ]
+
+metrics.registry.register_collector(_collect_runtime_metrics)
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/", response_class=HTMLResponse)
 async def get_main_page(request: Request):
-    if df_prices is None or df_prices.empty:
-        return templates.TemplateResponse("error.html", {"request": request, "error_message": "Данные не загружены."})
+    state = current_data
+    if state.main_page is not None:
+        return _conditional_response(request, state.main_page, "text/html; charset=utf-8", state.loaded_at)
+    if state.prices is None or not len(state.prices):
+        return templates.TemplateResponse(request, "error.html", {"error_message": "Данные не загружены."})
     try:
-        services = sorted(df_prices.dropna(subset=['Уровень'])['Сервис'].unique().tolist())
-        levels_from_file = df_prices['Уровень'].dropna().unique().tolist()
-        custom_order = ["Эксперт", "Оптимальный", "Оптимальный Плюс", "Минимальный", "Базовый"]
-        levels = sorted(levels_from_file, key=lambda level: (custom_order.index(level) if level in custom_order else float('inf'), level))
-        periods_list = df_prices['Период'].dropna().unique().tolist()
-        periods = sorted(periods_list, key=parse_period_string)
-        fixation_map_for_json = {key: float(value) for key, value in logic.FIXATION_COEFFICIENT_MAP.items()}
-        return templates.TemplateResponse("index.html", {
-            "request": request, "services": services, "levels": levels,
-            "periods": periods,
-            "fixation_map_json": json.dumps(fixation_map_for_json)
-        })
+        _main_page_context(state.prices)
     except KeyError as e:
-        return templates.TemplateResponse("error.html", {"request": request, "error_message": f"Ошибка в данных: отсутствует столбец: {e}"})
+        return templates.TemplateResponse(request, "error.html", {"error_message": f"Ошибка в данных: отсутствует столбец: {e}"})
+    return templates.TemplateResponse(request, "error.html", {"error_message": "Не удалось подготовить страницу."})
 
 @app.get("/get_levels_for_service/{service_name}")
-async def get_levels_for_service(service_name: str):
-    if df_prices is None:
-        return []
-    try:
-        filtered_df = df_prices[df_prices['Сервис'] == service_name]
-        levels_with_minutes_df = filtered_df[['Уровень', 'Минут']].copy()
-        levels_with_minutes_df.dropna(subset=['Уровень'], inplace=True)
-        levels_with_minutes_df.drop_duplicates(subset=['Уровень'], keep='first', inplace=True)
-        custom_order = ["Эксперт", "Оптимальный", "Оптимальный Плюс", "Минимальный", "Базовый"]
-        levels_list = levels_with_minutes_df.to_dict('records')
-        def sort_key(level_dict):
-            level_name = level_dict['Уровень']
-            return (custom_order.index(level_name) if level_name in custom_order else float('inf'), level_name)
-        sorted_levels = sorted(levels_list, key=sort_key)
-        return sorted_levels
-    except Exception as e:
-        print(f"Ошибка при получении уровней для сервиса '{service_name}': {e}")
-        return []
+async def get_levels_for_service(service_name: str, request: Request):
+    # Ответы собраны заранее для каждого сервиса текущей версии данных
+    state = current_data
+    cached = state.levels_by_service.get(service_name, EMPTY_LEVELS_BODY)
+    return _conditional_response(request, cached, "application/json", state.loaded_at)
 
 @app.post("/get_all_promotions_for_selection")
 async def get_all_promotions_for_selection(data: PromotionAllRequest):
-    if df_promotions is None or df_promotions.empty:
-        return {}
-    try:
-        service_lower = data.service.lower()
-        user_levels_lower_set = {level.lower() for level in data.levels}
-
-        # Создаем маску (список True/False) для фильтрации DataFrame
-        mask = []
-        for _, row in df_promotions.iterrows():
-            is_match = False
-            # 1. Проверяем совпадение по сервису (ТП)
-            if row['ТП'].lower() == service_lower:
-                # 2. Правильно разбираем строку с уровнями из файла акций
-                promo_levels = logic._parse_combo_level(row['Уровень'])
-                promo_levels_lower_set = {level.lower() for level in promo_levels}
-                
-                # ===== НАЧАЛО ИЗМЕНЕНИЙ =====
-                # 3. Проверяем, что набор уровней пользователя В ТОЧНОСТИ СОВПАДАЕТ
-                #    с набором уровней, для которых предназначена акция.
-                if promo_levels_lower_set == user_levels_lower_set:
-                    is_match = True
-                # ===== КОНЕЦ ИЗМЕНЕНИЙ =====
-            
-            mask.append(is_match)
-        
-        filtered_df = df_promotions[mask]
-
-        if filtered_df.empty:
-            return {}
-
-        promotions_map = {}
-        for promo_name, group in filtered_df.groupby('Приказ'):
-            promo_levels = group['Уровень'].unique().tolist()
-            
-            variants = []
-            for _, row in group.drop_duplicates(subset=['Месяцев']).iterrows():
-                variants.append({
-                    "months": int(row['Месяцев']),
-                    "discount_percent": row['Условие1'] * 100,
-                    "condition2": str(row['Условие2']) if pd.notna(row['Условие2']) else None
-                })
-            
-            variants.sort(key=lambda x: x['months'])
-
-            promotions_map[promo_name] = {
-                "id": promo_name,
-                "name": promo_name,
-                "applicable_levels": promo_levels,
-                "variants": variants
-            }
-        
-        return promotions_map
-    except Exception as e:
-        print(f"!!! ОШИБКА при поиске всех акций для '{data.service}': {e}")
+    # Ответы собраны заранее в load_data: акция подходит, только если набор
+    # уровней пользователя В ТОЧНОСТИ СОВПАДАЕТ с набором уровней акции.
+    promotion_selection_map = current_data.promotion_selection_map
+    if not promotion_selection_map:
         return {}
+    key = (data.service.lower(), frozenset(level.lower() for level in data.levels))
+    return promotion_selection_map.get(key, {})
 
-@app.post("/calculate")
-async def handle_calculation(data: CalculationInput):
-    if df_prices is None: raise HTTPException(status_code=500, detail="Данные прайс-листа не загружены.")
-    
-    promotion_info = find_applicable_promotion(data, df_promotions)
-    
-    calculation_result = logic.run_calculation(
-        data.dict(), 
-        df_prices,
-        promotion_info=promotion_info
-    )
-    
+def _format_calculation_result(calculation_result: Dict[str, Any]) -> Dict[str, Any]:
+    """Формирует ответ в формате /calculate из результата logic.run_calculation."""
     if calculation_result.get("price_summary") is None:
         return {"error": "Не удалось найти тарифы для указанных позиций."}
     
@@ -319,31 +735,606 @@ async def handle_calculation(data: CalculationInput):
     }
     return final_response
 
-@app.post("/download_offer")
-async def download_offer(data: CalculationInput):
-    if df_prices is None: raise HTTPException(status_code=500, detail="Данные прайс-листа не загружены.")
-        
-    promotion_info = find_applicable_promotion(data, df_promotions)
-
+def _calculate_quote(state: PricingData, data: CalculationInput, promotion_info: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Считает одно предложение и формирует ответ в формате /calculate."""
     calculation_result = logic.run_calculation(
         data.dict(), 
-        df_prices,
-        promotion_info=promotion_info
+        state.prices,
+        promotion_info=promotion_info,
+        price_index=state.price_index
     )
+    return _format_calculation_result(calculation_result)
+
+def _calculation_cache_key(state: PricingData, data: CalculationInput) -> Tuple:
+    """
+    Канонический ключ расчета. Уровни без аккаунтов не влияют на результат и
+    отбрасываются; месяц "сегодня" входит в ключ, так как от него зависит
+    применимость акции.
+    """
+    today = datetime.now()
+    promotion_id = None if data.promotion_id == 'no_promotion' else data.promotion_id
+    return (
+        state.version, today.year, today.month,
+        data.period, data.service,
+        tuple((level.level, level.accounts) for level in data.levels if level.accounts > 0),
+        data.prepayment_months, float(data.discount_percent), data.fixation_months, promotion_id,
+    )
+
+def _run_calculation_cached(state: PricingData, data: CalculationInput) -> Dict[str, Any]:
+    """logic.run_calculation с поиском акции через кэш результатов. Результат не изменять."""
+    with stage_timer("cache_lookup"):
+        cache_key = _calculation_cache_key(state, data)
+        calculation_result = calculation_cache.get(cache_key)
+    if calculation_result is None:
+        with stage_timer("find_applicable_promotion"):
+            promotion_info = find_applicable_promotion(data, state.promotion_catalogue)
+        with stage_timer("run_calculation"):
+            calculation_result = logic.run_calculation(
+                data.dict(),
+                state.prices,
+                promotion_info=promotion_info,
+                price_index=state.price_index
+            )
+        calculation_cache.put(cache_key, calculation_result)
+    return calculation_result
+
+@app.post("/calculate")
+async def handle_calculation(data: CalculationInput):
+    state = current_data
+    if state.prices is None: raise HTTPException(status_code=500, detail="Данные прайс-листа не загружены.")
+    
+    response_content = _format_calculation_result(_run_calculation_cached(state, data))
+    # Сериализуем сами (так же, как это сделал бы FastAPI), чтобы измерить этот этап
+    with stage_timer("serialize_json"):
+        return JSONResponse(jsonable_encoder(response_content))
+
+# --- Живые итоги ("что если") ---
+def _whatif_recalculate(state: PricingData, previous: Optional[whatif.WhatIfState], data: Dict[str, Any]) -> whatif.WhatIfState:
+    def resolve_promotion(session_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return find_applicable_promotion(CalculationInput(**session_data), state.promotion_catalogue)
+
+    with stage_timer("whatif_recalculate"):
+        return whatif.recalculate(previous, data, state.version, state.price_index, resolve_promotion)
+
+def _whatif_response(session_id: str, session: whatif.WhatIfState) -> JSONResponse:
+    response_content = dict(
+        _format_calculation_result(session.result),
+        session_id=session_id, data_version=session.data_version, recalculated=session.recalculated,
+    )
+    return JSONResponse(jsonable_encoder(response_content))
+
+@app.post("/calculate/whatif")
+async def open_whatif_session(data: CalculationInput):
+    """
+    Открывает сессию "что если": полный расчет, как /calculate, с сохранением найденных
+    тиров, акции и вкладов уровней. Дальше форма шлет только изменения в PATCH.
+    """
+    state = current_data
+    if state.prices is None: raise HTTPException(status_code=500, detail="Данные прайс-листа не загружены.")
+
+    session_id = secrets.token_urlsafe(16)
+    session = _whatif_recalculate(state, None, data.dict())
+    whatif_sessions.put(session_id, session)
+    return _whatif_response(session_id, session)
+
+@app.patch("/calculate/whatif/{session_id}")
+async def update_whatif_session(session_id: str, update: WhatIfUpdate):
+    """
+    Применяет изменения (аккаунты уровня, скидку, фиксацию, ...) и пересчитывает только
+    затронутые части. Итоги совпадают с /calculate для того же ввода. После перезагрузки
+    данных сессия пересчитывается с нуля на новой версии.
+    """
+    state = current_data
+    if state.prices is None: raise HTTPException(status_code=500, detail="Данные прайс-листа не загружены.")
+    previous = whatif_sessions.get(session_id)
+    if previous is None:
+        raise HTTPException(status_code=404, detail="Сессия не найдена или истекла.")
+
+    data = whatif.merge_update(previous.data, update.dict(exclude_unset=True))
+    try:
+        CalculationInput(**data)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=_format_validation_error(e))
+    session = _whatif_recalculate(state, previous, data)
+    whatif_sessions.put(session_id, session)
+    return _whatif_response(session_id, session)
+
+@app.delete("/calculate/whatif/{session_id}")
+async def close_whatif_session(session_id: str):
+    whatif_sessions.pop(session_id)
+    return {"status": "closed"}
+
+# --- Рейтинг сопровождения (лист "Расчет РС") ---
+def _calculate_ratings(state: PricingData, items: List[Any]) -> List[Dict[str, Any]]:
+    """
+    Считает пакет поправок; тиры всех сторон и продуктов ищутся через общий кэш
+    (support_rating.TierCache). Результаты - в порядке входных данных.
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    positions, amendments = [], []
+    for position, item in enumerate(items):
+        if isinstance(item, Exception):
+            results[position] = {"error": str(item)}
+            continue
+        if not isinstance(item, dict):
+            results[position] = {"error": "Ожидается объект RatingAmendment."}
+            continue
+        try:
+            amendments.append(RatingAmendment(**item).dict())
+            positions.append(position)
+        except ValidationError as e:
+            results[position] = {"error": _format_validation_error(e)}
+
+    with stage_timer("support_rating"):
+        rating_results, _ = support_rating.calculate_amendments(amendments, state.price_index)
+    for position, rating_result in zip(positions, rating_results):
+        results[position] = rating_result
+    return results
+
+@app.post("/calculate/rating")
+async def handle_rating_calculation(data: RatingAmendment):
+    """
+    Расчет РС, как на листе "Расчет РС": цены уровней обеих сторон, базовые
+    величины периодов, РС сторон и их разница (rating_difference).
+    """
+    state = current_data
+    if state.prices is None: raise HTTPException(status_code=500, detail="Данные прайс-листа не загружены.")
+    result = _calculate_ratings(state, [data.dict()])[0]
+    return JSONResponse(jsonable_encoder(result))
+
+@app.post("/calculate/rating/batch")
+async def handle_rating_batch(request: Request):
+    """
+    Пакет поправок (JSON-массив RatingAmendment или NDJSON), например массовое
+    изменение договоров. Ответ - {"results": [...]} в том же порядке, ошибки - {"error": ...}.
+    """
+    state = current_data
+    if state.prices is None: raise HTTPException(status_code=500, detail="Данные прайс-листа не загружены.")
+
+    items = _parse_batch_body(await request.body(), request.headers.get('content-type', ''))
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Слишком большой пакет: максимум {MAX_BATCH_SIZE} расчетов.")
+    results = await run_in_threadpool(_calculate_ratings, state, items)
+    return JSONResponse(jsonable_encoder({"results": results}))
+
+# --- Сравнение версий ---
+@app.post("/compare_versions")
+async def compare_versions(data: VersionComparisonInput):
+    """
+    Сравнение двух версий, как на листе "Сравнение версий": отличающиеся функции
+    (left/right - значения из матрицы), отличающиеся разделы описания из ТП.csv и
+    цены обеих сторон в периоде через тот же индекс тиров, что /calculate.
+    price_difference - разница месячной стоимости с НДС (right - left).
+    """
+    state = current_data
+    if state.versions is None: raise HTTPException(status_code=500, detail="Данные для сравнения версий не загружены.")
+    columns = []
+    for choice in (data.left, data.right):
+        column = state.versions.resolve(choice.service, choice.level)
+        if column is None:
+            raise HTTPException(status_code=404, detail=f"Версия '{choice.service}' уровня '{choice.level}' отсутствует в данных для сравнения.")
+        columns.append(column)
+
+    with stage_timer("compare_versions"):
+        comparison = state.versions.compare(*columns)
+        sides = {}
+        for name, choice, column in (("left", data.left, columns[0]), ("right", data.right, columns[1])):
+            product, level = state.versions.columns[column]
+            sides[name] = dict(
+                version_comparison.price_side(state.price_index, choice.service, choice.level, data.period, data.accounts),
+                service=choice.service, level=choice.level, version=product, version_level=level,
+            )
+    left_price, right_price = sides["left"]["list_monthly"], sides["right"]["list_monthly"]
+    return JSONResponse(jsonable_encoder(dict(
+        comparison, data_version=state.version, period=data.period, accounts=data.accounts,
+        left=sides["left"], right=sides["right"],
+        price_difference=None if left_price is None or right_price is None else right_price - left_price,
+    )))
+
+# --- Листы книги calc.xlsm ---
+@app.post("/sheets/{sheet_name}")
+async def calculate_sheet(sheet_name: str, data: SheetInput):
+    """
+    Значения всех формул листа ("Расчет РС", "Сравнение версий") для заданных входных
+    ячеек. Пересчитываются только формулы, зависящие от измененных ячеек; остальное
+    берется из базовых значений, вычисленных при первом запросе к листам этой версии данных.
+    """
+    state = current_data
+    # Первый запрос после старта или перезагрузки компилирует книгу - не в цикле событий
+    sheets = await run_in_threadpool(state.sheets.get) if state.sheets is not None else None
+    if sheets is None: raise HTTPException(status_code=500, detail="Листы книги не загружены.")
+    try:
+        with stage_timer("sheet_recalculate"):
+            values, recalculated = sheets.evaluate(sheet_name, data.inputs)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Лист '{sheet_name}' не найден.")
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return JSONResponse(jsonable_encoder({
+        "sheet": sheet_name, "data_version": state.version, "values": values, "recalculated": recalculated,
+    }))
+
+# --- Сравнение всех акций ---
+def _promotion_variants(state: PricingData, data: CalculationInput) -> List[Tuple[Dict[str, Any], Dict[str, Any], Optional[Dict[str, Any]]]]:
+    """Варианты вида (описание, изменения ввода, акция): без скидки, ручная скидка и все подходящие акции."""
+    variants = [
+        ({"variant": "no_promotion", "promotion_id": None, "prepayment_months": data.prepayment_months, "discount_percent": 0.0},
+         {"discount_percent": 0.0, "promotion_id": None}, None),
+        ({"variant": "manual_discount", "promotion_id": None, "prepayment_months": data.prepayment_months, "discount_percent": data.discount_percent},
+         {"promotion_id": None}, None),
+    ]
+    service_key = data.service.lower()
+    for service, promotion_id, months in sorted(key for key in state.promotion_catalogue if key[0] == service_key):
+        changes = {"promotion_id": promotion_id, "prepayment_months": months}
+        promotion_info = find_applicable_promotion(CalculationInput(**dict(data.dict(), **changes)), state.promotion_catalogue)
+        if promotion_info is None: continue
+        details = promotion_info["details"]
+        variants.append(({
+            "variant": "promotion", "promotion_id": promotion_id, "prepayment_months": months,
+            "discount_percent": float(details.get('Условие1') or 0) * 100, "condition2": details.get('Условие2'),
+            "applicable_levels": promotion_info["applicable_levels"],
+        }, changes, promotion_info))
+    return variants
+
+@app.post("/calculate/promotions")
+async def compare_promotions(data: CalculationInput):
+    """
+    Один расчет вместо /calculate на каждый вариант: без скидки, с ручной скидкой
+    и по каждой подходящей акции и периоду предоплаты. Тиры ищутся один раз;
+    price_summary каждого варианта совпадает с /calculate для тех же параметров.
+    """
+    state = current_data
+    if state.prices is None: raise HTTPException(status_code=500, detail="Данные прайс-листа не загружены.")
+    with stage_timer("compare_promotions"):
+        variants = _promotion_variants(state, data)
+        summaries = logic.run_variant_calculations(
+            data.dict(), [(changes, promotion_info) for _, changes, promotion_info in variants], state.price_index
+        )
+    if summaries is None:
+        return {"error": "Не удалось найти тарифы для указанных позиций."}
+    results = [dict(description, price_summary=summary) for (description, _, _), summary in zip(variants, summaries)]
+    return JSONResponse(jsonable_encoder({"data_version": state.version, "results": results}))
+
+# --- Подбор самого выгодного варианта ---
+# Жесткий бюджет времени на перебор; не уложились - ответ по рассмотренным вариантам, complete=false
+OPTIMIZER_TIME_BUDGET_SECONDS = float(os.environ.get("OPTIMIZER_TIME_BUDGET_SECONDS", "0.05"))
+MAX_OPTIMIZER_TOP = 100
+
+@app.post("/calculate/optimize")
+async def handle_quote_optimization(data: QuoteOptimizationInput):
+    """
+    Перебирает периоды предоплаты, все применимые варианты акций и фиксацию 0-12 мес.
+    и возвращает до top недоминируемых вариантов, от меньшей месячной цены к большей.
+    price_summary каждого варианта совпадает с ответом /calculate для тех же параметров.
+    """
+    state = current_data
+    if state.prices is None: raise HTTPException(status_code=500, detail="Данные прайс-листа не загружены.")
+    prepayment_options = data.prepayment_months or list(quote_optimizer.PREPAYMENT_MONTHS)
+    fixation_options = quote_optimizer.FIXATION_MONTHS if data.fixation_months is None else data.fixation_months
+    if any(months < 1 for months in prepayment_options):
+        raise HTTPException(status_code=422, detail="Период предоплаты - не меньше 1 месяца.")
+    if not fixation_options or any(months not in quote_optimizer.FIXATION_MONTHS for months in fixation_options):
+        raise HTTPException(status_code=422, detail="Месяцев фиксации - от 0 до 12.")
+    if not 1 <= data.top <= MAX_OPTIMIZER_TOP:
+        raise HTTPException(status_code=422, detail=f"top - от 1 до {MAX_OPTIMIZER_TOP}.")
+
+    request_data = data.dict(exclude={'prepayment_months', 'fixation_months', 'top'})
+    service_key = data.service.lower()
+    promotion_variants = [(promotion_id, months) for service, promotion_id, months in state.promotion_catalogue if service == service_key]
+
+    def resolve_promotion(promotion_id, months):
+        candidate = CalculationInput(**dict(request_data, prepayment_months=months, promotion_id=promotion_id))
+        return find_applicable_promotion(candidate, state.promotion_catalogue)
+
+    with stage_timer("optimize_quote"):
+        result = quote_optimizer.optimize_quote(
+            request_data, state.price_index, promotion_variants, resolve_promotion,
+            prepayment_options, fixation_options, data.top, OPTIMIZER_TIME_BUDGET_SECONDS,
+        )
+    if result is None:
+        return {"error": "Не удалось найти тарифы для указанных позиций."}
+    return JSONResponse(jsonable_encoder(dict(result, data_version=state.version)))
+
+@app.get("/calculate/cache_stats")
+async def get_calculation_cache_stats():
+    return dict(calculation_cache.stats(), data_version=current_data.version)
+
+# --- Пакетный расчет ---
+MAX_BATCH_SIZE = 10000
+
+def _parse_batch_body(body: bytes, content_type: str) -> List[Any]:
+    """
+    Разбирает тело пакетного запроса: JSON-массив или NDJSON (один объект на строку).
+    Битая строка NDJSON не ломает весь пакет - на ее месте будет ошибка.
+    """
+    text = body.decode('utf-8-sig')
+    if 'ndjson' in content_type or 'jsonl' in content_type:
+        items = []
+        for line_number, line in enumerate(text.splitlines(), start=1):
+            if not line.strip(): continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                items.append(ValueError(f"Строка {line_number}: некорректный JSON ({e.msg})."))
+        return items
+    try:
+        items = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Некорректный JSON: {e.msg}.")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Ожидается массив объектов CalculationInput.")
+    return items
+
+def _format_validation_error(e: ValidationError) -> str:
+    problems = "; ".join(f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors())
+    return f"Некорректные входные данные: {problems}"
+
+def _calculate_batch(state: PricingData, items: List[Any]) -> List[Dict[str, Any]]:
+    """
+    Считает пакет предложений. Поиск акции выполняется один раз
+    для каждой уникальной комбинации (период, сервис, акция, месяцы, уровни).
+    Предложения без акции считаются векторно (batch_engine), с акцией - по
+    Decimal-пути. Результаты возвращаются в порядке входных данных.
+    """
+    promotions_by_key = {}
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    plain_positions, plain_inputs = [], []
+    for position, item in enumerate(items):
+        if isinstance(item, Exception):
+            results[position] = {"error": str(item)}
+            continue
+        if not isinstance(item, dict):
+            results[position] = {"error": "Ожидается объект CalculationInput."}
+            continue
+        try:
+            data = CalculationInput(**item)
+        except ValidationError as e:
+            results[position] = {"error": _format_validation_error(e)}
+            continue
+
+        promotion_key = (
+            data.period, data.service.lower(), data.promotion_id, data.prepayment_months,
+            frozenset(level.level.lower() for level in data.levels if level.accounts > 0)
+        )
+        if promotion_key not in promotions_by_key:
+            promotions_by_key[promotion_key] = find_applicable_promotion(data, state.promotion_catalogue)
+        promotion_info = promotions_by_key[promotion_key]
+
+        if promotion_info is None:
+            plain_positions.append(position)
+            plain_inputs.append(data)
+            continue
+        try:
+            results[position] = _calculate_quote(state, data, promotion_info)
+        except Exception as e:
+            print(f"!!! ОШИБКА пакетного расчета для '{data.service}': {e}")
+            results[position] = {"error": "Ошибка расчета."}
+
+    try:
+        batch_results = batch_engine.run_batch_calculation([data.dict() for data in plain_inputs], state.price_index)
+    except Exception as e:
+        # Одна плохая позиция не должна ломать весь пакет - считаем позиции по одной
+        print(f"!!! ОШИБКА векторного расчета пакета, расчет по одному: {e}")
+        for position, data in zip(plain_positions, plain_inputs):
+            try:
+                results[position] = _calculate_quote(state, data, None)
+            except Exception as e:
+                print(f"!!! ОШИБКА пакетного расчета для '{data.service}': {e}")
+                results[position] = {"error": "Ошибка расчета."}
+        return results
+    for position, calculation_result in zip(plain_positions, batch_results):
+        results[position] = _format_calculation_result(calculation_result) if calculation_result else {"error": "Ошибка расчета."}
+    return results
+
+@app.post("/calculate/batch")
+async def handle_batch_calculation(request: Request):
+    """
+    Пакетный расчет: принимает JSON-массив CalculationInput или NDJSON-поток
+    (Content-Type: application/x-ndjson). Ответ - {"results": [...]} в том же порядке;
+    каждый элемент - ответ /calculate либо {"error": ...}.
+    """
+    state = current_data
+    if state.prices is None: raise HTTPException(status_code=500, detail="Данные прайс-листа не загружены.")
+
+    items = _parse_batch_body(await request.body(), request.headers.get('content-type', ''))
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Слишком большой пакет: максимум {MAX_BATCH_SIZE} расчетов.")
+
+    results = await run_in_threadpool(_calculate_batch, state, items)
+    return {"results": results}
+
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+def _offer_filename(context: Dict[str, Any], extension: str = "docx") -> str:
+    service_name_slug = context.get('service_name', 'offer').replace('/', '_')
+    return f"КП {service_name_slug} от {context['current_date']}.{extension}"
+
+def _unique_filename(filename: str, used_filenames: set) -> str:
+    """Добавляет " (2)", " (3)"... к имени, если такое уже есть в архиве."""
+    stem, suffix = os.path.splitext(filename)
+    candidate, copy_number = filename, 2
+    while candidate in used_filenames:
+        candidate = f"{stem} ({copy_number}){suffix}"
+        copy_number += 1
+    used_filenames.add(candidate)
+    return candidate
+
+def _attachment_header(filename: str) -> str:
+    return f"attachment; filename*=UTF-8''{quote(filename)}"
+
+@app.post("/download_offer")
+async def download_offer(data: CalculationInput, output_format: str = Query("docx", alias="format")):
+    """Формирует КП по расчету. format=pdf - документ в PDF (если доступен конвертер)."""
+    state = current_data
+    if state.prices is None: raise HTTPException(status_code=500, detail="Данные прайс-листа не загружены.")
+    if output_format not in ("docx", "pdf"):
+        raise HTTPException(status_code=400, detail="Параметр format может быть 'docx' или 'pdf'.")
+    if output_format == "pdf" and not pdf_converter.available:
+        raise HTTPException(status_code=503, detail="Формирование КП в PDF недоступно на сервере.")
+        
+    calculation_result = _run_calculation_cached(state, data)
     
     context = calculation_result.get("calculation_context")
     if not context:
         raise HTTPException(status_code=404, detail="Не удалось рассчитать данные для формирования предложения.")
         
+    # Результат может лежать в кэше - дополняем копию, а не сам объект
+    context = dict(context)
     context['current_date'] = datetime.now().strftime("%d.%m.%Y")
-    document_stream = document_generator.create_offer_document(context)
-    if not document_stream:
+    try:
+        with stage_timer("render_docx"):
+            document_bytes = await offer_render_pool.run(document_generator.render_offer_bytes, context)
+    except RenderPoolBusy:
+        raise HTTPException(status_code=503, detail="Сервер занят формированием других документов, повторите попытку позже.", headers={"Retry-After": "5"})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Формирование документа заняло слишком много времени.")
+    if not document_bytes:
         raise HTTPException(status_code=500, detail="Произошла ошибка при создании документа.")
         
-    service_name_slug = context.get('service_name', 'offer').replace('/', '_')
-    date_str = context['current_date']
-    original_filename = f"КП {service_name_slug} от {date_str}.docx"
-    encoded_filename = quote(original_filename)
-    media_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-    headers = {'Content-Disposition': f"attachment; filename*=UTF-8''{encoded_filename}"}
-    return StreamingResponse(document_stream, media_type=media_type, headers=headers)
\ No newline at end of file
+    media_type = DOCX_MEDIA_TYPE
+    if output_format == "pdf":
+        try:
+            with stage_timer("convert_pdf"):
+                document_bytes = await pdf_converter.convert(document_bytes)
+        except (PdfConverterUnavailable, RenderPoolBusy):
+            raise HTTPException(status_code=503, detail="Конвертер PDF сейчас недоступен, повторите попытку позже.", headers={"Retry-After": "10"})
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Конвертация документа в PDF заняла слишком много времени.")
+        except Exception:
+            raise HTTPException(status_code=500, detail="Произошла ошибка при конвертации документа в PDF.")
+        media_type = "application/pdf"
+
+    headers = {'Content-Disposition': _attachment_header(_offer_filename(context, output_format))}
+    return StreamingResponse(io.BytesIO(document_bytes), media_type=media_type, headers=headers)
+
+@app.get("/download_offer/pdf_status")
+async def get_pdf_converter_status():
+    return pdf_converter.stats()
+
+# --- Пакетное формирование КП (ZIP-архив) ---
+MAX_OFFER_BATCH_SIZE = 1000
+
+class _ZipChunkWriter:
+    """Приемник для zipfile без seek: копит записанные байты до очередной отдачи клиенту."""
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+# Места в пуле для документов архивов: все архивы вместе занимают не больше
+# max_workers задач, остаток очереди пула остается одиночным /download_offer.
+# Семафор создается на event loop и пул (пул можно подменить, loop - перезапустить).
+_archive_render_slots: Optional[Tuple[Any, RenderPool, asyncio.Semaphore]] = None
+
+def _get_archive_render_slots() -> asyncio.Semaphore:
+    global _archive_render_slots
+    loop, pool = asyncio.get_running_loop(), offer_render_pool
+    if _archive_render_slots is None or _archive_render_slots[0] is not loop or _archive_render_slots[1] is not pool:
+        _archive_render_slots = (loop, pool, asyncio.Semaphore(pool.max_workers))
+    return _archive_render_slots[2]
+
+async def _render_offer_for_archive(context: Dict[str, Any]) -> Optional[bytes]:
+    """
+    Рендер документа для архива: ждем свободного места в пуле не дольше его таймаута,
+    затем asyncio.TimeoutError. RenderPoolBusy - очередь пула заняли одиночные запросы.
+    """
+    slots = _get_archive_render_slots()
+    await asyncio.wait_for(slots.acquire(), timeout=offer_render_pool.timeout_seconds)
+    try:
+        return await offer_render_pool.run(document_generator.render_offer_bytes, context)
+    finally:
+        slots.release()
+
+async def _stream_offer_archive(jobs: List[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]):
+    """
+    Отдает ZIP-архив по частям по мере готовности документов.
+    Одновременно рендерится не больше документов, чем воркеров в пуле, а в памяти
+    держатся только они и текущая часть архива - пиковая память не зависит от размера пакета.
+    Документы в архиве идут в порядке запроса; ошибки собираются в "Ошибки.txt".
+    """
+    sink = _ZipChunkWriter()
+    archive = zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED)  # docx уже сжат
+    used_filenames, errors = set(), []
+    window = max(1, offer_render_pool.max_workers)
+    pending = deque()
+    remaining_jobs = iter(jobs)
+
+    def schedule():
+        while len(pending) < window:
+            job = next(remaining_jobs, None)
+            if job is None: return
+            number, context, error = job
+            task = asyncio.ensure_future(_render_offer_for_archive(context)) if context else None
+            pending.append((number, context, error, task))
+
+    try:
+        schedule()
+        while pending:
+            number, context, error, task = pending.popleft()
+            document_bytes = None
+            if task is not None:
+                try:
+                    document_bytes = await task
+                except asyncio.TimeoutError:
+                    error = "Формирование документа заняло слишком много времени."
+                except RenderPoolBusy:
+                    error = "Сервер занят формированием других документов, повторите попытку позже."
+                except Exception as e:
+                    # Например, BrokenProcessPool или ошибка сериализации: архив все равно дописываем
+                    print(f"!!! ОШИБКА формирования документа {number} для архива: {e!r}")
+                if not document_bytes and error is None:
+                    error = "Произошла ошибка при создании документа."
+            schedule()
+            if document_bytes:
+                archive.writestr(_unique_filename(_offer_filename(context), used_filenames), document_bytes)
+                yield sink.drain()
+            else:
+                errors.append(f"{number}: {error}")
+        if errors:
+            archive.writestr("Ошибки.txt", "\n".join(errors))
+        archive.close()
+        yield sink.drain()
+    finally:
+        # Клиент отключился или произошла ошибка - не оставляем задачи в пуле
+        for *_, task in pending:
+            if task is not None: task.cancel()
+
+@app.post("/download_offers")
+async def download_offers(request: Request):
+    """
+    Пакетное формирование КП: принимает JSON-массив CalculationInput или NDJSON
+    (как /calculate/batch) и потоком отдает ZIP-архив с документами.
+    Позиции, которые не удалось рассчитать или сформировать, перечислены
+    в файле "Ошибки.txt" внутри архива (номер позиции с 1).
+    """
+    state = current_data
+    if state.prices is None: raise HTTPException(status_code=500, detail="Данные прайс-листа не загружены.")
+
+    items = _parse_batch_body(await request.body(), request.headers.get('content-type', ''))
+    if not items:
+        raise HTTPException(status_code=400, detail="Пустой пакет.")
+    if len(items) > MAX_OFFER_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Слишком большой пакет: максимум {MAX_OFFER_BATCH_SIZE} предложений.")
+
+    results = await run_in_threadpool(_calculate_batch, state, items)
+    current_date = datetime.now().strftime("%d.%m.%Y")
+    jobs = []
+    for number, result in enumerate(results, start=1):
+        context = result.get("calculation_context")
+        if context:
+            jobs.append((number, dict(context, current_date=current_date), None))
+        else:
+            jobs.append((number, None, result.get("error", "Не удалось рассчитать данные для формирования предложения.")))
+
+    headers = {'Content-Disposition': _attachment_header(f"КП от {current_date}.zip")}
+    return StreamingResponse(_stream_offer_archive(jobs), media_type="application/zip", headers=headers)
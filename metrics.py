@@ -0,0 +1,257 @@
+# C:\excel-to-web\metrics.py
+
+import bisect
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+# ================================================================
+# МЕТРИКИ В ФОРМАТЕ PROMETHEUS (БЕЗ ВНЕШНИХ ЗАВИСИМОСТЕЙ)
+# ================================================================
+# Счетчики, гистограммы и значения (gauge) хранятся в памяти процесса и
+# отдаются текстом на /metrics. Запись - одна блокировка и bisect по
+# границам корзин (доли микросекунды), поэтому таймеры можно держать
+# включенными в горячем пути.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STAGE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 0.5, 2.5)
+
+Sample = Tuple[Dict[str, str], float]
+
+
+def _escape_label_value(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _labels(self, label_values: Tuple) -> Dict[str, Any]:
+        return dict(zip(self.labelnames, label_values))
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._render_samples()
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, label_values: Tuple = (), amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, label_values: Tuple = ()) -> float:
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def _render_samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self._labels(labels))} {_format_value(value)}" for labels, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, label_values: Tuple = ()) -> None:
+        with self._lock:
+            self._values[label_values] = value
+
+
+class _HistogramSeries:
+    """Ряд гистограммы для одного набора меток; можно получить заранее через Histogram.labels()."""
+    __slots__ = ("buckets", "bucket_counts", "total", "count", "_lock")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)  # последняя корзина - +Inf
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.total += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.bucket_counts), self.total, self.count
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, _HistogramSeries] = {}
+
+    def labels(self, *label_values) -> _HistogramSeries:
+        series = self._series.get(label_values)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(label_values, _HistogramSeries(self.buckets))
+        return series
+
+    def observe(self, value: float, label_values: Tuple = ()) -> None:
+        self.labels(*label_values).observe(value)
+
+    def count(self, label_values: Tuple = ()) -> int:
+        series = self._series.get(label_values)
+        return series.count if series else 0
+
+    def _render_samples(self):
+        with self._lock:
+            items = sorted(self._series.items())
+        lines = []
+        for label_values, series in items:
+            bucket_counts, total, count = series.snapshot()
+            labels = self._labels(label_values)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(dict(labels, le=_format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {repr(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Набор метрик процесса плюс функции-сборщики значений, читаемых в момент запроса /metrics."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]] = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]) -> None:
+        """collector() возвращает [(имя, тип, описание, [(метки, значение), ...]), ...]."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                print(f"--- ПРЕДУПРЕЖДЕНИЕ: сборщик метрик завершился с ошибкой: {e}")
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_DURATION = registry.histogram(
+    "tariff_stage_duration_seconds", "Длительность этапов обработки запроса", ("stage",), buckets=STAGE_BUCKETS
+)
+REQUESTS_TOTAL = registry.counter("tariff_http_requests_total", "Число HTTP-запросов", ("method", "route", "status"))
+REQUEST_DURATION = registry.histogram(
+    "tariff_http_request_duration_seconds", "Длительность HTTP-запросов (до отправки ответа целиком)", ("method", "route")
+)
+REQUESTS_IN_FLIGHT = registry.gauge("tariff_http_requests_in_flight", "Запросы в обработке")
+
+# ================================================================
+# ТАЙМЕР ЭТАПОВ И ASGI-MIDDLEWARE
+# ================================================================
+
+class stage_timer:
+    """
+    with stage_timer("find_price_tiers"): ...
+    Записывает длительность блока в tariff_stage_duration_seconds{stage=...}.
+    """
+    __slots__ = ("_series", "_started")
+
+    def __init__(self, stage: str):
+        self._series = STAGE_DURATION.labels(stage)
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._series.observe(time.perf_counter() - self._started)
+        return False
+
+
+def stage(stage_name: str) -> _HistogramSeries:
+    """Заранее полученный ряд этапа - для самых горячих мест, где время меряется вручную."""
+    return STAGE_DURATION.labels(stage_name)
+
+
+class MetricsMiddleware:
+    """
+    Считает запросы и их длительность по шаблону маршрута ("/get_levels_for_service/{service_name}"),
+    а не по фактическому пути, чтобы число рядов метрик не зависело от входных данных.
+    Для потоковых ответов время считается до отправки последней части.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc(amount=1)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_FLIGHT.inc(amount=-1)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope.get("method", "")
+            REQUEST_DURATION.observe(time.perf_counter() - started, (method, route))
+            REQUESTS_TOTAL.inc((method, route, str(status[0])))
@@ -0,0 +1,236 @@
+# C:\excel-to-web\pdf_converter.py
+
+import hashlib
+import io
+import os
+import queue
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import xmlrpc.client
+import zipfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from calc_cache import CalculationCache
+from render_pool import RenderPool
+
+# ================================================================
+# КОНВЕРТАЦИЯ DOCX -> PDF ЧЕРЕЗ ПУЛ "ТЕПЛЫХ" ПРОЦЕССОВ LIBREOFFICE
+# ================================================================
+# Запуск LibreOffice на каждый запрос занимает секунды и на VM с одним CPU
+# быстро перегружает сервер. Вместо этого держим несколько долгоживущих
+# процессов unoserver (https://github.com/unoconv/unoserver): каждый хранит
+# запущенный headless LibreOffice и принимает задания по XML-RPC на своем порту.
+# Одновременно конвертируется не больше документов, чем воркеров; зависший
+# воркер по таймауту перезапускается. Готовые PDF кэшируются по хэшу
+# содержимого DOCX.
+
+
+class PdfConverterUnavailable(Exception):
+    """Конвертер не настроен (нет unoserver) или не смог запуститься."""
+
+
+def docx_digest(document_bytes: bytes) -> str:
+    """
+    Хэш содержимого DOCX. Считается по именам и распакованным данным частей,
+    а не по байтам архива: zip хранит время записи, и один и тот же документ,
+    сформированный в разные секунды, дал бы разные хэши.
+    """
+    digest = hashlib.sha256()
+    try:
+        with zipfile.ZipFile(io.BytesIO(document_bytes)) as archive:
+            for name in sorted(archive.namelist()):
+                digest.update(name.encode("utf-8") + b"\0")
+                digest.update(archive.read(name))
+    except zipfile.BadZipFile:
+        digest.update(document_bytes)
+    return digest.hexdigest()
+
+
+class _TimeoutTransport(xmlrpc.client.Transport):
+    def __init__(self, timeout: float):
+        super().__init__()
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        connection.timeout = self.timeout
+        return connection
+
+
+class _UnoserverWorker:
+    """Один процесс unoserver со своим профилем LibreOffice и парой портов."""
+
+    def __init__(self, command: str, port: int, uno_port: int, profile_dir: Path, startup_timeout: float):
+        self.command = command
+        self.port = port
+        self.uno_port = uno_port
+        self.profile_dir = profile_dir
+        self.startup_timeout = startup_timeout
+        self.process: Optional[subprocess.Popen] = None
+        self.restarts = 0
+
+    def start(self) -> None:
+        self.process = subprocess.Popen(
+            [
+                self.command, "--interface", "127.0.0.1", "--port", str(self.port),
+                "--uno-port", str(self.uno_port), "--user-installation", self.profile_dir.as_uri(),
+            ],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True,
+        )
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise PdfConverterUnavailable(f"unoserver на порту {self.port} завершился при запуске (код {self.process.returncode}).")
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=0.5):
+                    return
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise PdfConverterUnavailable(f"unoserver на порту {self.port} не запустился за {self.startup_timeout:.0f} с.")
+
+    def stop(self) -> None:
+        process, self.process = self.process, None
+        if process is None or process.poll() is not None:
+            return
+        # unoserver запускает soffice дочерним процессом - останавливаем всю группу
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def restart(self) -> None:
+        self.stop()
+        self.restarts += 1
+        self.start()
+
+    def convert(self, document_bytes: bytes, timeout: float) -> bytes:
+        proxy = xmlrpc.client.ServerProxy(f"http://127.0.0.1:{self.port}", transport=_TimeoutTransport(timeout), allow_none=True)
+        result = proxy.convert(None, xmlrpc.client.Binary(document_bytes), None, "pdf")
+        return result.data if isinstance(result, xmlrpc.client.Binary) else bytes(result)
+
+
+class PdfConverter:
+    """
+    Пул воркеров unoserver с ограничением параллелизма, таймаутом и кэшем PDF.
+
+    - command: путь к unoserver; None - конвертер недоступен (PdfConverterUnavailable);
+    - workers: число процессов LibreOffice (на одном CPU разумно 1);
+    - max_queue: сколько заданий может ждать свободного воркера, сверх этого - RenderPoolBusy;
+    - timeout_seconds: ограничение на одну конвертацию, затем asyncio.TimeoutError
+      и перезапуск воркера.
+    """
+
+    def __init__(
+        self, command: Optional[str], workers: int = 1, base_port: int = 2003, max_queue: int = 4,
+        timeout_seconds: float = 60.0, startup_timeout: float = 60.0,
+        cache_maxsize: int = 64, cache_ttl_seconds: float = 3600.0,
+    ):
+        self.command = command
+        self.workers_count = max(1, workers)
+        self.base_port = base_port
+        self.timeout_seconds = timeout_seconds
+        self.startup_timeout = startup_timeout
+        self.cache = CalculationCache(maxsize=cache_maxsize, ttl_seconds=cache_ttl_seconds)
+        self._pool = RenderPool(max_workers=self.workers_count, max_queue=max_queue, timeout_seconds=timeout_seconds, mode="thread")
+        self._lock = threading.Lock()
+        self._workers: List[_UnoserverWorker] = []
+        self._idle: "queue.Queue[_UnoserverWorker]" = queue.Queue()
+        self._profiles_dir: Optional[tempfile.TemporaryDirectory] = None
+        self.conversions = 0
+        self.failures = 0
+
+    @property
+    def available(self) -> bool:
+        return bool(self.command)
+
+    def _ensure_started(self) -> None:
+        if not self.available:
+            raise PdfConverterUnavailable("Конвертер PDF не настроен (unoserver не найден).")
+        with self._lock:
+            if self._workers:
+                return
+            self._profiles_dir = tempfile.TemporaryDirectory(prefix="unoserver-")
+            started = []
+            try:
+                for number in range(self.workers_count):
+                    port = self.base_port + 2 * number
+                    worker = _UnoserverWorker(
+                        self.command, port, port + 1, Path(self._profiles_dir.name) / f"worker{number}", self.startup_timeout
+                    )
+                    worker.start()
+                    started.append(worker)
+            except Exception:
+                for worker in started:
+                    worker.stop()
+                self._profiles_dir.cleanup()
+                self._profiles_dir = None
+                raise
+            self._workers = started
+            for worker in started:
+                self._idle.put(worker)
+
+    def _convert_blocking(self, document_bytes: bytes) -> bytes:
+        self._ensure_started()
+        worker = self._idle.get()
+        try:
+            pdf_bytes = worker.convert(document_bytes, self.timeout_seconds)
+            with self._lock:
+                self.conversions += 1
+            return pdf_bytes
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+            print(f"!!! ОШИБКА конвертации в PDF (порт {worker.port}), воркер будет перезапущен: {e}")
+            try:
+                worker.restart()
+            except PdfConverterUnavailable as restart_error:
+                print(f"!!! ОШИБКА перезапуска конвертера PDF: {restart_error}")
+            raise
+        finally:
+            self._idle.put(worker)
+
+    async def convert(self, document_bytes: bytes) -> bytes:
+        """Конвертирует DOCX в PDF (или берет готовый PDF из кэша по хэшу содержимого DOCX)."""
+        if not self.available:
+            raise PdfConverterUnavailable("Конвертер PDF не настроен (unoserver не найден).")
+        key = docx_digest(document_bytes)
+        pdf_bytes = self.cache.get(key)
+        if pdf_bytes is None:
+            pdf_bytes = await self._pool.run(self._convert_blocking, document_bytes)
+            self.cache.put(key, pdf_bytes)
+        return pdf_bytes
+
+    def warm_up(self, sample_document: bytes) -> None:
+        """Запускает все воркеры и прогоняет через каждый пробный документ."""
+        self._ensure_started()
+        for worker in list(self._workers):
+            worker.convert(sample_document, self.timeout_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            workers = {
+                "available": self.available, "workers": len(self._workers),
+                "restarts": sum(worker.restarts for worker in self._workers),
+                "conversions": self.conversions, "failures": self.failures,
+            }
+        return dict(workers, pool=self._pool.stats(), cache=self.cache.stats())
+
+    def shutdown(self) -> None:
+        self._pool.shutdown()
+        with self._lock:
+            workers, self._workers = self._workers, []
+            profiles_dir, self._profiles_dir = self._profiles_dir, None
+        for worker in workers:
+            worker.stop()
+        if profiles_dir is not None:
+            profiles_dir.cleanup()
@@ -0,0 +1,132 @@
+# C:\excel-to-web\price_store.py
+
+import sys
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# ================================================================
+# КОМПАКТНОЕ ХРАНИЛИЩЕ ПРАЙС-ЛИСТА И АКЦИЙ (БЕЗ PANDAS)
+# ================================================================
+# pandas нужен только data_loader'у для разбора xlsx. В памяти процесса
+# прайс-лист хранится по столбцам: текст - кортежи интернированных строк
+# (тысячи повторов "Сервис"/"Уровень"/"Период" - один объект), числа -
+# array('q') / array('d'). Акции - записи со __slots__. Эти объекты же
+# попадают в снимок данных, поэтому рабочий процесс не импортирует pandas
+# ни при старте, ни при обработке запросов.
+
+PRICE_TEXT_COLUMNS = ('Сервис', 'Уровень', 'Период', 'Минут')
+PRICE_INT_COLUMNS = ('Аккаунтов',)
+PRICE_FLOAT_COLUMNS = ('Стоимость без НДС',)
+PRICE_COLUMNS = PRICE_TEXT_COLUMNS + PRICE_INT_COLUMNS + PRICE_FLOAT_COLUMNS
+
+
+def is_missing(value: Any) -> bool:
+    """None или NaN (NaN - единственное значение, не равное самому себе)."""
+    return value is None or value != value
+
+
+def _text(value: Any) -> Optional[str]:
+    if is_missing(value):
+        return None
+    return sys.intern(value if isinstance(value, str) else str(value))
+
+
+def _number(value: Any, default: float) -> float:
+    return default if is_missing(value) else value
+
+
+class PriceTable:
+    """
+    Прайс-лист по столбцам. Доступ как к таблице: table['Сервис'] - последовательность
+    значений столбца (KeyError, если столбца не было в исходных данных), 'Минут' in
+    table.columns, len(table). Пропуски в тексте - None, в "Аккаунтов" - 0 (как в загрузчике).
+    """
+    __slots__ = ('columns', '_columns', '_length')
+
+    def __init__(self, columns: Dict[str, Sequence], length: int):
+        self.columns: Tuple[str, ...] = tuple(columns)
+        self._columns = columns
+        self._length = length
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, Any]], columns: Optional[Sequence[str]] = None) -> 'PriceTable':
+        """
+        Собирает таблицу из строк-словарей. Сохраняются только столбцы, нужные приложению
+        (PRICE_COLUMNS); columns - список столбцов источника (иначе - по ключам строк).
+        """
+        records = list(records)
+        if columns is None:
+            columns = list(dict.fromkeys(key for record in records for key in record))
+        present = [column for column in PRICE_COLUMNS if column in columns]
+        data: Dict[str, Sequence] = {}
+        for column in present:
+            values = [record.get(column) for record in records]
+            if column in PRICE_INT_COLUMNS:
+                data[column] = array('q', (int(_number(value, 0)) for value in values))
+            elif column in PRICE_FLOAT_COLUMNS:
+                data[column] = array('d', (float(_number(value, float('nan'))) for value in values))
+            else:
+                data[column] = tuple(_text(value) for value in values)
+        return cls(data, len(records))
+
+    def __getitem__(self, column: str) -> Sequence:
+        return self._columns[column]
+
+    def __len__(self) -> int:
+        return self._length
+
+    def distinct(self, column: str) -> List[Any]:
+        """Уникальные непустые значения столбца в порядке первого появления."""
+        return [value for value in dict.fromkeys(self._columns[column]) if value is not None]
+
+
+class PromotionRecord:
+    """Строка файла акций: только поля, которые использует расчет и подбор акций."""
+    __slots__ = ('service', 'level', 'order', 'months', 'discount', 'condition2')
+
+    def __init__(self, service: Optional[str], level: Optional[str], order: Optional[str],
+                 months: Optional[int], discount: Optional[float], condition2: Optional[str]):
+        self.service = service
+        self.level = level
+        self.order = order
+        self.months = months
+        self.discount = discount
+        self.condition2 = condition2
+
+    def as_details(self) -> Dict[str, Any]:
+        """Словарь с исходными названиями столбцов - в таком виде акцию принимает logic.run_calculation."""
+        return {
+            'ТП': self.service, 'Уровень': self.level, 'Приказ': self.order,
+            'Месяцев': self.months, 'Условие1': self.discount, 'Условие2': self.condition2,
+        }
+
+
+class PromotionTable:
+    """Акции: кортеж PromotionRecord плюс список столбцов исходного файла (для проверки данных)."""
+    __slots__ = ('columns', 'records')
+
+    def __init__(self, records: Sequence[PromotionRecord] = (), columns: Sequence[str] = ()):
+        self.records: Tuple[PromotionRecord, ...] = tuple(records)
+        self.columns: Tuple[str, ...] = tuple(columns)
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, Any]], columns: Optional[Sequence[str]] = None) -> 'PromotionTable':
+        records = list(records)
+        if columns is None:
+            columns = list(dict.fromkeys(key for record in records for key in record))
+        promotions = []
+        for record in records:
+            months, discount = record.get('Месяцев'), record.get('Условие1')
+            promotions.append(PromotionRecord(
+                service=_text(record.get('ТП')), level=_text(record.get('Уровень')), order=_text(record.get('Приказ')),
+                months=None if is_missing(months) else int(months),
+                discount=None if is_missing(discount) else float(discount),
+                condition2=_text(record.get('Условие2')),
+            ))
+        return cls(promotions, columns)
+
+    def __iter__(self) -> Iterator[PromotionRecord]:
+        return iter(self.records)
+
+    def __len__(self) -> int:
+        return len(self.records)
@@ -0,0 +1,185 @@
+# C:\excel-to-web\quote_optimizer.py
+
+import time
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import logic
+
+# ================================================================
+# ПОДБОР САМОГО ВЫГОДНОГО ВАРИАНТА ПРЕДЛОЖЕНИЯ
+# ================================================================
+# Кандидат - (акция или без акции, период предоплаты, месяцев фиксации). Цена
+# кандидата считается теми же функциями logic, что и /calculate, но по частям,
+# каждая из которых зависит лишь от части параметров:
+#   тиры прайса        - только от уровней и аккаунтов: ищутся один раз на запрос;
+#   прейскурант        - от предоплаты;
+#   цена со скидкой    - от ветки (акция/скидка) и предоплаты: одна на ветку;
+#   цена с фиксацией   - от предоплаты и фиксации, но НЕ от акции (в logic фиксация
+#                        считается от ручной скидки): одна на пару (предоплата, фиксация).
+# Отсечение ветвей, заведомо не лучших, чем уже рассмотренные (без расчета):
+#   - у не-ЛД сервисов без акции месячные цены от предоплаты не зависят - считается
+#     только самая короткая предоплата, более длинные ей доминируются;
+#   - акция с фиксацией дает ту же цену, что фиксация без акции при той же предоплате, -
+#     для веток акций считается только вариант без фиксации.
+# Итог - варианты, которые не доминируются другими: нет варианта с не большей
+# месячной ценой, не меньшей фиксацией и не большей предоплатой. Варианты
+# упорядочены по месячной цене (fixed_monthly - с фиксацией, если она есть).
+
+PREPAYMENT_MONTHS = tuple(range(1, 13))
+FIXATION_MONTHS = (0,) + tuple(sorted(logic.FIXATION_COEFFICIENT_MAP))
+
+# (id акции, месяцев) -> найденная акция в формате find_applicable_promotion или None
+PromotionResolver = Callable[[Any, int], Optional[Dict[str, Any]]]
+
+
+class QuoteOptimizer:
+    """
+    Перебор кандидатов одного предложения с общими тирами и промежуточными суммами.
+    deadline - момент time.perf_counter(), после которого перебор прекращается
+    (лучшие из рассмотренных вариантов все равно возвращаются).
+    """
+
+    def __init__(self, data: Dict[str, Any], level_prices_info: List[Dict[str, Any]], deadline: float):
+        self.data = data
+        self.level_prices_info = level_prices_info
+        self.is_ld_service = "ЛД" in data.get('service', '')
+        self.deadline = deadline
+        self.evaluated = 0
+        self.pruned = 0
+        self.dominated = 0
+        self.complete = True
+        self._list_parts: Dict[int, Tuple[Decimal, Decimal]] = {}
+        self._fixed_periods: Dict[Tuple[int, int], Decimal] = {}
+        self._options: List[Dict[str, Any]] = []
+
+    def _candidate_data(self, prepayment_months: int, fixation_months: int, promotion_id: Any = None) -> Dict[str, Any]:
+        return dict(self.data, prepayment_months=prepayment_months, fixation_months=fixation_months, promotion_id=promotion_id)
+
+    def _list_prices(self, prepayment_months: int) -> Tuple[Decimal, Decimal]:
+        """(list_monthly, list_period) - как в logic._calculate_price_summary."""
+        parts = self._list_parts.get(prepayment_months)
+        if parts is None:
+            D_prepayment_months = Decimal(str(prepayment_months))
+            list_monthly_base = sum((logic.list_monthly_term(item, self.is_ld_service) for item in self.level_prices_info), Decimal('0'))
+            if self.is_ld_service:
+                list_period = logic.round_decimal(list_monthly_base * D_prepayment_months * logic.VAT_RATE)
+                list_monthly = logic.round_decimal(list_monthly_base * logic.VAT_RATE)
+            else:
+                list_period = list_monthly_base * D_prepayment_months
+                list_monthly = logic.round_decimal(list_period / D_prepayment_months)
+            parts = self._list_parts[prepayment_months] = (list_monthly, list_period)
+        return parts
+
+    def _fixed_period(self, prepayment_months: int, fixation_months: int) -> Decimal:
+        key = (prepayment_months, fixation_months)
+        value = self._fixed_periods.get(key)
+        if value is None:
+            data = self._candidate_data(prepayment_months, fixation_months)
+            if self.is_ld_service:
+                value = logic.calculate_ld_fixed_price(self.level_prices_info, data)
+            else:
+                value = logic.calculate_non_ld_fixed_price(self.level_prices_info, data) * Decimal(str(prepayment_months))
+            self._fixed_periods[key] = value
+        return value
+
+    def _discounted_period(self, prepayment_months: int, promotion_info: Optional[Dict[str, Any]]) -> Decimal:
+        data = self._candidate_data(prepayment_months, 0)
+        if promotion_info:
+            return logic._calculate_discounted_price_with_promotion(
+                self.level_prices_info, data, promotion_info["details"], promotion_info["applicable_levels"], self.is_ld_service
+            )
+        if self.is_ld_service:
+            return logic.calculate_ld_discounted_price(self.level_prices_info, data)
+        return logic.calculate_non_ld_discounted_price(self.level_prices_info, data) * Decimal(str(prepayment_months))
+
+    def _add_option(self, promotion_id: Any, prepayment_months: int, fixation_months: int,
+                    discounted_period: Decimal, fixed_period: Decimal) -> None:
+        list_monthly, list_period = self._list_prices(prepayment_months)
+        price_summary = logic.price_summary_from_periods(
+            list_monthly, list_period, discounted_period, fixed_period, Decimal(str(prepayment_months))
+        )
+        self._options.append({
+            "promotion_id": promotion_id, "prepayment_months": prepayment_months, "fixation_months": fixation_months,
+            "monthly_price": price_summary["fixed_monthly"], "period_price": price_summary["fixed_period"],
+            "savings_monthly": float(logic.round_decimal(Decimal(str(price_summary["list_monthly"])) - Decimal(str(price_summary["fixed_monthly"])))),
+            "price_summary": price_summary,
+        })
+        self.evaluated += 1
+
+    def _out_of_time(self) -> bool:
+        if time.perf_counter() > self.deadline:
+            self.complete = False
+        return not self.complete
+
+    def run(self, prepayment_options: Iterable[int], fixation_options: Iterable[int],
+            promotion_variants: Iterable[Tuple[Any, int]], resolve_promotion: PromotionResolver) -> None:
+        prepayment_options = sorted(set(prepayment_options))
+        fixation_options = sorted(set(fixation_options))
+
+        # Ветки без акции: для не-ЛД месячные цены одинаковы при любой предоплате
+        plain_prepayments = prepayment_options if self.is_ld_service else prepayment_options[:1]
+        self.pruned += (len(prepayment_options) - len(plain_prepayments)) * len(fixation_options)
+        branches: List[Tuple[Any, int, Optional[Dict[str, Any]]]] = [(None, months, None) for months in plain_prepayments]
+        for promotion_id, months in promotion_variants:
+            if months not in prepayment_options: continue
+            if self._out_of_time(): return
+            promotion_info = resolve_promotion(promotion_id, months)
+            if promotion_info is not None:
+                branches.append((promotion_id, months, promotion_info))
+
+        # Сначала варианты без фиксации (самые дешевые), затем с фиксацией по возрастанию
+        discounted_periods = []
+        for promotion_id, months, promotion_info in branches:
+            if self._out_of_time(): return
+            discounted_period = self._discounted_period(months, promotion_info)
+            discounted_periods.append(discounted_period)
+            if 0 in fixation_options:
+                self._add_option(promotion_id, months, 0, discounted_period, discounted_period)
+        for fixation_months in (months for months in fixation_options if months > 0):
+            for (promotion_id, months, promotion_info), discounted_period in zip(branches, discounted_periods):
+                if promotion_info is not None:
+                    self.pruned += 1  # та же цена, что у фиксации без акции
+                    continue
+                if self._out_of_time(): return
+                self._add_option(None, months, fixation_months, discounted_period, self._fixed_period(months, fixation_months))
+
+    def best(self, top: int) -> List[Dict[str, Any]]:
+        """Недоминируемые варианты, от дешевых к дорогим (при равной цене - короче предоплата, длиннее фиксация)."""
+        ranked = sorted(self._options, key=lambda option: (option["monthly_price"], option["prepayment_months"], -option["fixation_months"]))
+        frontier: List[Dict[str, Any]] = []
+        for option in ranked:
+            # Все, кто раньше в ranked, не дороже; доминирует тот, у кого не хуже и фиксация, и предоплата
+            if any(kept["fixation_months"] >= option["fixation_months"] and kept["prepayment_months"] <= option["prepayment_months"]
+                   for kept in frontier):
+                self.dominated += 1
+                continue
+            frontier.append(option)
+        return frontier[:top]
+
+
+def optimize_quote(
+    data: Dict[str, Any],
+    price_index: logic.PriceIndex,
+    promotion_variants: Iterable[Tuple[Any, int]],
+    resolve_promotion: PromotionResolver,
+    prepayment_options: Iterable[int] = PREPAYMENT_MONTHS,
+    fixation_options: Iterable[int] = FIXATION_MONTHS,
+    top: int = 10,
+    time_budget_seconds: float = 0.05,
+) -> Optional[Dict[str, Any]]:
+    """
+    Лучшие варианты предложения data (период, сервис, уровни, ручная скидка).
+    None - тарифы для уровней не найдены.
+    """
+    started = time.perf_counter()
+    level_prices_info = logic.find_price_tiers(data, None, price_index)
+    if not level_prices_info:
+        return None
+    optimizer = QuoteOptimizer(data, level_prices_info, started + time_budget_seconds)
+    optimizer.run(prepayment_options, fixation_options, promotion_variants, resolve_promotion)
+    options = optimizer.best(top)
+    return {
+        "options": options, "evaluated": optimizer.evaluated, "pruned": optimizer.pruned, "dominated": optimizer.dominated,
+        "complete": optimizer.complete, "seconds": round(time.perf_counter() - started, 6),
+    }
@@ -0,0 +1,123 @@
+# C:\excel-to-web\render_pool.py
+
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+
+class RenderPoolBusy(Exception):
+    """Все воркеры заняты и очередь заполнена - задачу не принимаем."""
+
+
+class RenderPool:
+    """
+    Ограниченный пул для тяжелых синхронных задач (формирование документов),
+    чтобы они не блокировали event loop uvicorn.
+
+    - max_workers: сколько задач выполняется одновременно;
+    - max_queue: сколько задач может ждать свободного воркера, сверх этого - RenderPoolBusy;
+    - timeout_seconds: сколько обработчик ждет результата, затем asyncio.TimeoutError.
+      Задача, не уложившаяся в таймаут, дорабатывает в фоне и занимает место в пуле,
+      поэтому число одновременно работающих задач никогда не превышает лимит.
+    - mode: "process" (отдельные процессы, не конкурируют за GIL с обработчиками)
+      или "thread" (потоки, без накладных расходов на передачу данных).
+      Если процесс-воркер умер (BrokenProcessPool), пул сбрасывается: следующий
+      вызов поднимает новые воркеры и повторяет прогрев.
+    """
+
+    def __init__(self, max_workers: int = 2, max_queue: int = 8, timeout_seconds: float = 30.0, mode: str = "process"):
+        if mode not in ("process", "thread"):
+            raise ValueError(f"Неизвестный режим пула: {mode}")
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.timeout_seconds = timeout_seconds
+        self.mode = mode
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._warm_up_task = None
+        self.finished = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.restarts = 0
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                if self.mode == "process":
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="render")
+                if self._warm_up_task is not None and self.restarts:
+                    # Пересоздание после сбоя: прогреваем новые воркеры в фоне, не дожидаясь
+                    fn, args = self._warm_up_task
+                    for _ in range(self.max_workers):
+                        self._executor.submit(fn, *args)
+            return self._executor
+
+    def _drop_broken(self, executor: Executor) -> None:
+        """Сбрасывает сломанный пул (если его еще не заменили) - следующий вызов создаст новый."""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            self.restarts += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, _future) -> None:
+        with self._lock:
+            self._pending -= 1
+            self.finished += 1
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Выполняет fn(*args) в пуле и возвращает результат."""
+        executor = self._get_executor()
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise RenderPoolBusy()
+            self._pending += 1
+        try:
+            future = executor.submit(fn, *args)
+        except Exception as e:
+            with self._lock:
+                self._pending -= 1
+            if isinstance(e, BrokenProcessPool):
+                self._drop_broken(executor)
+            raise
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout_seconds)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timed_out += 1
+            raise
+        except BrokenProcessPool:
+            self._drop_broken(executor)
+            raise
+
+    def warm_up(self, fn: Callable[..., Any], *args: Any) -> None:
+        """Заранее поднимает воркеры (для процессов - импорт модулей), не дожидаясь первого запроса."""
+        self._warm_up_task = (fn, args)
+        executor = self._get_executor()
+        for future in [executor.submit(fn, *args) for _ in range(self.max_workers)]:
+            future.result()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode, "max_workers": self.max_workers, "max_queue": self.max_queue,
+                "in_flight": self._pending, "finished": self.finished,
+                "rejected": self.rejected, "timed_out": self.timed_out, "restarts": self.restarts,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,196 @@
+# C:\excel-to-web\serve.py
+#
+# Запуск приложения в несколько рабочих процессов с общими данными прайс-листа.
+#
+#   python serve.py --host 0.0.0.0 --port 10000              # WEB_CONCURRENCY воркеров (по умолчанию 1)
+#   WEB_CONCURRENCY=4 python serve.py --port 10000
+#
+# Один воркер - обычный uvicorn в этом же процессе. Несколько воркеров - схема
+# "fork после загрузки": родитель один раз загружает снимок данных и строит
+# индексы (PriceIndex, каталог акций, готовые страницы), замораживает эти объекты
+# для сборщика мусора (gc.freeze) и только потом делает fork. Воркеры получают
+# данные уже готовыми и делят страницы памяти с родителем (copy-on-write), так
+# что новый воркер не добавляет ни времени загрузки, ни копии данных.
+#
+# Перезагрузку данных выполняет родитель: по SIGHUP (его же шлет POST /admin/reload
+# из любого воркера) или по изменению файлов (DATA_WATCH_INTERVAL_SECONDS). После
+# успешной загрузки воркеры по одному заменяются новыми, остальные продолжают
+# принимать запросы на общем сокете.
+
+import argparse
+import gc
+import os
+import signal
+import sys
+import time
+from typing import Dict, Set
+
+import uvicorn
+
+# Сколько ждать завершения воркера (дообработка текущих запросов) перед SIGKILL
+WORKER_STOP_TIMEOUT_SECONDS = float(os.environ.get("WORKER_STOP_TIMEOUT_SECONDS", "30"))
+
+
+def _freeze_shared_objects() -> None:
+    """Убирает загруженные данные из поля зрения сборщика мусора, чтобы он не трогал общие страницы."""
+    gc.collect()
+    gc.freeze()
+
+
+class Supervisor:
+    """Родительский процесс: держит сокет и данные, запускает и перезапускает воркеры."""
+
+    def __init__(self, config: uvicorn.Config, workers: int, watch_interval: float):
+        import main
+        self.main = main
+        self.config = config
+        self.workers_count = workers
+        self.watch_interval = watch_interval
+        self.socket = config.bind_socket()
+        self.workers: Dict[int, int] = {}  # pid -> номер воркера
+        self.retiring: Set[int] = set()
+        self.should_exit = False
+        self.reload_requested = False
+
+    # --- Воркеры ---
+    def _spawn(self, number: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                self._run_worker(number)
+            except BaseException as e:
+                print(f"!!! ОШИБКА воркера {number}: {e}")
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        self.workers[pid] = number
+
+    def _run_worker(self, number: int) -> None:
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, signal.SIG_DFL)
+        main = self.main
+        main.supervisor_pid = os.getppid()
+        # У каждого воркера свои процессы unoserver - на своих портах
+        main.pdf_converter.base_port += number * 2 * main.pdf_converter.workers_count
+        uvicorn.Server(self.config).run(sockets=[self.socket])
+
+    def _stop_worker(self, pid: int) -> None:
+        """SIGTERM (uvicorn дообрабатывает текущие запросы) и ожидание, затем SIGKILL."""
+        self.retiring.add(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        deadline = time.monotonic() + WORKER_STOP_TIMEOUT_SECONDS
+        try:
+            while time.monotonic() < deadline:
+                if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                    break
+                time.sleep(0.05)
+            else:
+                print(f"--- ПРЕДУПРЕЖДЕНИЕ: воркер {pid} не завершился за {WORKER_STOP_TIMEOUT_SECONDS:.0f} с, SIGKILL.")
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass  # уже завершен и собран
+        self.retiring.discard(pid)
+        self.workers.pop(pid, None)
+
+    def _reap(self) -> None:
+        """Перезапускает воркеры, завершившиеся сами по себе."""
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            number = self.workers.pop(pid, None)
+            if number is None or pid in self.retiring or self.should_exit:
+                continue
+            print(f"!!! Воркер {number} (pid {pid}) завершился с кодом {os.waitstatus_to_exitcode(status)}, перезапуск.")
+            self._spawn(number)
+
+    # --- Данные ---
+    def _reload(self) -> None:
+        self.reload_requested = False
+        try:
+            result = self.main.reload_data(isolated=True)
+        except Exception as e:
+            print(f"!!! ОШИБКА перезагрузки данных: {e}")
+            return
+        if result["status"] == "rejected":
+            return
+        _freeze_shared_objects()
+        # По одному: остальные воркеры в это время обслуживают запросы на общем сокете
+        for pid, number in list(self.workers.items()):
+            self._stop_worker(pid)
+            self._spawn(number)
+        print(f"✓ Воркеры перезапущены на данных версии {result['version']}.")
+
+    # --- Главный цикл ---
+    def _handle_exit(self, signum, frame) -> None:
+        self.should_exit = True
+
+    def _handle_reload(self, signum, frame) -> None:
+        self.reload_requested = True
+
+    def run(self) -> None:
+        started = time.perf_counter()
+        self.main.reload_data()
+        # Данные грузит только родитель - воркеры с пустыми данными не запускаем
+        if self.main.current_data.prices is None:
+            sys.exit("!!! Прайс-лист не загружен - воркеры не запущены.")
+        self.config.load()
+        _freeze_shared_objects()
+        signal.signal(signal.SIGTERM, self._handle_exit)
+        signal.signal(signal.SIGINT, self._handle_exit)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+        for number in range(self.workers_count):
+            self._spawn(number)
+        print(f"✓ Запущено воркеров: {self.workers_count} (pid родителя {os.getpid()}, данные загружены за {time.perf_counter() - started:.3f} с).")
+
+        watcher = self.main.DataFilesWatcher() if self.watch_interval > 0 else None
+        next_watch = time.monotonic() + self.watch_interval
+        while not self.should_exit:
+            time.sleep(0.2)
+            self._reap()
+            if watcher is not None and time.monotonic() >= next_watch:
+                next_watch = time.monotonic() + self.watch_interval
+                if watcher.changed():
+                    self.reload_requested = True
+            if self.reload_requested and not self.should_exit:
+                self._reload()
+
+        # Останавливаем все воркеры одновременно, затем дожидаемся каждого
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(self.workers):
+            self._stop_worker(pid)
+        self.socket.close()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Калькулятор тарифов: запуск в один или несколько процессов")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "10000")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "1")))
+    parser.add_argument("--limit-concurrency", type=int, default=None, help="--limit-concurrency uvicorn (на каждый воркер)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        uvicorn.run("main:app", host=args.host, port=args.port, limit_concurrency=args.limit_concurrency, log_level=args.log_level)
+        return
+
+    import main
+    config = uvicorn.Config(main.app, host=args.host, port=args.port, limit_concurrency=args.limit_concurrency, log_level=args.log_level)
+    Supervisor(config, args.workers, main.DATA_WATCH_INTERVAL_SECONDS).run()
+
+
+if __name__ == "__main__":
+    main_cli()
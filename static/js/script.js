@@ -36,6 +36,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // НОВЫЙ БЛОК: Получаем контейнер для всех полей акции для удобного скрытия/показа
     const promotionContainer = document.getElementById('promotion-container');
+    const liveTotal = document.getElementById('live-total');
     
     let allPromotionsData = {};
     let lastCalculationData = null; 
@@ -256,6 +257,84 @@ document.addEventListener('DOMContentLoaded', function() {
         document.getElementById('total-minutes').textContent = totalMinutesDisplay;
         validateUserCount();
         updateAvailablePromotions();
+        scheduleWhatIf();
+    }
+
+    // --- ЖИВЫЕ ИТОГИ ("ЧТО ЕСЛИ") ---
+    // Сервер держит сессию с найденными тирами и акцией; при вводе отправляются только изменения,
+    // и он пересчитывает лишь затронутые части. Запросы идут по одному, иначе PATCH могут обогнать друг друга.
+    let whatIfSession = null; // { id, sent } - sent: ввод, который уже есть на сервере
+    let whatIfTimer = null;
+    let whatIfBusy = false;
+    let whatIfPending = false;
+
+    function scheduleWhatIf() {
+        clearTimeout(whatIfTimer);
+        whatIfTimer = setTimeout(updateWhatIf, 150);
+    }
+
+    function getWhatIfPayload() {
+        // Уровни - все, включая нулевые: так обнуление уровня тоже становится изменением
+        const payload = getCalculationPayload();
+        payload.levels = Array.from(levelInputs).map(input => ({ level: input.dataset.level, accounts: parseInt(input.value) || 0 }));
+        return payload;
+    }
+
+    function getWhatIfChanges(sent, payload) {
+        const changes = {};
+        ['prepayment_months', 'discount_percent', 'fixation_months', 'promotion_id'].forEach(key => {
+            if (sent[key] !== payload[key]) changes[key] = payload[key];
+        });
+        const sentAccounts = Object.fromEntries(sent.levels.map(item => [item.level, item.accounts]));
+        const levels = payload.levels.filter(item => (sentAccounts[item.level] || 0) !== item.accounts);
+        if (levels.length) changes.levels = levels;
+        return changes;
+    }
+
+    async function updateWhatIf() {
+        if (whatIfBusy) { whatIfPending = true; return; }
+        whatIfBusy = true;
+        try {
+            await sendWhatIf();
+        } catch (error) {
+            console.error("Ошибка при расчете живых итогов:", error);
+        } finally {
+            whatIfBusy = false;
+            if (whatIfPending) { whatIfPending = false; updateWhatIf(); }
+        }
+    }
+
+    async function sendWhatIf() {
+        const payload = getWhatIfPayload();
+        if (!payload.service || !payload.levels.some(item => item.accounts > 0) || Number.isNaN(payload.prepayment_months)) {
+            liveTotal.textContent = '';
+            return;
+        }
+        const headers = { 'Content-Type': 'application/json' };
+        let response = null;
+        if (whatIfSession && whatIfSession.sent.service === payload.service && whatIfSession.sent.period === payload.period) {
+            const changes = getWhatIfChanges(whatIfSession.sent, payload);
+            if (Object.keys(changes).length === 0) return;
+            response = await fetch(`/calculate/whatif/${whatIfSession.id}`, { method: 'PATCH', headers, body: JSON.stringify(changes) });
+        }
+        if (!response || response.status === 404) {
+            // Новая сессия: первый ввод, другой сервис/период или сессия истекла (или в другом воркере)
+            response = await fetch('/calculate/whatif', { method: 'POST', headers, body: JSON.stringify(payload) });
+        }
+        const data = await response.json();
+        if (!response.ok) {
+            whatIfSession = null;
+            liveTotal.textContent = '';
+            return;
+        }
+        whatIfSession = { id: data.session_id, sent: payload };
+        if (data.error) {
+            liveTotal.textContent = data.error;
+            return;
+        }
+        const summary = data.price_summary;
+        const total = payload.fixation_months > 0 ? summary.fixed_period : summary.discounted_period;
+        liveTotal.textContent = `Предварительно: ${formatNumber(total)} руб. за ${data.calculation_context.prepayment_months} мес.`;
     }
 
     async function updateLevels() {
@@ -467,12 +546,16 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 
     serviceSelectElement.addEventListener('change', updateLevels);
+    // Предоплата, скидка, фиксация и акция: поле предоплаты пересоздается, поэтому слушаем контейнер
+    document.querySelector('.options-container').addEventListener('input', scheduleWhatIf);
+    document.querySelector('.options-container').addEventListener('change', scheduleWhatIf);
     promotionSelect.addEventListener('change', handlePromotionChange);
 
     // ИЗМЕНЕНО: Добавляем вызов новой функции в обработчик
     periodSelect.addEventListener('change', () => {
         validatePeriod();
         updatePromotionBlockVisibility();
+        scheduleWhatIf();
     });
 
     fixationMonthsInput.addEventListener('input', () => { const months = parseInt(fixationMonthsInput.value) || 0; const coefficient = FIXATION_COEFFICIENT_MAP[months] || 1.0; fixationCoefficientInput.value = coefficient.toFixed(2); });
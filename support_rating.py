@@ -0,0 +1,129 @@
+# C:\excel-to-web\support_rating.py
+
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+import logic
+
+# ================================================================
+# РЕЙТИНГ СОПРОВОЖДЕНИЯ (ЛИСТ "РАСЧЕТ РС")
+# ================================================================
+# Лист сравнивает набор продуктов клиента до изменения договора (П1) и после (П2):
+#   цена уровня   I = ROUND(цена тира без НДС * аккаунтов * 1.2, 2), нет тира -> 0
+#   база          E15 = цена 1 аккаунта с НДС "Главный бухгалтер, Базовый" в периоде стороны
+#   РС стороны    F15 = сумма ROUND(I / база, 2) по всем уровням всех продуктов
+#   разница       F17 = РС(П2) - РС(П1)
+# Тир ищется как в /calculate (logic.find_price_tiers): точное количество
+# аккаунтов или старший тир, если аккаунтов больше. В книге то же самое делает
+# пара GETPIVOTDATA "Пользователей" (число тиров) + "цена1".
+# Все тиры пакета поправок (обе стороны, все продукты, базы периодов) ищутся
+# через общий кэш: одинаковый ключ (сервис, уровень, период, аккаунтов) - один поиск в индексе.
+
+BASE_SERVICE = "Пакет Программ Главный Бухгалтер, Podpis (1 пользователь, ЛД)"
+BASE_LEVEL = "Базовый"
+SIDES = ("current", "changed")
+
+PriceKey = Tuple[str, str, str, int]
+
+
+class TierCache:
+    """
+    Обертка над logic.PriceIndex на один пакет: каждый ключ тира ищется в индексе
+    один раз, а цена строки и ее РС (Decimal с округлением) считаются один раз
+    для каждой пары (тир, аккаунтов) и (цена строки, база).
+    """
+    __slots__ = ('_index', 'tiers', '_line_prices', '_ratings')
+
+    def __init__(self, price_index: logic.PriceIndex):
+        self._index = price_index
+        self.tiers: Dict[PriceKey, Optional[float]] = {}
+        self._line_prices: Dict[Tuple[float, int], Decimal] = {}
+        self._ratings: Dict[Tuple[Decimal, Decimal], Decimal] = {}
+
+    def find_price(self, service: str, level: str, period: str, accounts: int) -> Optional[float]:
+        key = (service, level, period, accounts)
+        if key not in self.tiers:
+            self.tiers[key] = self._index.find_price(service, level, period, accounts)
+        return self.tiers[key]
+
+    def line_price(self, price: float, accounts: int) -> Decimal:
+        """I = ROUND(цена тира * аккаунтов * 1.2, 2)."""
+        key = (price, accounts)
+        value = self._line_prices.get(key)
+        if value is None:
+            value = self._line_prices[key] = logic.round_decimal(Decimal(str(price)) * Decimal(str(accounts)) * logic.VAT_RATE)
+        return value
+
+    def rating(self, line_price: Decimal, base: Decimal) -> Decimal:
+        """ROUND(I / база, 2)."""
+        key = (line_price, base)
+        value = self._ratings.get(key)
+        if value is None:
+            value = self._ratings[key] = logic.round_decimal(line_price / base)
+        return value
+
+
+def base_value(period: str, tiers: TierCache) -> Optional[Decimal]:
+    """Базовая величина периода (E15): цена одного аккаунта базового продукта с НДС."""
+    price = tiers.find_price(BASE_SERVICE, BASE_LEVEL, period, 1)
+    if price is None:
+        return None
+    return logic.round_decimal(Decimal(str(price)) * logic.VAT_RATE)
+
+
+def calculate_side(side: Dict[str, Any], tiers: TierCache) -> Dict[str, Any]:
+    """
+    Одна сторона (П1 или П2): {"period": ..., "products": [{"service": ..., "levels": [...]}]}.
+    РС - None, если аккаунты есть, а базовой величины в периоде нет (в книге - пустая разница).
+    """
+    period = side['period']
+    products, total_accounts, total_price = [], 0, Decimal('0')
+    priced_levels: List[Dict[str, Any]] = []
+    for product in side.get('products', []):
+        level_prices_info = logic.find_price_tiers(
+            {"service": product['service'], "period": period, "levels": product.get('levels', [])}, None, tiers
+        )
+        found = {(item['level_name'], item['accounts']): item['price_without_vat_per_user'] for item in level_prices_info}
+        levels = []
+        for level_input in product.get('levels', []):
+            accounts = level_input.get('accounts', 0)
+            if accounts <= 0: continue
+            price = found.get((level_input['level'], accounts))
+            price_with_vat = Decimal('0') if price is None else tiers.line_price(price, accounts)
+            level = {"level": level_input['level'], "accounts": accounts, "price_found": price is not None,
+                     "price_with_vat": price_with_vat, "rating": None}
+            levels.append(level)
+            priced_levels.append(level)
+            total_accounts += accounts
+            total_price += price_with_vat
+        products.append({"service": product['service'], "levels": levels})
+
+    base = base_value(period, tiers) if total_accounts > 0 else None
+    if total_accounts == 0:
+        rating: Optional[Decimal] = Decimal('0')
+    elif base is None or base == 0:
+        rating = None
+    else:
+        rating = Decimal('0')
+        for level in priced_levels:
+            level['rating'] = tiers.rating(level['price_with_vat'], base)
+            rating += level['rating']
+    return {
+        "period": period, "products": products, "accounts": total_accounts,
+        "price_with_vat": total_price, "base_value": base, "rating": rating,
+    }
+
+
+def calculate_amendment(amendment: Dict[str, Any], tiers: TierCache) -> Dict[str, Any]:
+    """Поправка к договору: {"current": сторона, "changed": сторона} -> обе стороны и разница РС."""
+    sides = {name: calculate_side(amendment[name], tiers) for name in SIDES}
+    current_rating, changed_rating = sides["current"]["rating"], sides["changed"]["rating"]
+    difference = None if current_rating is None or changed_rating is None else changed_rating - current_rating
+    return dict(sides, rating_difference=difference)
+
+
+def calculate_amendments(amendments: List[Dict[str, Any]], price_index: logic.PriceIndex) -> Tuple[List[Dict[str, Any]], int]:
+    """Пакет поправок с общим кэшем тиров. Возвращает (результаты, число поисков в индексе)."""
+    tiers = TierCache(price_index)
+    results = [calculate_amendment(amendment, tiers) for amendment in amendments]
+    return results, len(tiers.tiers)
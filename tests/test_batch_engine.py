@@ -0,0 +1,115 @@
+# C:\excel-to-web\tests\test_batch_engine.py
+
+import random
+import pytest
+
+from logic import PriceIndex, run_calculation
+from price_store import PriceTable
+from batch_engine import calculate_price_summaries, run_batch_calculation
+
+approx = pytest.approx
+
+# Сценарии из tests/test_logic.py (без акций): прайс, входные данные, эталон из Excel
+SCENARIOS = [
+    (
+        [
+            {'Сервис': 'Пакет Программ Главный Бухгалтер, Podpis, ilex.Накладные (1 пользователь, ЛД)', 'Уровень': 'Оптимальный', 'Аккаунтов': 1, 'Стоимость без НДС': 79.17, 'Период': 'окт.25'},
+        ],
+        {"period": "окт.25", "service": "Пакет Программ Главный Бухгалтер, Podpis, ilex.Накладные (1 пользователь, ЛД)",
+         "levels": [{"level": "Оптимальный", "accounts": 1}], "prepayment_months": 4, "discount_percent": 0.0, "fixation_months": 0},
+        {'list_period': 380.02, 'list_monthly': 95.00},
+    ),
+    (
+        [
+            {'Сервис': 'Пакет Программ Главный Бухгалтер, Podpis, ilex.Накладные (1 пользователь, ЛД)', 'Уровень': 'Оптимальный Плюс', 'Аккаунтов': 1, 'Стоимость без НДС': 92.06, 'Период': 'окт.25'},
+        ],
+        {"period": "окт.25", "service": "Пакет Программ Главный Бухгалтер, Podpis, ilex.Накладные (1 пользователь, ЛД)",
+         "levels": [{"level": "Оптимальный Плюс", "accounts": 1}], "prepayment_months": 4, "discount_percent": 0.0, "fixation_months": 0},
+        {'list_period': 441.89, 'list_monthly': 110.47, 'discounted_period': 441.89, 'fixed_monthly': 110.47},
+    ),
+    (
+        [
+            {'Сервис': 'Главный Бухгалтер ПРОФ', 'Уровень': 'Эксперт', 'Аккаунтов': 1, 'Стоимость без НДС': 205.64, 'Период': 'окт.25'},
+            {'Сервис': 'Главный Бухгалтер ПРОФ', 'Уровень': 'Оптимальный', 'Аккаунтов': 2, 'Стоимость без НДС': 101.16, 'Период': 'окт.25'},
+            {'Сервис': 'Главный Бухгалтер ПРОФ', 'Уровень': 'Базовый', 'Аккаунтов': 3, 'Стоимость без НДС': 28.86, 'Период': 'окт.25'},
+        ],
+        {"period": "окт.25", "service": "Главный Бухгалтер ПРОФ",
+         "levels": [{"level": "Эксперт", "accounts": 1}, {"level": "Оптимальный", "accounts": 2}, {"level": "Базовый", "accounts": 3}],
+         "prepayment_months": 4, "discount_percent": 5.0, "fixation_months": 6},
+        {'list_period': 2373.80, 'discounted_period': 2255.08, 'discounted_monthly': 563.77, 'fixed_period': 2412.96, 'fixed_monthly': 603.24},
+    ),
+    (
+        [
+            {'Сервис': 'Главный Бухгалтер ПРОФ (1 пользователь)', 'Уровень': 'Эксперт', 'Аккаунтов': 1, 'Стоимость без НДС': 406.40, 'Период': 'окт.25'},
+        ],
+        {"period": "окт.25", "service": "Главный Бухгалтер ПРОФ (1 пользователь)",
+         "levels": [{"level": "Эксперт", "accounts": 1}], "prepayment_months": 8, "discount_percent": 15.0, "fixation_months": 9},
+        {'list_period': 3901.44, 'discounted_period': 3316.24, 'discounted_monthly': 414.53, 'fixed_period': 3681.04, 'fixed_monthly': 460.13},
+    ),
+    (
+        [
+            {'Сервис': 'Предприятие', 'Уровень': 'Эксперт', 'Аккаунтов': 10, 'Стоимость без НДС': 112.50, 'Период': 'окт.25'},
+            {'Сервис': 'Предприятие', 'Уровень': 'Оптимальный', 'Аккаунтов': 10, 'Стоимость без НДС': 61.18, 'Период': 'окт.25'},
+            {'Сервис': 'Предприятие', 'Уровень': 'Минимальный', 'Аккаунтов': 5, 'Стоимость без НДС': 33.09, 'Период': 'окт.25'},
+        ],
+        {"period": "окт.25", "service": "Предприятие",
+         "levels": [{"level": "Эксперт", "accounts": 20}, {"level": "Оптимальный", "accounts": 30}, {"level": "Минимальный", "accounts": 40}],
+         "prepayment_months": 9, "discount_percent": 10.0, "fixation_months": 11},
+        {'list_period': 58417.20, 'list_monthly': 6490.80, 'discounted_period': 52575.48, 'fixed_period': 59410.26, 'fixed_monthly': 6601.14},
+    ),
+]
+
+
+@pytest.mark.parametrize("prices, user_input_data, expected", SCENARIOS)
+def test_batch_engine_matches_decimal_path_on_reference_cases(prices, user_input_data, expected):
+    """
+    Векторный расчет в копейках должен давать ровно те же числа,
+    что и Decimal-путь run_calculation, и совпадать с эталоном из Excel.
+    """
+    price_index = PriceIndex.from_table(PriceTable.from_records(prices))
+
+    decimal_result = run_calculation(user_input_data, None, price_index=price_index)
+    batch_result = run_batch_calculation([user_input_data], price_index)[0]
+
+    assert batch_result == decimal_result
+    for key, value in expected.items():
+        assert batch_result['price_summary'][key] == approx(value)
+
+
+def test_batch_engine_matches_decimal_path_on_random_quotes():
+    """
+    Сверка на случайных предложениях (ЛД и не-ЛД, скидки, фиксация, превышение тиров),
+    включая значения, которые уходят на Decimal-путь (скидка 1/3, предоплата 0).
+    """
+    rng = random.Random(20251001)
+    services = ['Главный Бухгалтер ПРОФ', 'Пакет Программ Главный Бухгалтер, Podpis (1 пользователь, ЛД)']
+    levels = ['Эксперт', 'Оптимальный', 'Минимальный']
+    rows = [
+        {'Сервис': service, 'Уровень': level, 'Аккаунтов': accounts, 'Стоимость без НДС': rng.randint(1, 250000) / 100, 'Период': 'окт.25'}
+        for service in services for level in levels for accounts in range(1, 11)
+    ]
+    price_index = PriceIndex.from_table(PriceTable.from_records(rows))
+
+    batch = [
+        {
+            "period": "окт.25", "service": rng.choice(services),
+            "levels": [{"level": level, "accounts": rng.randint(0, 30)} for level in rng.sample(levels, rng.randint(1, 3))],
+            "prepayment_months": rng.choice([0, 1, 3, 4, 6, 12, 24, 36]),
+            "discount_percent": rng.choice([0.0, 5.0, 12.5, 33.33, 99.99, 1 / 3]),
+            "fixation_months": rng.choice([0, 1, 5, 9, 12, 13]),
+        }
+        for _ in range(2000)
+    ]
+
+    assert run_batch_calculation(batch, price_index) == [run_calculation(data, None, price_index=price_index) for data in batch]
+
+
+def test_calculate_price_summaries_marks_inexact_quotes():
+    """Цена с долями копейки не представима в целых копейках - такое предложение не считается векторно."""
+    quotes = [
+        {"data": {"service": "Предприятие", "prepayment_months": 1}, "levels": [{"price_without_vat_per_user": 10.005, "accounts": 1}]},
+        {"data": {"service": "Предприятие", "prepayment_months": 1}, "levels": [{"price_without_vat_per_user": 10.05, "accounts": 1}]},
+    ]
+    summaries = calculate_price_summaries(quotes)
+    assert summaries[0] is None
+    assert summaries[1]['list_monthly'] == approx(12.06)
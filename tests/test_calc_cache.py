@@ -0,0 +1,41 @@
+# C:\excel-to-web\tests\test_calc_cache.py
+
+from calc_cache import CalculationCache
+
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_evicts_least_recently_used_entry():
+    """При переполнении вытесняется запись, к которой дольше всего не обращались."""
+    cache = CalculationCache(maxsize=2, ttl_seconds=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cache_expires_entries_and_counts_hits():
+    """Запись живет ttl_seconds; попадания и промахи учитываются в stats()."""
+    clock = _FakeClock()
+    cache = CalculationCache(maxsize=10, ttl_seconds=30, clock=clock)
+    cache.put("quote", {"price_summary": {"list_period": 100.0}})
+
+    clock.now = 29.9
+    assert cache.get("quote") is not None
+    clock.now = 30.0
+    assert cache.get("quote") is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 0)
+    assert stats["hit_ratio"] == 0.5
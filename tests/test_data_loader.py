@@ -0,0 +1,63 @@
+# C:\excel-to-web\tests\test_data_loader.py
+
+from datetime import datetime
+import pandas as pd
+
+import data_loader
+
+
+def _write_sources(data_dir, price=205.64):
+    pd.DataFrame([
+        {'Сервис': ' Главный Бухгалтер ПРОФ ', 'Уровень': 'Эксперт', 'Аккаунтов': 1, 'Стоимость без НДС': price, 'Минут': 800, 'Период': datetime(2025, 10, 1)},
+        {'Сервис': 'Главный Бухгалтер ПРОФ', 'Уровень': 'Эксперт', 'Аккаунтов': 2, 'Стоимость без НДС': 171.63, 'Минут': 800, 'Период': datetime(2009, 1, 1)},
+    ]).to_excel(data_dir / data_loader.PRICELIST_FILENAME, index=False)
+    pd.DataFrame([
+        {'ТП': 'Главный Бухгалтер ПРОФ', 'Уровень': 'ЭКСПЕРТ', 'Условие1': 0.15, 'Месяцев': 6, 'Условие2': None, 'Приказ': 'Акция_Пр.166 (сентябрь25)'},
+    ]).to_excel(data_dir / data_loader.PROMOTIONS_FILENAME, index=False)
+
+
+def test_load_tables_normalizes_and_reuses_snapshot_until_source_changes(tmp_path, monkeypatch):
+    """
+    Первая загрузка читает xlsx и пишет снимок, вторая берет снимок,
+    изменение xlsx приводит к повторному чтению исходных файлов.
+    """
+    monkeypatch.delenv("DATA_SNAPSHOT_DIR", raising=False)
+    _write_sources(tmp_path)
+
+    prices, promotions, source = data_loader.load_tables(tmp_path)
+    assert source == "xlsx"
+    assert list(prices['Период']) == ['окт.25', 'янв.09']
+    assert prices['Сервис'][0] == 'Главный Бухгалтер ПРОФ'
+    assert prices['Сервис'][0] is prices['Сервис'][1]
+    assert list(prices['Минут']) == ['800', '800']
+    assert [promotion.months for promotion in promotions] == [6]
+    assert promotions.records[0].condition2 is None
+
+    cached_prices, _, source = data_loader.load_tables(tmp_path)
+    assert source == "snapshot"
+    assert all(list(cached_prices[column]) == list(prices[column]) for column in prices.columns)
+
+    _write_sources(tmp_path, price=199.99)
+    reloaded_prices, _, source = data_loader.load_tables(tmp_path)
+    assert source == "xlsx"
+    assert reloaded_prices['Стоимость без НДС'][0] == 199.99
+
+
+def test_snapshot_is_loaded_without_pandas(tmp_path, monkeypatch):
+    """Рабочий процесс, стартующий со снимка, не импортирует pandas."""
+    import subprocess
+    import sys
+    from pathlib import Path
+    monkeypatch.delenv("DATA_SNAPSHOT_DIR", raising=False)
+    _write_sources(tmp_path)
+    data_loader.load_tables(tmp_path)
+
+    root = Path(data_loader.__file__).resolve().parent
+    script = (
+        "import sys, data_loader, main; from pathlib import Path; "
+        f"prices, _, source = data_loader.load_tables(Path({str(tmp_path)!r})); "
+        "main.build_pricing_data(prices, None, version=1, source=source); "
+        "print(source, 'pandas' in sys.modules)"
+    )
+    result = subprocess.run([sys.executable, "-c", script], cwd=root, capture_output=True, text=True, check=True)
+    assert result.stdout.strip().splitlines()[-1] == "snapshot False"
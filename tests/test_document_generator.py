@@ -0,0 +1,75 @@
+# C:\excel-to-web\tests\test_document_generator.py
+
+import io
+import os
+import shutil
+import zipfile
+
+from docxtpl import DocxTemplate
+
+import document_generator
+from document_generator import OfferTemplateCache
+
+CONTEXT = {
+    "service_name": "Главный Бухгалтер ПРОФ", "prepayment_months": 4, "discount_percent": 5.0,
+    "fixation_months": 6, "total_users": 6, "current_date": "01.10.2025",
+    "levels": [
+        {"level_name": "Эксперт", "accounts": 1, "price_without_vat_per_user": 205.64},
+        {"level_name": "Оптимальный", "accounts": 2, "price_without_vat_per_user": 101.16},
+    ],
+    "price_summary": {
+        "list_monthly": 874.66, "list_period": 3498.64, "discounted_monthly": 830.93,
+        "discounted_period": 3323.72, "fixed_monthly": 889.1, "fixed_period": 3556.4,
+    },
+}
+
+
+def _zip_entries(document_bytes):
+    archive = zipfile.ZipFile(io.BytesIO(document_bytes))
+    return {name: archive.read(name) for name in archive.namelist()}
+
+
+def test_cached_template_renders_same_document_as_docxtpl():
+    """
+    Рендер из кэша разобранного шаблона дает те же части документа, что и
+    обычный DocxTemplate, в том числе при повторном рендере другим контекстом.
+    """
+    doc = DocxTemplate(str(document_generator.OFFER_TEMPLATE_PATH))
+    doc.render(CONTEXT)
+    expected = io.BytesIO()
+    doc.save(expected)
+
+    document_generator.render_offer_bytes(dict(CONTEXT, service_name="Другой сервис", levels=[]))
+    assert _zip_entries(document_generator.render_offer_bytes(CONTEXT)) == _zip_entries(expected.getvalue())
+
+
+def test_template_cache_reloads_when_file_changes(tmp_path):
+    """Шаблон разбирается один раз и перечитывается только после изменения файла."""
+    template_path = tmp_path / "offer_template.docx"
+    shutil.copy(document_generator.OFFER_TEMPLATE_PATH, template_path)
+    cache = OfferTemplateCache(template_path)
+
+    first = cache.get()
+    assert cache.get() is first
+    assert cache.loads == 1
+
+    stat = os.stat(template_path)
+    os.utime(template_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert cache.get() is not first
+    assert cache.loads == 2
+
+
+def test_template_cache_falls_back_to_docxtpl_render(monkeypatch):
+    """Без нужных внутренних методов DocxTemplate кэш отдает обычный рендер docxtpl."""
+    monkeypatch.setattr(document_generator, "_DOCXTPL_INTERNALS", document_generator._DOCXTPL_INTERNALS + ("no_such_method",))
+    cache = OfferTemplateCache(document_generator.OFFER_TEMPLATE_PATH)
+    template = cache.get()
+    assert isinstance(template, document_generator._PlainOfferTemplate)
+
+    doc = DocxTemplate(str(document_generator.OFFER_TEMPLATE_PATH))
+    doc.render(CONTEXT)
+    expected = io.BytesIO()
+    doc.save(expected)
+    rendered = io.BytesIO()
+    template.render_to(CONTEXT, rendered)
+    assert _zip_entries(rendered.getvalue()) == _zip_entries(expected.getvalue())
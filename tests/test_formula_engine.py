@@ -0,0 +1,202 @@
+# C:\excel-to-web\tests\test_formula_engine.py
+
+import warnings
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+import data_loader
+import formula_engine
+import workbook_model
+from formula_engine import CompiledWorkbook, PivotSource, WorkbookState
+from price_store import PriceTable
+
+ROOT = Path(__file__).resolve().parent.parent
+SHEET = "Лист1"
+
+
+def _key(address, sheet=SHEET):
+    return (sheet,) + formula_engine.parse_cell(address)
+
+
+def _workbook(constants, formulas, **kwargs):
+    return CompiledWorkbook(
+        {_key(address): value for address, value in constants.items()},
+        {_key(address): text for address, text in formulas.items()},
+        **kwargs,
+    )
+
+
+def _evaluate(state, *addresses):
+    values = state.evaluate([_key(address) for address in addresses])
+    return [values[_key(address)] for address in addresses]
+
+
+def test_excel_semantics():
+    workbook = _workbook(
+        {"A1": 2.675, "A2": "Главный Бухгалтер ПРОФ", "A3": 10, "B1": "Эксперт", "B2": "Оптимальный", "C1": 1, "C2": 2},
+        {
+            "D1": "=ROUND(A1,2)",
+            "D2": '=IF(ISNUMBER(SEARCH("ЛД",A2)),"ЛД","-")',
+            "D3": '=IFERROR(A3/0,"деление")',
+            "D4": '=VLOOKUP("оптимальный",B1:C2,2,FALSE)',
+            "D5": '=HLOOKUP("нет",B1:C2,2,FALSE)',
+            "D6": '=CONCATENATE(A3," шт. ",TEXT(1234.5,"# ##0,00")," ",TEXT(0.15,"0%"))',
+            "D7": '=TEXT(DATE(2025,13,1),"ДД.ММ.ГГГГ")',
+            "D8": "=-2^2+A3%",
+            "D9": '=IFS(A3>10,"много",A3=10,"ровно")',
+            "D10": "=SUM(C1:C2,A3,TRUE)",
+            "D11": "=E20",
+            "D12": '=AND(A3>5,OR(A2="главный бухгалтер проф",FALSE))',
+        },
+    )
+    assert not workbook.compile_errors
+    state = WorkbookState(workbook)
+    assert _evaluate(state, "D1", "D2", "D3", "D4", "D5", "D6", "D7", "D8", "D9", "D10", "D11", "D12") == [
+        2.68, "-", "деление", 2, formula_engine.ERROR_NA, "10 шт. 1 234,50 15%", "01.01.2026", 4.1, "ровно", 14, 0, True,
+    ]
+
+
+def test_compile_errors_become_cell_errors():
+    workbook = _workbook({}, {"A1": "=НЕТФУНКЦИИ(1)", "A2": "=НетИмени", "A3": "=(1", "A4": "=A1+1"})
+    assert set(workbook.compile_errors) == {_key("A1"), _key("A2"), _key("A3")}
+    assert _evaluate(WorkbookState(workbook), "A1", "A2", "A3", "A4") == [formula_engine.ERROR_NAME] * 4
+
+
+def test_incremental_recalculation_touches_only_downstream_cells():
+    """Изменение входной ячейки сбрасывает и пересчитывает только зависящие от нее формулы."""
+    formulas = {"B1": "=A1*2", "B2": "=A2*2", "C1": "=B1+1", "C2": "=SUM(B1:B2)", "D1": "=A3"}
+    workbook = _workbook({"A1": 1, "A2": 2, "A3": 3}, formulas)
+    state = WorkbookState(workbook)
+    assert _evaluate(state, *formulas) == [2, 4, 3, 6, 3]
+    assert state.evaluations == 5
+
+    dirty = state.set_inputs({_key("A2"): 10})
+    assert dirty == {_key("B2"), _key("C2")}
+    assert _evaluate(state, *formulas) == [2, 20, 3, 22, 3]
+    assert state.evaluations == 7
+
+    # То же значение - ничего не пересчитывается; формулу задать нельзя
+    assert state.set_inputs({_key("A2"): 10}) == set()
+    with pytest.raises(ValueError):
+        state.set_inputs({_key("B1"): 5})
+
+
+def test_structured_references_names_and_pivots():
+    class Pivot(PivotSource):
+        def get(self, data_field, items):
+            return 100 * items["Аккаунтов"] if data_field == "цена1" else formula_engine.ERROR_REF
+
+    workbook = _workbook(
+        {"A1": "Аккаунтов", "B1": "Цена", "A2": 1, "B2": 10, "A3": 2, "B3": 20, "D1": 2},
+        {
+            "C2": "=Таблица1[[#This Row],[Аккаунтов]]*Таблица1[[#This Row],[Цена]]",
+            "C3": "=Таблица1[[#This Row],[Аккаунтов]]*Таблица1[[#This Row],[Цена]]",
+            "E1": "=SUMIFS(Таблица1[Цена],Таблица1[Аккаунтов],\">1\")",
+            "E2": '=GETPIVOTDATA("цена1",Сводная,"Аккаунтов",D1)',
+            "E3": "=SUM(Цены)",
+        },
+        tables={"Таблица1": (SHEET, 1, 1, 3, ["Аккаунтов", "Цена"])},
+        defined_names={"Сводная": (SHEET, 10, 1, 20, 5), "Цены": (SHEET, 2, 2, 3, 2)},
+    )
+    assert not workbook.compile_errors
+    state = WorkbookState(workbook, {"Сводная": Pivot()})
+    assert _evaluate(state, "C2", "C3", "E1", "E2", "E3") == [10, 40, 20, 200, 30]
+    # Входная ячейка внутри диапазона имени: зависимость найдена по диапазону
+    assert state.set_inputs({_key("B3"): 30}) == {_key("C3"), _key("E1"), _key("E3")}
+
+
+def test_volatile_cells_are_not_reused_from_base_values():
+    workbook = _workbook({}, {"A1": "=MONTH(TODAY())", "A2": "=A1+1", "A3": "=1+1"})
+    assert workbook.volatile == {_key("A1"), _key("A2")}
+    base = WorkbookState(workbook, today=lambda: date(2025, 7, 15))
+    base.evaluate(workbook.formulas)
+    state = WorkbookState(workbook, values=base.values, today=lambda: date(2025, 8, 1))
+    assert _evaluate(state, "A1", "A2", "A3") == [8, 9, 2]
+    assert state.evaluations == 2
+
+# ================================================================
+# КНИГА CALC.XLSM
+# ================================================================
+
+@pytest.fixture(scope="module")
+def calc_workbook(tmp_path_factory):
+    if not (ROOT / workbook_model.WORKBOOK_FILENAME).exists():
+        pytest.skip("calc.xlsm отсутствует")
+    source = workbook_model.load_workbook_source(ROOT, tmp_path_factory.mktemp("data"))
+    prices, _, _ = data_loader.load_tables(ROOT / "data_export")
+    return source, workbook_model.compile_workbook(source), prices
+
+
+def test_all_formulas_compile_and_match_cached_excel_values(calc_workbook):
+    """
+    Все формулы formulas_map.txt компилируются, а значения (при входных данных из
+    книги и сводных по data_export/pricelist.xlsx) совпадают с сохраненными Excel;
+    исключение - формулы, зависящие от TODAY().
+    """
+    import openpyxl
+    source, compiled, prices = calc_workbook
+    assert len(compiled.formulas) > 6000 and not compiled.compile_errors
+    values = WorkbookState(compiled, workbook_model.build_pivots(prices)).evaluate(compiled.formulas)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        cached_book = openpyxl.load_workbook(ROOT / workbook_model.WORKBOOK_FILENAME, data_only=True)
+    mismatches = []
+    for key, value in values.items():
+        if key in compiled.volatile:
+            continue
+        cached = cached_book[key[0]].cell(key[1], key[2]).value
+        if hasattr(cached, "year"):
+            cached = formula_engine.to_serial(cached)
+        if isinstance(value, formula_engine.CellError):
+            value = value.code
+        if cached is None:
+            cached = "" if value == "" else 0
+        if isinstance(value, (int, float)) and isinstance(cached, (int, float)) and not isinstance(value, bool):
+            matches = value == pytest.approx(cached, abs=1e-6)
+        else:
+            matches = value == cached
+        if not matches:
+            mismatches.append((key, value, cached))
+    assert not mismatches, mismatches[:10]
+
+
+def test_sheet_model_recalculates_only_changed_inputs(calc_workbook):
+    source, compiled, prices = calc_workbook
+    sheets = workbook_model.SheetModel(compiled, source, prices)
+    values, recalculated = sheets.evaluate("Расчет РС", {})
+    assert recalculated == 0 and values["J6"] == "#REF!"  # сервис не выбран
+
+    values, recalculated = sheets.evaluate("Расчет РС", {"E2": "окт.25", "E3": "Главный Бухгалтер ПРОФ", "E6": 3})
+    expected = formula_engine.round_half_up(
+        next(price for service, level, accounts, period, price in zip(
+            prices['Сервис'], prices['Уровень'], prices['Аккаунтов'], prices['Период'], prices['Стоимость без НДС'])
+            if (service, level, accounts, period) == ("Главный Бухгалтер ПРОФ", "Эксперт", 3, "окт.25")) * 3 * 1.2, 2)
+    assert values["E9"] == 3 and values["I6"] == expected and values["D15"] == "2025-10-01"
+    assert 0 < recalculated < len(sheets.sheet_cells["Расчет РС"])
+    # Правый блок (П2) от левого не зависит
+    assert values["R6"] == 0 and values["N9"] == 0
+
+    with pytest.raises(ValueError):
+        sheets.evaluate("Расчет РС", {"I6": 1})
+    with pytest.raises(ValueError):
+        sheets.evaluate("Расчет РС", {"E2": "не дата"})
+    with pytest.raises(KeyError):
+        sheets.evaluate("Калькулятор", {})
+
+
+def test_price_pivot_matches_pivot_semantics():
+    prices = PriceTable.from_records([
+        {'Сервис': 'ГБ', 'Уровень': 'Эксперт', 'Аккаунтов': 1, 'Стоимость без НДС': 10.0, 'Период': 'июл.25'},
+        {'Сервис': 'ГБ', 'Уровень': 'Эксперт', 'Аккаунтов': 2, 'Стоимость без НДС': 9.5, 'Период': 'июл.25'},
+        {'Сервис': 'ГБ', 'Уровень': 'Базовый', 'Аккаунтов': 1, 'Стоимость без НДС': 2.675, 'Период': 'июл.25'},
+    ])
+    pivots = workbook_model.build_pivots(prices)
+    july = formula_engine.to_serial(date(2025, 7, 1))
+    assert pivots["НМВ_безНДС"].get("цена1", {"Период": july, "Сервис": "гб", "Уровень": "ЭКСПЕРТ", "Аккаунтов": 2}) == 9.5
+    assert pivots["НМВ_Пользователей"].get("Пользователей", {"Период": "июл.25", "Сервис": "ГБ", "Уровень": "Эксперт"}) == 2
+    assert pivots["НМВ"].get("цена", {"Период": july, "Сервис": "ГБ", "Уровень": "Базовый", "Аккаунтов": 1}) == 3.21
+    assert pivots["НМВ_безНДС"].get("цена1", {"Период": july, "Сервис": "ГБ", "Уровень": "Эксперт", "Аккаунтов": 5}) == formula_engine.ERROR_REF
+    assert pivots["НМВ_безНДС"].get("цена", {}) == formula_engine.ERROR_REF
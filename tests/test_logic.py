@@ -6,6 +6,7 @@ import pytest
 
 # Импортируем функцию, которую хотим протестировать
 from logic import run_calculation
+from price_store import PriceTable
 
 # Используем pytest.approx для безопасного сравнения чисел с плавающей точкой
 approx = pytest.approx
@@ -399,4 +400,121 @@ def test_enterprise_over_max_users_with_discount_and_fixation():
     assert summary['discounted_monthly'] == approx(5841.72)
 
     assert summary['fixed_period'] == approx(59410.26)
-    assert summary['fixed_monthly'] == approx(6601.14)
\ No newline at end of file
+    assert summary['fixed_monthly'] == approx(6601.14)
+
+
+# ===== НОВЫЙ ТЕСТ ДЛЯ ИНДЕКСА ПРАЙС-ЛИСТА =====
+def test_price_index_matches_dataframe_tier_search():
+    """
+    Проверяет, что поиск тарифа через PriceIndex дает те же результаты,
+    что и прежний поиск по DataFrame:
+    - точное совпадение по количеству аккаунтов (при дублях - первая строка);
+    - превышение максимума -> максимальный тир;
+    - количество "между" тирами или ниже минимума -> тариф не найден.
+    """
+    from logic import PriceIndex, find_price_tiers
+
+    # --- 1. Arrange ---
+    mock_prices_data = [
+        {'Сервис': 'Предприятие', 'Уровень': 'Эксперт', 'Аккаунтов': 10, 'Стоимость без НДС': 112.50, 'Период': 'окт.25'},
+        {'Сервис': 'Предприятие', 'Уровень': 'Эксперт', 'Аккаунтов': 2, 'Стоимость без НДС': 180.00, 'Период': 'окт.25'},
+        {'Сервис': 'Предприятие', 'Уровень': 'Эксперт', 'Аккаунтов': 2, 'Стоимость без НДС': 999.99, 'Период': 'окт.25'},
+        {'Сервис': 'Предприятие', 'Уровень': 'Эксперт', 'Аккаунтов': 5, 'Стоимость без НДС': 140.00, 'Период': 'окт.25'},
+        {'Сервис': 'Предприятие', 'Уровень': 'Эксперт', 'Аккаунтов': 10, 'Стоимость без НДС': 1.00, 'Период': 'сен.25'},
+    ]
+    df_prices = pd.DataFrame(mock_prices_data)
+    price_index = PriceIndex.from_dataframe(df_prices)
+
+    def tier_price(accounts):
+        data = {"service": "Предприятие", "period": "окт.25", "levels": [{"level": "Эксперт", "accounts": accounts}]}
+        found = find_price_tiers(data, None, price_index)
+        return found[0]['price_without_vat_per_user'] if found else None
+
+    # --- 2-3. Act & Assert ---
+    assert tier_price(2) == approx(180.00)
+    assert tier_price(5) == approx(140.00)
+    assert tier_price(10) == approx(112.50)
+    assert tier_price(25) == approx(112.50)
+    assert tier_price(3) is None
+    assert tier_price(1) is None
+    assert tier_price(0) is None
+    assert price_index.find_price('Предприятие', 'Эксперт', 'ноя.25', 2) is None
+
+
+# ===== НОВЫЙ ТЕСТ ДЛЯ АКЦИЙ С ДЛИННОЙ ПРЕДОПЛАТОЙ И НЕСКОЛЬКИМИ ОКНАМИ =====
+@pytest.mark.parametrize("months, condition2, is_ld_service, expected_windows, expected_total", [
+    (36, '2 мес. со скидкой 99%', False, [(2, Decimal('0.99'))], Decimal('90590.96')),
+    (24, '1 мес. со скидкой 99%, 2 мес. со скидкой 50%', False, [(1, Decimal('0.99')), (2, Decimal('0.50'))], Decimal('59110.44')),
+    (3, '1 мес. со скидкой 99%, 5 мес. со скидкой 50%', False, [(1, Decimal('0.99')), (5, Decimal('0.50'))], Decimal('3270.81')),
+    (12, '2 мес. со скидкой 99%', True, [(2, Decimal('0.99'))], Decimal('26774.26')),
+    (12, None, False, [], Decimal('31908.36')),
+])
+def test_promotion_price_matches_month_by_month_reference(months, condition2, is_ld_service, expected_windows, expected_total):
+    """
+    Расчет по акции "отрезками" (льготные окна + базовая скидка) должен давать
+    ровно ту же сумму, что и честный помесячный перебор с округлением по каждому уровню.
+    Окна и итоги заданы явно, чтобы ошибка разбора "Условие2" не попала в эталон.
+    """
+    from logic import (
+        _calculate_discounted_price_with_promotion, _parse_condition2_windows, round_decimal, VAT_RATE
+    )
+
+    # --- 1. Arrange ---
+    level_prices_info = [
+        {"level_name": "Эксперт", "accounts": 2, "price_without_vat_per_user": 664.03},
+        {"level_name": "Оптимальный", "accounts": 3, "price_without_vat_per_user": 406.21},
+        {"level_name": "Минимальный", "accounts": 1, "price_without_vat_per_user": 51.17},
+    ]
+    promotion_details = {'Условие1': 0.15, 'Месяцев': months, 'Условие2': condition2}
+    applicable_levels = ['Эксперт', 'Оптимальный']
+
+    # Помесячный эталон по заданным окнам (без разбора "Условие2")
+    reference = Decimal('0')
+    for month_num in range(1, months + 1):
+        multiplier = Decimal('1') - Decimal('0.15')
+        window_end = 0
+        for window_months, window_discount in expected_windows:
+            window_end += window_months
+            if month_num <= window_end:
+                multiplier = Decimal('1') - window_discount
+                break
+        for level in level_prices_info:
+            level_multiplier = multiplier if level["level_name"] in applicable_levels else Decimal('1')
+            price = round_decimal(Decimal(str(level["price_without_vat_per_user"])) * Decimal(level["accounts"]) * level_multiplier)
+            reference += price if is_ld_service else round_decimal(price * VAT_RATE)
+    reference = round_decimal(reference * VAT_RATE) if is_ld_service else round_decimal(reference)
+
+    # --- 2. Act ---
+    result = _calculate_discounted_price_with_promotion(
+        level_prices_info, {}, promotion_details, applicable_levels, is_ld_service
+    )
+
+    # --- 3. Assert ---
+    assert _parse_condition2_windows(condition2) == expected_windows
+    assert reference == expected_total
+    assert result == expected_total
+
+
+@pytest.mark.parametrize("service", ["Комплекс коммерческий VIP Предприятие", "Пакет Программ Главный Бухгалтер, Podpis (1 пользователь, ЛД)"])
+def test_variant_calculations_match_run_calculation(service):
+    """Все варианты за один вызов: те же итоги, что run_calculation на каждый вариант."""
+    from logic import PriceIndex, run_variant_calculations
+
+    prices_table = PriceTable.from_records([
+        {'Сервис': service, 'Уровень': 'Эксперт', 'Аккаунтов': 2, 'Стоимость без НДС': 664.03, 'Период': 'окт.25'},
+        {'Сервис': service, 'Уровень': 'Оптимальный', 'Аккаунтов': 2, 'Стоимость без НДС': 406.20, 'Период': 'окт.25'},
+    ])
+    data = {
+        "period": "окт.25", "service": service, "prepayment_months": 3, "discount_percent": 7.0, "fixation_months": 2,
+        "levels": [{"level": "Эксперт", "accounts": 2}, {"level": "Оптимальный", "accounts": 2}],
+    }
+    variants = [({"discount_percent": 0.0}, None), ({}, None)]
+    for months, condition2 in ((6, None), (12, '2 мес. со скидкой 99%'), (12, '1 мес. со скидкой 99%, 2 мес. со скидкой 50%')):
+        details = {'Условие1': 0.10, 'Месяцев': months, 'Условие2': condition2}
+        variants.append(({"prepayment_months": months, "fixation_months": 0}, {"details": details, "applicable_levels": ['Эксперт']}))
+
+    summaries = run_variant_calculations(data, variants, PriceIndex.from_table(prices_table))
+    for (changes, promotion_info), summary in zip(variants, summaries):
+        expected = run_calculation(dict(data, **changes), prices_table, promotion_info=promotion_info)["price_summary"]
+        assert summary == expected, changes
+    assert run_variant_calculations(dict(data, period="ноя.25"), variants, PriceIndex.from_table(prices_table)) is None
@@ -0,0 +1,513 @@
+# C:\excel-to-web\tests\test_main.py
+
+import pandas as pd
+from datetime import datetime
+import dataclasses
+import json
+import pytest
+
+import main
+from price_store import PriceTable, PromotionTable
+from main import CalculationInput, build_promotion_catalogue, build_promotion_selection_map, find_applicable_promotion
+
+approx = pytest.approx
+
+
+class _FixedDateTime(datetime):
+    """Подменяет "сегодня" на сентябрь 2025, чтобы период окт.25 был разрешен для акций."""
+    @classmethod
+    def now(cls, tz=None):
+        return datetime(2025, 9, 15, 12, 0)
+
+
+@pytest.fixture
+def fixed_today(monkeypatch):
+    monkeypatch.setattr(main, "datetime", _FixedDateTime)
+
+
+@pytest.fixture
+def promotions():
+    return PromotionTable.from_records([
+        {'ТП': 'Комплекс коммерческий VIP Предприятие', 'Уровень': 'ЭКСПЕРТ', 'Условие1': 0.15, 'Месяцев': 12, 'Условие2': None, 'Приказ': 'Акция_Пр.166 (сентябрь25)'},
+        {'ТП': 'Комплекс коммерческий VIP Предприятие', 'Уровень': 'ЭКСПЕРТОПТИМАЛЬНЫЙ', 'Условие1': 0.10, 'Месяцев': 12, 'Условие2': '1 мес. со скидкой 99%', 'Приказ': 'Акция_Пр.166 (сентябрь25)'},
+        {'ТП': 'Комплекс коммерческий VIP Предприятие', 'Уровень': 'ЭКСПЕРТОПТИМАЛЬНЫЙМИНИМАЛЬНЫЙ', 'Условие1': 0.10, 'Месяцев': 12, 'Условие2': '2 мес. со скидкой 99%', 'Приказ': 'Акция_Пр.166 (сентябрь25)'},
+        {'ТП': 'Комплекс коммерческий VIP Предприятие', 'Уровень': 'ОПТИМАЛЬНЫЙ', 'Условие1': 0.05, 'Месяцев': 6, 'Условие2': None, 'Приказ': 'Акция_Пр.166 (сентябрь25)'},
+    ])
+
+
+def _request(levels, prepayment_months=12, period="окт.25"):
+    return CalculationInput(
+        period=period,
+        service="Комплекс коммерческий VIP Предприятие",
+        levels=[{"level": name, "accounts": accounts} for name, accounts in levels],
+        prepayment_months=prepayment_months,
+        promotion_id="Акция_Пр.166 (сентябрь25)",
+    )
+
+
+def test_promotion_catalogue_picks_largest_matching_combo(fixed_today, promotions):
+    """
+    Из всех вариантов акции выбирается "комбо" с наибольшим числом уровней,
+    которые пользователь действительно заполнил (аккаунтов > 0).
+    """
+    catalogue = build_promotion_catalogue(promotions)
+
+    full = find_applicable_promotion(_request([("Эксперт", 2), ("Оптимальный", 2), ("Минимальный", 2)]), catalogue)
+    assert set(full["applicable_levels"]) == {'Эксперт', 'Оптимальный', 'Минимальный'}
+    assert full["details"]['Условие2'] == '2 мес. со скидкой 99%'
+
+    partial = find_applicable_promotion(_request([("Эксперт", 2), ("Оптимальный", 1), ("Минимальный", 0)]), catalogue)
+    assert set(partial["applicable_levels"]) == {'Эксперт', 'Оптимальный'}
+
+    expert_only = find_applicable_promotion(_request([("Эксперт", 1)]), catalogue)
+    assert expert_only["details"]['Условие1'] == pytest.approx(0.15)
+
+
+def test_promotion_catalogue_respects_months_and_period(fixed_today, promotions):
+    """
+    Акция не применяется, если нет варианта на выбранное число месяцев
+    или период прейскуранта не входит в разрешенные (текущий и два следующих месяца).
+    """
+    catalogue = build_promotion_catalogue(promotions)
+
+    assert find_applicable_promotion(_request([("Эксперт", 1)], prepayment_months=7), catalogue) is None
+    assert find_applicable_promotion(_request([("Оптимальный", 1)], prepayment_months=6), catalogue) is not None
+    assert find_applicable_promotion(_request([("Эксперт", 1)], period="авг.25"), catalogue) is None
+    assert find_applicable_promotion(_request([("Эксперт", 1)], period="дек.25"), catalogue) is None
+
+
+def test_promotion_selection_map_requires_exact_level_set(promotions):
+    """
+    Для /get_all_promotions_for_selection ответы собираются заранее:
+    акция попадает в выдачу, только если набор уровней совпадает в точности,
+    варианты отсортированы по месяцам.
+    """
+    selection_map = build_promotion_selection_map(promotions)
+    service_key = 'комплекс коммерческий vip предприятие'
+
+    combo = selection_map[(service_key, frozenset({'эксперт', 'оптимальный'}))]
+    promo = combo['Акция_Пр.166 (сентябрь25)']
+    assert promo['applicable_levels'] == ['ЭКСПЕРТОПТИМАЛЬНЫЙ']
+    assert promo['variants'] == [{"months": 12, "discount_percent": pytest.approx(10.0), "condition2": '1 мес. со скидкой 99%'}]
+
+    assert (service_key, frozenset({'эксперт', 'оптимальный', 'базовый'})) not in selection_map
+    assert selection_map[(service_key, frozenset({'оптимальный'}))]['Акция_Пр.166 (сентябрь25)']['variants'][0]['months'] == 6
+
+
+@pytest.fixture
+def mock_price_data(monkeypatch):
+    """Подменяет загруженные данные небольшим прайсом "Главный Бухгалтер ПРОФ" и чистит кэш расчетов."""
+    price_rows = [
+        {'Сервис': 'Главный Бухгалтер ПРОФ', 'Уровень': 'Эксперт', 'Аккаунтов': 1, 'Стоимость без НДС': 205.64, 'Период': 'окт.25'},
+        {'Сервис': 'Главный Бухгалтер ПРОФ', 'Уровень': 'Оптимальный', 'Аккаунтов': 2, 'Стоимость без НДС': 101.16, 'Период': 'окт.25'},
+        {'Сервис': 'Главный Бухгалтер ПРОФ', 'Уровень': 'Базовый', 'Аккаунтов': 3, 'Стоимость без НДС': 28.86, 'Период': 'окт.25'},
+    ]
+    prices = PriceTable.from_records(price_rows)
+    monkeypatch.setattr(main, "current_data", main.build_pricing_data(prices, PromotionTable(), version=1, source="test"))
+    monkeypatch.setattr(main, "calculation_cache", main.CalculationCache(maxsize=16, ttl_seconds=60))
+    return prices
+
+
+GLAVBUH_QUOTE = {
+    "period": "окт.25", "service": "Главный Бухгалтер ПРОФ",
+    "levels": [{"level": "Эксперт", "accounts": 1}, {"level": "Оптимальный", "accounts": 2}, {"level": "Базовый", "accounts": 3}],
+    "prepayment_months": 4, "discount_percent": 5.0, "fixation_months": 6,
+}
+
+
+def test_calculate_uses_result_cache_until_data_version_changes(mock_price_data, monkeypatch):
+    """
+    Повторный /calculate с тем же (канонически) вводом берется из кэша;
+    смена версии данных (перезагрузка) делает старые записи недоступными.
+    """
+    from fastapi.testclient import TestClient
+    client = TestClient(main.app)
+
+    first = client.post("/calculate", json=GLAVBUH_QUOTE).json()
+    with_empty_level = dict(GLAVBUH_QUOTE, levels=GLAVBUH_QUOTE["levels"] + [{"level": "Минимальный", "accounts": 0}])
+    second = client.post("/calculate", json=with_empty_level).json()
+    assert first == second
+    assert (main.calculation_cache.hits, main.calculation_cache.misses) == (1, 1)
+
+    monkeypatch.setattr(main, "current_data", dataclasses.replace(main.current_data, version=main.current_data.version + 1))
+    client.post("/calculate", json=GLAVBUH_QUOTE)
+    assert main.calculation_cache.misses == 2
+    assert client.get("/calculate/cache_stats").json()["hits"] == 1
+
+
+def test_calculate_batch_matches_single_calculation(mock_price_data):
+    """
+    /calculate/batch принимает JSON-массив и NDJSON, сохраняет порядок,
+    возвращает ошибки по отдельным элементам, а результаты совпадают с /calculate.
+    """
+    from fastapi.testclient import TestClient
+    client = TestClient(main.app)
+
+    quote = GLAVBUH_QUOTE
+    missing = dict(quote, period="ноя.25")
+    single = client.post("/calculate", json=quote).json()
+
+    results = client.post("/calculate/batch", json=[quote, {"period": "окт.25"}, missing, quote]).json()["results"]
+    assert results[0] == single
+    assert results[3] == single
+    assert "error" in results[1]
+    assert "error" in results[2]
+    assert single["price_summary"]["fixed_period"] == approx(2412.96)
+
+    ndjson = "\n".join([json.dumps(quote, ensure_ascii=False), "{broken", json.dumps(missing, ensure_ascii=False)])
+    response = client.post("/calculate/batch", content=ndjson.encode("utf-8"), headers={"Content-Type": "application/x-ndjson"})
+    results = response.json()["results"]
+    assert [("error" in result) for result in results] == [False, True, True]
+    assert results[0] == single
+
+
+def test_calculate_batch_handles_accounts_beyond_int64(mock_price_data):
+    """Предложение с аккаунтами вне int64 считается по Decimal-пути и не ломает остальные элементы пакета."""
+    from fastapi.testclient import TestClient
+    client = TestClient(main.app)
+
+    oversized = dict(GLAVBUH_QUOTE, levels=[{"level": "Эксперт", "accounts": 10 ** 20}])
+    results = client.post("/calculate/batch", json=[GLAVBUH_QUOTE, oversized]).json()["results"]
+    assert results[0] == client.post("/calculate", json=GLAVBUH_QUOTE).json()
+    assert results[1] == client.post("/calculate", json=oversized).json()
+    assert "error" not in results[1]
+
+
+def test_calculate_batch_recalculates_items_one_by_one_when_engine_fails(mock_price_data, monkeypatch):
+    """Если векторный расчет падает, позиции пакета считаются по одной и получают свои результаты."""
+    from fastapi.testclient import TestClient
+    client = TestClient(main.app)
+    single = client.post("/calculate", json=GLAVBUH_QUOTE).json()
+
+    def broken_engine(batch, price_index):
+        raise OverflowError("int too big to convert")
+    monkeypatch.setattr(main.batch_engine, "run_batch_calculation", broken_engine)
+
+    missing = dict(GLAVBUH_QUOTE, period="ноя.25")
+    results = client.post("/calculate/batch", json=[GLAVBUH_QUOTE, missing, GLAVBUH_QUOTE]).json()["results"]
+    assert results[0] == single
+    assert results[2] == single
+    assert "error" in results[1]
+
+
+def test_whatif_session_updates_match_calculate(mock_price_data):
+    """
+    Сессия "что если": PATCH с одним изменившимся полем дает те же итоги, что /calculate
+    для полного ввода; неизвестная или закрытая сессия - 404.
+    """
+    from fastapi.testclient import TestClient
+    client = TestClient(main.app)
+
+    opened = client.post("/calculate/whatif", json=GLAVBUH_QUOTE).json()
+    session_id = opened["session_id"]
+    assert opened["price_summary"] == client.post("/calculate", json=GLAVBUH_QUOTE).json()["price_summary"]
+
+    updated = client.patch(f"/calculate/whatif/{session_id}", json={"levels": [{"level": "Оптимальный", "accounts": 0}]}).json()
+    expected = client.post("/calculate", json=dict(GLAVBUH_QUOTE, levels=[GLAVBUH_QUOTE["levels"][0], GLAVBUH_QUOTE["levels"][2]])).json()
+    assert {key: updated[key] for key in expected} == expected
+    assert updated["recalculated"]["tiers"] == 0
+
+    updated = client.patch(f"/calculate/whatif/{session_id}", json={"discount_percent": 10.0}).json()
+    expected = client.post("/calculate", json=dict(GLAVBUH_QUOTE, levels=[GLAVBUH_QUOTE["levels"][0], GLAVBUH_QUOTE["levels"][2]], discount_percent=10.0)).json()
+    assert updated["price_summary"] == expected["price_summary"]
+
+    assert client.patch(f"/calculate/whatif/{session_id}", json={"fixation_months": "много"}).status_code == 422
+    client.delete(f"/calculate/whatif/{session_id}")
+    assert client.patch(f"/calculate/whatif/{session_id}", json={"discount_percent": 1.0}).status_code == 404
+
+
+def test_rating_endpoints_compare_both_sides(mock_price_data):
+    """/calculate/rating и пакетный /calculate/rating/batch: РС до и после изменения договора."""
+    from fastapi.testclient import TestClient
+    client = TestClient(main.app)
+    amendment = {
+        "current": {"period": "окт.25", "products": [{"service": "Главный Бухгалтер ПРОФ", "levels": [{"level": "Эксперт", "accounts": 1}]}]},
+        "changed": {"period": "окт.25", "products": [{"service": "Главный Бухгалтер ПРОФ", "levels": [{"level": "Оптимальный", "accounts": 2}]}]},
+    }
+    single = client.post("/calculate/rating", json=amendment).json()
+    assert single["current"]["price_with_vat"] == approx(246.77) and single["changed"]["price_with_vat"] == approx(242.78)
+    # В тестовом прайсе нет базового продукта - РС и разница не считаются
+    assert single["current"]["base_value"] is None and single["rating_difference"] is None
+
+    batch = client.post("/calculate/rating/batch", json=[amendment, {"current": {}}, amendment]).json()["results"]
+    assert batch[0] == single == batch[2]
+    assert "error" in batch[1]
+
+
+def test_compare_versions_endpoint_returns_feature_and_price_diff(mock_price_data):
+    """/compare_versions: отличающиеся функции из матрицы и разница цен по индексу тиров."""
+    from fastapi.testclient import TestClient
+    if main.current_data.versions is None:
+        pytest.skip("данные для сравнения не загружены")
+    client = TestClient(main.app)
+    request = {"period": "окт.25", "accounts": 1,
+               "left": {"service": "Главный Бухгалтер ПРОФ", "level": "Эксперт"},
+               "right": {"service": "Главный Бухгалтер ПРОФ", "level": "Оптимальный"}}
+    body = client.post("/compare_versions", json=request).json()
+    assert body["features"] and body["same_features"] + len(body["features"]) == 80
+    assert body["left"]["version"] == "Главный бухгалтер ПРОФ" and body["left"]["list_monthly"] == approx(246.77)
+    # В тестовом прайсе у "Оптимальный" только тир на 2 аккаунта
+    assert body["right"]["price_found"] is False and body["price_difference"] is None
+
+    body = client.post("/compare_versions", json=dict(request, accounts=2)).json()
+    # Слева 2 аккаунта больше старшего тира (1) - цена старшего тира, как в /calculate
+    assert body["left"]["list_monthly"] == approx(493.54) and body["right"]["list_monthly"] == approx(242.78)
+    assert body["price_difference"] == approx(242.78 - 493.54)
+    assert client.post("/compare_versions", json=dict(request, right={"service": "Нет", "level": "Эксперт"})).status_code == 404
+
+
+def test_optimize_endpoint_ranks_options(mock_price_data):
+    """/calculate/optimize: лучший вариант совпадает с /calculate для тех же параметров."""
+    from fastapi.testclient import TestClient
+    client = TestClient(main.app)
+    request = {"period": "окт.25", "service": "Главный Бухгалтер ПРОФ", "discount_percent": 5.0,
+               "levels": [{"level": "Эксперт", "accounts": 1}, {"level": "Оптимальный", "accounts": 2}]}
+    body = client.post("/calculate/optimize", json=dict(request, top=5)).json()
+    assert body["complete"] and body["data_version"] == 1 and 0 < len(body["options"]) <= 5
+    prices = [option["monthly_price"] for option in body["options"]]
+    assert prices == sorted(prices)
+
+    best = body["options"][0]
+    calculated = client.post("/calculate", json=dict(
+        request, prepayment_months=best["prepayment_months"], fixation_months=best["fixation_months"])).json()
+    assert calculated["price_summary"] == best["price_summary"]
+
+    assert client.post("/calculate/optimize", json=dict(request, fixation_months=[13])).status_code == 422
+    assert "error" in client.post("/calculate/optimize", json=dict(request, service="Нет такого")).json()
+
+
+def test_compare_promotions_endpoint_matches_calculate(fixed_today, promotions, monkeypatch):
+    """/calculate/promotions: без скидки, ручная скидка и каждая подходящая акция - как отдельные /calculate."""
+    from fastapi.testclient import TestClient
+    service = "Комплекс коммерческий VIP Предприятие"
+    prices = PriceTable.from_records([
+        {'Сервис': service, 'Уровень': 'Эксперт', 'Аккаунтов': 2, 'Стоимость без НДС': 664.03, 'Период': 'окт.25'},
+        {'Сервис': service, 'Уровень': 'Оптимальный', 'Аккаунтов': 2, 'Стоимость без НДС': 406.20, 'Период': 'окт.25'},
+    ])
+    monkeypatch.setattr(main, "current_data", main.build_pricing_data(prices, promotions, version=1, source="test"))
+    monkeypatch.setattr(main, "calculation_cache", main.CalculationCache(maxsize=16, ttl_seconds=60))
+    client = TestClient(main.app)
+    request = {"period": "окт.25", "service": service, "prepayment_months": 3, "discount_percent": 5.0, "fixation_months": 0,
+               "levels": [{"level": "Эксперт", "accounts": 2}, {"level": "Оптимальный", "accounts": 2}]}
+
+    results = client.post("/calculate/promotions", json=request).json()["results"]
+    assert [(r["variant"], r["prepayment_months"]) for r in results] == [
+        ("no_promotion", 3), ("manual_discount", 3), ("promotion", 6), ("promotion", 12),
+    ]
+    assert set(results[3]["applicable_levels"]) == {"Эксперт", "Оптимальный"} and results[3]["discount_percent"] == approx(10.0)
+    for result in results:
+        single = dict(request, prepayment_months=result["prepayment_months"], promotion_id=result["promotion_id"],
+                      discount_percent=request["discount_percent"] if result["variant"] != "no_promotion" else 0.0)
+        assert client.post("/calculate", json=single).json()["price_summary"] == result["price_summary"], result["variant"]
+
+    assert "error" in client.post("/calculate/promotions", json=dict(request, period="ноя.25")).json()
+
+
+def test_sheet_endpoint_evaluates_workbook_sheet_with_loaded_prices(mock_price_data, monkeypatch):
+    """/sheets/Расчет РС: формулы книги считаются по прайсу текущей версии данных."""
+    from fastapi.testclient import TestClient
+    # Книга не компилируется при загрузке данных - только при первом запросе к листам
+    monkeypatch.setattr(main, "_compiled_workbook", None)
+    monkeypatch.setattr(main, "current_data", main.build_pricing_data(mock_price_data, PromotionTable(), version=1, source="test"))
+    assert main._compiled_workbook is None
+    if main.current_data.sheets.get() is None:
+        pytest.skip("calc.xlsm не загружена")
+    client = TestClient(main.app)
+
+    response = client.post("/sheets/Расчет РС", json={"inputs": {"E2": "окт.25", "E3": "Главный Бухгалтер ПРОФ", "E6": 1}})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["data_version"] == 1 and body["recalculated"] > 0
+    assert body["values"]["I6"] == approx(round(205.64 * 1.2, 2)) and body["values"]["E9"] == 1
+    assert body["values"]["D15"] == "2025-10-01"
+
+    assert client.post("/sheets/Расчет РС", json={"inputs": {"I6": 1}}).status_code == 422
+    assert client.post("/sheets/Нет листа", json={"inputs": {}}).status_code == 404
+
+
+def test_reload_data_swaps_snapshot_and_rejects_broken_files(tmp_path, monkeypatch):
+    """
+    Горячая перезагрузка: корректные файлы публикуются новой версией,
+    а файл без нужных столбцов отклоняется - продолжаем работать на прежних данных.
+    """
+    monkeypatch.setattr(main, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(main, "current_data", main.PricingData())
+    monkeypatch.setenv("DATA_SNAPSHOT_DIR", str(tmp_path / "snapshot"))
+    pd.DataFrame([
+        {'Сервис': 'Предприятие', 'Уровень': 'Эксперт', 'Аккаунтов': 1, 'Стоимость без НДС': 112.5, 'Минут': 800, 'Период': datetime(2025, 10, 1)},
+    ]).to_excel(tmp_path / "pricelist.xlsx", index=False)
+
+    first = main.reload_data()
+    assert first["status"] == "reloaded"
+    loaded = main.current_data
+    assert loaded.price_index.find_price('Предприятие', 'Эксперт', 'окт.25', 1) == approx(112.5)
+
+    pd.DataFrame([{'Сервис': 'Предприятие', 'Цена': 1}]).to_excel(tmp_path / "pricelist.xlsx", index=False)
+    second = main.reload_data()
+    assert second["status"] == "rejected"
+    assert main.current_data is loaded
+
+
+def test_admin_reload_requires_token(monkeypatch):
+    """Без заданного ADMIN_TOKEN или с неверным токеном перезагрузка недоступна."""
+    from fastapi.testclient import TestClient
+    client = TestClient(main.app)
+
+    monkeypatch.setattr(main, "ADMIN_TOKEN", None)
+    assert client.post("/admin/reload").status_code == 403
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+    assert client.post("/admin/reload", headers={"X-Admin-Token": "wrong"}).status_code == 403
+
+
+def test_download_offers_streams_zip_with_unique_names_and_errors(mock_price_data, monkeypatch):
+    """
+    /download_offers отдает ZIP: документы в порядке запроса, одинаковые имена
+    получают суффикс " (2)", а нерассчитанные позиции перечислены в "Ошибки.txt".
+    """
+    import io
+    import zipfile
+    from fastapi.testclient import TestClient
+    from render_pool import RenderPool
+    pool = RenderPool(max_workers=2, max_queue=0, mode="thread")
+    monkeypatch.setattr(main, "offer_render_pool", pool)
+    client = TestClient(main.app)
+
+    try:
+        response = client.post("/download_offers", json=[GLAVBUH_QUOTE, dict(GLAVBUH_QUOTE, period="ноя.25"), GLAVBUH_QUOTE])
+    finally:
+        pool.shutdown()
+
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    names = archive.namelist()
+    date_str = datetime.now().strftime("%d.%m.%Y")
+    assert names == [
+        f"КП Главный Бухгалтер ПРОФ от {date_str}.docx",
+        f"КП Главный Бухгалтер ПРОФ от {date_str} (2).docx",
+        "Ошибки.txt",
+    ]
+    assert archive.read("Ошибки.txt").decode("utf-8").startswith("2: ")
+    assert zipfile.is_zipfile(io.BytesIO(archive.read(names[0])))
+
+
+def test_download_offers_finishes_archive_when_render_fails(mock_price_data, monkeypatch):
+    """Сбой рендера (например, сломанный пул) попадает в "Ошибки.txt", архив дописывается до конца."""
+    import io
+    import zipfile
+    from concurrent.futures.process import BrokenProcessPool
+    from fastapi.testclient import TestClient
+    from render_pool import RenderPool
+    pool = RenderPool(max_workers=1, max_queue=0, mode="thread")
+    monkeypatch.setattr(main, "offer_render_pool", pool)
+    render = main.document_generator.render_offer_bytes
+
+    def flaky_render(context):
+        if context["discount_percent"] == 7.0:
+            raise BrokenProcessPool("worker died")
+        return render(context)
+    monkeypatch.setattr(main.document_generator, "render_offer_bytes", flaky_render)
+    client = TestClient(main.app)
+
+    try:
+        response = client.post("/download_offers", json=[GLAVBUH_QUOTE, dict(GLAVBUH_QUOTE, discount_percent=7.0), GLAVBUH_QUOTE])
+    finally:
+        pool.shutdown()
+
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert len(archive.namelist()) == 3
+    assert archive.read("Ошибки.txt").decode("utf-8") == "2: Произошла ошибка при создании документа."
+
+
+def test_archive_render_waits_for_pool_slot_with_timeout(monkeypatch):
+    """
+    Рендер для архива ждет свободного воркера (без RenderPoolBusy при max_queue=0),
+    а если место не освободилось за таймаут пула - asyncio.TimeoutError.
+    """
+    import asyncio
+    import time
+    from render_pool import RenderPool
+    monkeypatch.setattr(main.document_generator, "render_offer_bytes", lambda context: time.sleep(context["sleep"]) or b"docx")
+
+    async def render_two(first_sleep, second_sleep):
+        return await asyncio.gather(
+            main._render_offer_for_archive({"sleep": first_sleep}),
+            main._render_offer_for_archive({"sleep": second_sleep}),
+            return_exceptions=True,
+        )
+
+    pool = RenderPool(max_workers=1, max_queue=0, timeout_seconds=1.0, mode="thread")
+    monkeypatch.setattr(main, "offer_render_pool", pool)
+    try:
+        assert asyncio.run(render_two(0.1, 0.0)) == [b"docx", b"docx"]
+        assert pool.stats()["rejected"] == 0
+
+        async def render_while_slot_taken():
+            await main._get_archive_render_slots().acquire()
+            await main._render_offer_for_archive({"sleep": 0.0})
+
+        pool.timeout_seconds = 0.1
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(render_while_slot_taken())
+    finally:
+        pool.shutdown()
+
+
+def test_download_offer_pdf_requires_converter(mock_price_data, monkeypatch):
+    """format=pdf без настроенного конвертера - 503, неизвестный формат - 400."""
+    from fastapi.testclient import TestClient
+    from pdf_converter import PdfConverter
+    monkeypatch.setattr(main, "pdf_converter", PdfConverter(command=None))
+    client = TestClient(main.app)
+
+    assert client.post("/download_offer?format=pdf", json=GLAVBUH_QUOTE).status_code == 503
+    assert client.post("/download_offer?format=xls", json=GLAVBUH_QUOTE).status_code == 400
+
+
+def test_metrics_endpoint_reports_stages_and_requests(mock_price_data):
+    """После /calculate на /metrics есть этапы расчета и счетчик запросов по шаблону маршрута."""
+    from fastapi.testclient import TestClient
+    client = TestClient(main.app)
+
+    client.post("/calculate", json=GLAVBUH_QUOTE)
+    client.get("/get_levels_for_service/Главный Бухгалтер ПРОФ")
+    text = client.get("/metrics").text
+
+    for stage in ("cache_lookup", "find_applicable_promotion", "run_calculation.find_price_tiers",
+                  "run_calculation.decimal_arithmetic", "serialize_json"):
+        assert f'tariff_stage_duration_seconds_count{{stage="{stage}"}}' in text
+    assert 'tariff_http_requests_total{method="POST",route="/calculate",status="200"}' in text
+    assert 'route="/get_levels_for_service/{service_name}"' in text
+    assert 'tariff_data_rows{table="prices"} 3' in text
+
+
+def test_main_page_and_levels_are_revalidated_with_304(monkeypatch):
+    """
+    Главная страница и уровни сервиса готовятся один раз на версию данных;
+    повторный запрос с ETag или Last-Modified получает 304, новая версия данных - новый ETag.
+    """
+    from fastapi.testclient import TestClient
+    price_rows = [
+        {'Сервис': 'Главный Бухгалтер ПРОФ', 'Уровень': 'Базовый', 'Минут': '30', 'Аккаунтов': 1, 'Стоимость без НДС': 28.86, 'Период': 'окт.25'},
+        {'Сервис': 'Главный Бухгалтер ПРОФ', 'Уровень': 'Эксперт', 'Минут': '60', 'Аккаунтов': 1, 'Стоимость без НДС': 205.64, 'Период': 'окт.25'},
+        {'Сервис': 'Главный Бухгалтер ПРОФ', 'Уровень': 'Эксперт', 'Минут': '90', 'Аккаунтов': 2, 'Стоимость без НДС': 190.0, 'Период': 'окт.25'},
+    ]
+    monkeypatch.setattr(main, "current_data", main.build_pricing_data(PriceTable.from_records(price_rows), PromotionTable(), version=1, source="test"))
+    client = TestClient(main.app)
+
+    levels = client.get("/get_levels_for_service/Главный Бухгалтер ПРОФ")
+    assert levels.json() == [{'Уровень': 'Эксперт', 'Минут': '60'}, {'Уровень': 'Базовый', 'Минут': '30'}]
+    assert levels.headers["cache-control"] == main.METADATA_CACHE_CONTROL
+    assert client.get("/get_levels_for_service/Нет такого").json() == []
+
+    page = client.get("/")
+    assert page.status_code == 200 and "Главный Бухгалтер ПРОФ" in page.text
+    not_modified = client.get("/", headers={"If-None-Match": page.headers["etag"]})
+    assert not_modified.status_code == 304 and not_modified.content == b""
+    assert client.get("/", headers={"If-Modified-Since": page.headers["last-modified"]}).status_code == 304
+    assert client.get("/get_levels_for_service/Главный Бухгалтер ПРОФ", headers={"If-None-Match": levels.headers["etag"]}).status_code == 304
+
+    price_rows[0]['Минут'] = '45'
+    monkeypatch.setattr(main, "current_data", main.build_pricing_data(PriceTable.from_records(price_rows), PromotionTable(), version=2, source="test"))
+    changed = client.get("/get_levels_for_service/Главный Бухгалтер ПРОФ", headers={"If-None-Match": levels.headers["etag"]})
+    assert changed.status_code == 200 and changed.json()[1]['Минут'] == '45'
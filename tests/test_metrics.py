@@ -0,0 +1,27 @@
+# C:\excel-to-web\tests\test_metrics.py
+
+from metrics import MetricsRegistry
+
+
+def test_histogram_and_counter_render_prometheus_text():
+    """Гистограмма отдает накопительные корзины, _sum и _count; метки экранируются."""
+    registry = MetricsRegistry()
+    histogram = registry.histogram("demo_seconds", "Пример", ("stage",), buckets=(0.1, 1.0))
+    counter = registry.counter("demo_total", "Пример", ("route",))
+
+    series = histogram.labels("calc")
+    for value in (0.05, 0.1, 0.5, 3.0):
+        series.observe(value)
+    counter.inc(('/a"b',))
+    counter.inc(('/a"b',))
+    registry.register_collector(lambda: [("demo_rows", "gauge", "Строки", [({"table": "prices"}, 952)])])
+
+    lines = registry.render().splitlines()
+    assert 'demo_seconds_bucket{stage="calc",le="0.1"} 2' in lines
+    assert 'demo_seconds_bucket{stage="calc",le="1"} 3' in lines
+    assert 'demo_seconds_bucket{stage="calc",le="+Inf"} 4' in lines
+    assert 'demo_seconds_sum{stage="calc"} 3.65' in lines
+    assert 'demo_seconds_count{stage="calc"} 4' in lines
+    assert 'demo_total{route="/a\\"b"} 2' in lines
+    assert "# TYPE demo_rows gauge" in lines
+    assert 'demo_rows{table="prices"} 952' in lines
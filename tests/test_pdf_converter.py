@@ -0,0 +1,75 @@
+# C:\excel-to-web\tests\test_pdf_converter.py
+
+import asyncio
+import io
+import socket
+import sys
+import time
+import zipfile
+
+import pytest
+
+from pdf_converter import PdfConverter, PdfConverterUnavailable, docx_digest
+
+# Заглушка unoserver: тот же XML-RPC интерфейс convert(...), вместо PDF - помеченные байты
+FAKE_UNOSERVER = '''
+import argparse, xmlrpc.client
+from xmlrpc.server import SimpleXMLRPCServer
+parser = argparse.ArgumentParser()
+parser.add_argument("--interface"); parser.add_argument("--port", type=int)
+parser.add_argument("--uno-port"); parser.add_argument("--user-installation")
+args = parser.parse_args()
+server = SimpleXMLRPCServer((args.interface, args.port), allow_none=True, logRequests=False)
+def convert(inpath, indata, outpath, convert_to):
+    return xmlrpc.client.Binary(b"%PDF-fake " + indata.data)
+server.register_function(convert)
+server.serve_forever()
+'''
+
+
+def _docx(text, date_time):
+    stream = io.BytesIO()
+    with zipfile.ZipFile(stream, "w") as archive:
+        archive.writestr(zipfile.ZipInfo("word/document.xml", date_time=date_time), text)
+    return stream.getvalue()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_docx_digest_ignores_zip_timestamps():
+    """Один и тот же документ, записанный в разное время, дает один ключ кэша PDF."""
+    assert docx_digest(_docx("КП", (2025, 9, 1, 10, 0, 0))) == docx_digest(_docx("КП", (2025, 9, 1, 10, 0, 2)))
+    assert docx_digest(_docx("КП", (2025, 9, 1, 10, 0, 0))) != docx_digest(_docx("КП 2", (2025, 9, 1, 10, 0, 0)))
+
+
+def test_pdf_converter_uses_long_lived_worker_and_caches_result(tmp_path):
+    """
+    Конвертер запускает воркер один раз, отдает результат по XML-RPC,
+    а повторная конвертация того же документа берется из кэша.
+    """
+    script = tmp_path / "unoserver"
+    script.write_text(f"#!{sys.executable}\n" + FAKE_UNOSERVER, encoding="utf-8")
+    script.chmod(0o755)
+    converter = PdfConverter(command=str(script), workers=1, base_port=_free_port(), timeout_seconds=10, startup_timeout=20)
+
+    try:
+        first = asyncio.run(converter.convert(_docx("КП", (2025, 9, 1, 10, 0, 0))))
+        again = asyncio.run(converter.convert(_docx("КП", (2025, 9, 1, 10, 0, 5))))
+        stats = converter.stats()
+    finally:
+        converter.shutdown()
+
+    assert first.startswith(b"%PDF-fake ")
+    assert again == first
+    assert (stats["workers"], stats["conversions"], stats["cache"]["hits"]) == (1, 1, 1)
+
+
+def test_pdf_converter_without_unoserver_is_unavailable():
+    converter = PdfConverter(command=None)
+    assert not converter.available
+    with pytest.raises(PdfConverterUnavailable):
+        asyncio.run(converter.convert(b"docx"))
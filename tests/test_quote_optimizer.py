@@ -0,0 +1,90 @@
+# C:\excel-to-web\tests\test_quote_optimizer.py
+
+from itertools import product
+
+import pytest
+
+import logic
+import quote_optimizer
+from logic import PriceIndex
+from price_store import PriceTable
+
+NON_LD = "Главный Бухгалтер ПРОФ"
+LD = "Пакет Программ Главный Бухгалтер, Podpis (1 пользователь, ЛД)"
+
+PROMOTIONS = {
+    ("Акция", 6): {"details": {"Месяцев": 6, "Условие1": 0.05, "Условие2": None}, "applicable_levels": ["Эксперт"]},
+    ("Акция", 12): {"details": {"Месяцев": 12, "Условие1": 0.10, "Условие2": "2 мес. со скидкой 99%"}, "applicable_levels": ["Эксперт"]},
+    ("Не подходит", 3): None,
+}
+
+
+def _price_index():
+    rows = []
+    for service in (NON_LD, LD):
+        rows += [
+            {'Сервис': service, 'Уровень': 'Эксперт', 'Аккаунтов': 1, 'Стоимость без НДС': 205.64, 'Период': 'окт.25'},
+            {'Сервис': service, 'Уровень': 'Эксперт', 'Аккаунтов': 2, 'Стоимость без НДС': 190.13, 'Период': 'окт.25'},
+            {'Сервис': service, 'Уровень': 'Оптимальный', 'Аккаунтов': 1, 'Стоимость без НДС': 101.16, 'Период': 'окт.25'},
+        ]
+    return PriceIndex.from_table(PriceTable.from_records(rows))
+
+
+def _quote(service):
+    return {"period": "окт.25", "service": service, "discount_percent": 3.0,
+            "levels": [{"level": "Эксперт", "accounts": 2}, {"level": "Оптимальный", "accounts": 1}]}
+
+
+def _brute_force_frontier(data, price_index):
+    """Все кандидаты через logic.run_calculation и недоминируемые из них."""
+    candidates = [(None, months, None) for months in quote_optimizer.PREPAYMENT_MONTHS]
+    candidates += [(key[0], key[1], info) for key, info in PROMOTIONS.items() if info is not None]
+    options = []
+    for (promotion_id, months, promotion_info), fixation in product(candidates, quote_optimizer.FIXATION_MONTHS):
+        candidate = dict(data, prepayment_months=months, fixation_months=fixation, promotion_id=promotion_id)
+        summary = logic.run_calculation(candidate, None, promotion_info, price_index)["price_summary"]
+        options.append((summary["fixed_monthly"], months, fixation, promotion_id, summary))
+    frontier = []
+    for option in sorted(options, key=lambda option: (option[0], option[1], -option[2])):
+        if not any(kept[2] >= option[2] and kept[1] <= option[1] for kept in frontier):
+            frontier.append(option)
+    return frontier
+
+
+@pytest.mark.parametrize("service", [NON_LD, LD])
+def test_options_match_calculate_and_brute_force(service):
+    """Отсечение ветвей не теряет лучших вариантов; цены - как у /calculate для тех же параметров."""
+    price_index, data = _price_index(), _quote(service)
+    result = quote_optimizer.optimize_quote(
+        data, price_index, list(PROMOTIONS), lambda promotion_id, months: PROMOTIONS[(promotion_id, months)], top=100,
+    )
+    expected = _brute_force_frontier(data, price_index)
+    assert result["complete"] and result["pruned"] > 0
+    assert [(option["monthly_price"], option["prepayment_months"], option["fixation_months"]) for option in result["options"]] == \
+        [(monthly, months, fixation) for monthly, months, fixation, _, _ in expected]
+    for option, (_, _, _, _, summary) in zip(result["options"], expected):
+        assert option["price_summary"] == summary
+    if service == NON_LD:
+        # Самый дешевый вариант - акция на 12 мес. без фиксации
+        best = result["options"][0]
+        assert (best["promotion_id"], best["prepayment_months"], best["fixation_months"]) == ("Акция", 12, 0)
+
+    top = quote_optimizer.optimize_quote(data, price_index, [], lambda *args: None, top=3)
+    assert len(top["options"]) == 3 and top["options"][0]["promotion_id"] is None
+
+
+def test_constraints_budget_and_missing_tiers():
+    price_index, data = _price_index(), _quote(NON_LD)
+    result = quote_optimizer.optimize_quote(
+        data, price_index, list(PROMOTIONS), lambda promotion_id, months: PROMOTIONS[(promotion_id, months)],
+        prepayment_options=[3, 6], fixation_options=[0, 6],
+    )
+    assert {option["promotion_id"] for option in result["options"]} == {None, "Акция"}
+    assert {option["prepayment_months"] for option in result["options"]} <= {3, 6}
+    assert {option["fixation_months"] for option in result["options"]} <= {0, 6}
+
+    # Бюджет времени исчерпан - перебор прерван, ответ все равно есть
+    expired = quote_optimizer.optimize_quote(data, price_index, [], lambda *args: None, time_budget_seconds=-1)
+    assert expired["complete"] is False and expired["options"] == []
+
+    assert quote_optimizer.optimize_quote(dict(data, service="Нет такого"), price_index, [], lambda *args: None) is None
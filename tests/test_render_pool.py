@@ -0,0 +1,63 @@
+# C:\excel-to-web\tests\test_render_pool.py
+
+import asyncio
+import os
+import threading
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+
+from render_pool import RenderPool, RenderPoolBusy
+
+
+def test_render_pool_runs_task_and_counts_it():
+    """Задача выполняется в пуле, результат возвращается в обработчик."""
+    pool = RenderPool(max_workers=1, max_queue=0, mode="thread")
+    try:
+        assert asyncio.run(pool.run(pow, 2, 10)) == 1024
+        stats = pool.stats()
+        assert (stats["in_flight"], stats["finished"]) == (0, 1)
+    finally:
+        pool.shutdown()
+
+
+def test_render_pool_rejects_when_full_and_times_out():
+    """
+    Сверх воркеров и очереди задачи не принимаются (RenderPoolBusy),
+    а долгая задача завершается для обработчика по таймауту.
+    """
+    release = threading.Event()
+    pool = RenderPool(max_workers=1, max_queue=0, timeout_seconds=0.2, mode="thread")
+
+    async def scenario():
+        slow = asyncio.ensure_future(pool.run(release.wait, 5))
+        await asyncio.sleep(0.05)
+        with pytest.raises(RenderPoolBusy):
+            await pool.run(pow, 2, 2)
+        with pytest.raises(asyncio.TimeoutError):
+            await slow
+
+    try:
+        asyncio.run(scenario())
+        stats = pool.stats()
+        assert (stats["rejected"], stats["timed_out"]) == (1, 1)
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_render_pool_recovers_after_worker_dies():
+    """Умерший процесс-воркер ломает только текущую задачу: следующая идет в новый пул, с прогревом."""
+    pool = RenderPool(max_workers=1, max_queue=0, timeout_seconds=30, mode="process")
+
+    async def scenario():
+        with pytest.raises(BrokenProcessPool):
+            await pool.run(os._exit, 1)
+        return await pool.run(pow, 2, 10)
+
+    try:
+        pool.warm_up(abs, -1)
+        assert asyncio.run(scenario()) == 1024
+        stats = pool.stats()
+        assert (stats["restarts"], stats["in_flight"]) == (1, 0)
+    finally:
+        pool.shutdown()
@@ -0,0 +1,86 @@
+# C:\excel-to-web\tests\test_serve.py
+
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="многопроцессный режим использует fork")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _children(pid: int):
+    children = []
+    for stat_path in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            fields = stat_path.read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(stat_path.parent.name))
+    return children
+
+
+def _get_json(url, method="GET", headers=None):
+    request = urllib.request.Request(url, method=method, headers=headers or {})
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return response.status, json.loads(response.read())
+
+
+def _wait_for(condition, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if condition():
+                return True
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+@pytest.mark.skipif(not Path("/proc").exists(), reason="нужен /proc для списка дочерних процессов")
+def test_supervisor_forks_workers_with_preloaded_data_and_rolls_them_on_reload(tmp_path):
+    """
+    serve.py --workers 2: родитель загружает данные один раз и запускает два воркера;
+    /admin/reload в любом воркере приводит к перезагрузке в родителе и замене воркеров;
+    SIGTERM останавливает всех.
+    """
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, ADMIN_TOKEN="secret", DATA_SNAPSHOT_DIR=str(tmp_path / "snapshot"),
+               OFFER_RENDER_MODE="thread", DATA_WATCH_INTERVAL_SECONDS="0")
+    process = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", "2", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+    )
+    try:
+        assert _wait_for(lambda: _get_json(f"{base_url}/admin/data_status")[0] == 200)
+        assert _wait_for(lambda: len(_children(process.pid)) == 2)
+        first_workers = set(_children(process.pid))
+        _, status = _get_json(f"{base_url}/admin/data_status")
+        assert status["version"] == 1 and status["worker_pid"] in first_workers
+
+        code, scheduled = _get_json(f"{base_url}/admin/reload", method="POST", headers={"x-admin-token": "secret"})
+        assert code == 202 and scheduled["status"] == "scheduled"
+        assert _wait_for(lambda: len(set(_children(process.pid)) - first_workers) == 2)
+        assert _wait_for(lambda: _get_json(f"{base_url}/admin/data_status")[1]["version"] == 2)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        output, _ = process.communicate(timeout=60)
+    assert process.returncode == 0, output
+    assert "Запущено воркеров: 2" in output
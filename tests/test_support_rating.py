@@ -0,0 +1,112 @@
+# C:\excel-to-web\tests\test_support_rating.py
+
+import random
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+
+import data_loader
+import workbook_model
+from logic import PriceIndex
+from price_store import PriceTable
+import support_rating
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _price_index():
+    rows = [
+        {'Сервис': support_rating.BASE_SERVICE, 'Уровень': 'Базовый', 'Аккаунтов': 1, 'Стоимость без НДС': 34.6, 'Период': 'окт.25'},
+        {'Сервис': 'Предприятие', 'Уровень': 'Эксперт', 'Аккаунтов': 1, 'Стоимость без НДС': 300.0, 'Период': 'окт.25'},
+        {'Сервис': 'Предприятие', 'Уровень': 'Эксперт', 'Аккаунтов': 2, 'Стоимость без НДС': 280.0, 'Период': 'окт.25'},
+        {'Сервис': 'Главный Бухгалтер ПРОФ', 'Уровень': 'Базовый', 'Аккаунтов': 1, 'Стоимость без НДС': 28.86, 'Период': 'окт.25'},
+    ]
+    return PriceIndex.from_table(PriceTable.from_records(rows))
+
+
+def test_amendment_rating_and_difference():
+    """РС стороны - сумма ROUND(цена уровня с НДС / база, 2); старший тир для большего числа аккаунтов."""
+    amendment = {
+        "current": {"period": "окт.25", "products": [
+            {"service": "Предприятие", "levels": [{"level": "Эксперт", "accounts": 1}]},
+            {"service": "Главный Бухгалтер ПРОФ", "levels": [{"level": "Базовый", "accounts": 1}, {"level": "Эксперт", "accounts": 0}]},
+        ]},
+        "changed": {"period": "окт.25", "products": [
+            {"service": "Предприятие", "levels": [{"level": "Эксперт", "accounts": 3}, {"level": "Оптимальный", "accounts": 1}]},
+        ]},
+    }
+    result = support_rating.calculate_amendment(amendment, support_rating.TierCache(_price_index()))
+    base = Decimal('41.52')  # 34.6 * 1.2
+    current, changed = result["current"], result["changed"]
+    assert current["base_value"] == base and current["accounts"] == 2
+    assert current["rating"] == Decimal('8.67') + Decimal('0.83')  # 360.00/41.52, 34.63/41.52
+    # 3 аккаунта -> тир 2 (280); тира "Оптимальный" нет - цена 0, как IFERROR(...;0) в книге
+    assert changed["products"][0]["levels"][0]["price_with_vat"] == Decimal('1008.00')
+    assert changed["products"][0]["levels"][1]["price_found"] is False
+    assert changed["rating"] == Decimal('24.28')
+    assert result["rating_difference"] == Decimal('24.28') - Decimal('9.50')
+
+    # Без базовой величины периода РС не считается; пустая сторона - РС 0
+    no_base = support_rating.calculate_amendment(
+        {"current": {"period": "сен.25", "products": amendment["current"]["products"]}, "changed": {"period": "окт.25", "products": []}},
+        support_rating.TierCache(_price_index()),
+    )
+    assert no_base["current"]["rating"] is None and no_base["changed"]["rating"] == 0
+    assert no_base["rating_difference"] is None
+
+
+def test_batch_looks_up_each_tier_once():
+    side = {"period": "окт.25", "products": [{"service": "Предприятие", "levels": [{"level": "Эксперт", "accounts": 2}]}]}
+    results, lookups = support_rating.calculate_amendments([{"current": side, "changed": side}] * 50, _price_index())
+    assert len(results) == 50 and all(result["rating_difference"] == 0 for result in results)
+    assert lookups == 2  # тир "Предприятие/Эксперт/2" и база периода
+
+
+@pytest.fixture(scope="module")
+def rating_sheet(tmp_path_factory):
+    if not (ROOT / workbook_model.WORKBOOK_FILENAME).exists():
+        pytest.skip("calc.xlsm отсутствует")
+    source = workbook_model.load_workbook_source(ROOT, tmp_path_factory.mktemp("data"))
+    prices, _, _ = data_loader.load_tables(ROOT / "data_export")
+    return workbook_model.SheetModel(workbook_model.compile_workbook(source), source, prices), prices
+
+
+def test_matches_workbook_sheet(rating_sheet):
+    """Одна позиция на стороне - те же цены, РС и разница, что формулы листа "Расчет РС"."""
+    sheets, prices = rating_sheet
+    index = PriceIndex.from_table(prices)
+    level_names = {level.upper(): level for level in prices.distinct('Уровень')}
+    rng = random.Random(22)
+    periods = sorted(prices.distinct('Период'))
+    services = sorted({service for service in prices.distinct('Сервис')} & {
+        "Главный Бухгалтер ПРОФ", "Предприятие", "Предприятие ПРОФ", "VIP Предприятие", "Комплекс коммерческий Предприятие",
+    })
+    for _ in range(20):
+        inputs, sides = {}, {}
+        for side, (period_cell, service_cell, accounts_column) in (("current", ("E2", "E3", "E")), ("changed", ("N2", "N3", "N"))):
+            period, service = rng.choice(periods), rng.choice(services)
+            accounts = [rng.randint(0, 12) for _ in range(3)]
+            inputs.update({period_cell: period, service_cell: service})
+            inputs.update({f"{accounts_column}{row}": count for row, count in zip((6, 7, 8), accounts)})
+            sides[side] = (period, service, accounts)
+        values, _ = sheets.evaluate("Расчет РС", inputs)
+
+        amendment, labels = {}, {}
+        for side, level_cell in (("current", "D8"), ("changed", "M8")):
+            period, service, accounts = sides[side]
+            # Третий уровень зависит от сервиса (списки!K25:N44), как в книге
+            labels[side] = ["ЭКСПЕРТ", "ОПТИМАЛЬНЫЙ", str(values[level_cell])]
+            amendment[side] = {"period": period, "products": [{"service": service, "levels": [
+                {"level": level_names.get(label.upper(), label), "accounts": count} for label, count in zip(labels[side], accounts)
+            ]}]}
+        result = support_rating.calculate_amendments([amendment], index)[0][0]
+
+        for side, price_column, rating_cell in (("current", "I", "F15"), ("changed", "R", "F16")):
+            levels = {level["level"].upper(): level for level in result[side]["products"][0]["levels"]}
+            for row, label in zip((6, 7, 8), labels[side]):
+                expected = values[f"{price_column}{row}"]
+                level = levels.get(label.upper())
+                assert float(level["price_with_vat"] if level else 0) == pytest.approx(expected), (side, row, inputs)
+            assert float(result[side]["rating"]) == pytest.approx(values[rating_cell]), (side, inputs)
+        assert float(result["rating_difference"]) == pytest.approx(values["F17"]), inputs
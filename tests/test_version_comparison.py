@@ -0,0 +1,88 @@
+# C:\excel-to-web\tests\test_version_comparison.py
+
+import csv
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+
+from logic import PriceIndex
+from price_store import PriceTable
+import version_comparison
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _write_csv(path: Path, rows):
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        csv.writer(f).writerows(rows)
+
+
+@pytest.fixture
+def matrix(tmp_path):
+    """Две группы уровней по две версии, как в выгрузке листа (пустой столбец - разделитель)."""
+    _write_csv(tmp_path / version_comparison.MATRIX_FILENAME, [
+        ["Unnamed: 0"] * 10,
+        ["", "", "", "", "ЭКСПЕРТ", "", "", "ОПТИМАЛЬНЫЙ", "", ""],
+        ["", "https://wiki", "", "", "Предприятие Проф", "Главный бухгалтер", "", "Предприятие Проф", "Главный бухгалтер", ""],
+        ["ФУНКЦИОНАЛЬНОСТИ", "Поиск", "1.0", "", " +", "+", "", "+", "+", ""],
+        ["", "Закладки", "2.0", "", "+\nбез ограничений", "-", "", " - ", "-", ""],
+        ["УСЛУГИ", "Вопрос эксперту", "3.0", "", "+", "по запросу", "", "-", "по запросу", ""],
+    ])
+    _write_csv(tmp_path / version_comparison.DESCRIPTIONS_FILENAME, [
+        ["Изменяемые разделы:", "Главный бухгалтер", "Предприятие ПРОФ"],
+        ["Кому", "БУХГАЛТЕРУ", "РУКОВОДИТЕЛЮ"],
+        ["Наполнение ", "Законодательная база", "Законодательная база"],
+        ["", "", "0"],
+        ["Эксперт", "– полный набор", ""],
+        ["Оптимальный", "– расширенный набор", ""],
+    ])
+    return version_comparison.load_version_matrix(tmp_path)
+
+
+def test_feature_and_description_diff(matrix):
+    assert len(matrix) == 4 and len(matrix.features) == 3
+    left = matrix.resolve("Предприятие ПРОФ", "Эксперт")
+    right = matrix.resolve("Главный бухгалтер", "ОПТИМАЛЬНЫЙ")
+    assert matrix.columns[left] == ("Предприятие Проф", "ЭКСПЕРТ")
+
+    result = matrix.compare(left, right)
+    assert [(f["section"], f["number"], f["left"], f["right"]) for f in result["features"]] == [
+        ("ФУНКЦИОНАЛЬНОСТИ", "2", "+\nбез ограничений", "-"), ("УСЛУГИ", "3", "+", "по запросу"),
+    ]
+    assert result["same_features"] == 1
+    assert result["descriptions"] == [
+        {"section": "Кому", "left": "РУКОВОДИТЕЛЮ", "right": "БУХГАЛТЕРУ"},
+        {"section": "Уровень", "left": "– полный набор", "right": "– расширенный набор"},
+    ]
+    # Обратная пара - та же разница со сторонами наоборот; сама с собой - без отличий
+    swapped = matrix.compare(right, left)
+    assert [(f["left"], f["right"]) for f in swapped["features"]] == [("-", "+\nбез ограничений"), ("по запросу", "+")]
+    assert matrix.compare(left, left)["features"] == [] and matrix.feature_diff(left, right) is matrix.feature_diff(right, left)
+
+
+def test_resolve_price_list_names(matrix):
+    assert matrix.resolve("Главный бухгалтер (1 пользователь)", "Эксперт") == ("главный бухгалтер", "эксперт")
+    assert matrix.resolve("Главный бухгалтер", "Базовый") is None
+    assert matrix.resolve("Доппакет НМВ", "Эксперт") is None
+    assert version_comparison.load_version_matrix(ROOT / "нет каталога") is None
+
+
+def test_price_side_uses_tier_index():
+    index = PriceIndex.from_table(PriceTable.from_records([
+        {'Сервис': 'Предприятие ПРОФ', 'Уровень': 'Эксперт', 'Аккаунтов': 1, 'Стоимость без НДС': 300.0, 'Период': 'окт.25'},
+        {'Сервис': 'Предприятие ПРОФ', 'Уровень': 'Эксперт', 'Аккаунтов': 2, 'Стоимость без НДС': 280.05, 'Период': 'окт.25'},
+    ]))
+    side = version_comparison.price_side(index, 'Предприятие ПРОФ', 'Эксперт', 'окт.25', 3)
+    assert side == {"price_found": True, "price_without_vat_per_user": 280.05, "list_monthly": Decimal('1008.18')}
+    assert version_comparison.price_side(index, 'Предприятие ПРОФ', 'Базовый', 'окт.25', 1)["price_found"] is False
+
+
+def test_exported_matrix_loads():
+    if not (ROOT / "data_export" / version_comparison.MATRIX_FILENAME).exists():
+        pytest.skip("выгрузка матрицы отсутствует")
+    matrix = version_comparison.load_version_matrix(ROOT / "data_export")
+    assert len(matrix.features) == 80 and len(matrix) > 40
+    column = matrix.resolve("Пакет Программ Главный Бухгалтер, Podpis (1 пользователь, ЛД)", "Оптимальный Плюс")
+    assert column is not None and matrix.descriptions[column[0]]
+    assert set(matrix.level_descriptions) >= {"эксперт", "оптимальный", "минимальный", "базовый"}
@@ -0,0 +1,90 @@
+# C:\excel-to-web\tests\test_whatif.py
+
+import random
+
+from logic import PriceIndex, run_calculation
+from price_store import PriceTable
+import whatif
+
+LEVELS = ["Эксперт", "Оптимальный", "Минимальный", "Базовый"]
+SERVICES = ["Комплекс коммерческий VIP Предприятие", "Главный Бухгалтер ЛД"]
+
+
+def _price_index(rng):
+    rows = [
+        {'Сервис': service, 'Уровень': level, 'Аккаунтов': accounts, 'Стоимость без НДС': round(rng.uniform(10, 900), 2), 'Период': 'окт.25'}
+        for service in SERVICES for level in LEVELS for accounts in range(1, 8)
+        if not (level == "Базовый" and accounts > 4)  # для больших количеств тира нет - уровень пропускается
+    ]
+    return PriceIndex.from_table(PriceTable.from_records(rows))
+
+
+def _resolve_promotion(data):
+    """Упрощенный подбор акции: комбо Эксперт+Оптимальный на 12 мес., иначе только Эксперт."""
+    if data.get('promotion_id') != 'Акция' or data.get('prepayment_months') != 12:
+        return None
+    active = {level['level'] for level in data['levels'] if level['accounts'] > 0}
+    if {"Эксперт", "Оптимальный"} <= active:
+        return {"details": {'Месяцев': 12, 'Условие1': 0.1, 'Условие2': '2 мес. со скидкой 99%'}, "applicable_levels": ["Эксперт", "Оптимальный"]}
+    if "Эксперт" in active:
+        return {"details": {'Месяцев': 12, 'Условие1': 0.15, 'Условие2': None}, "applicable_levels": ["Эксперт"]}
+    return None
+
+
+class _CountingIndex(PriceIndex):
+    __slots__ = ('lookups',)
+
+    def find_price(self, service, level, period, accounts):
+        self.lookups += 1
+        return super().find_price(service, level, period, accounts)
+
+
+def test_incremental_recalculation_matches_run_calculation():
+    """
+    Случайная последовательность правок (аккаунты одного уровня, скидка, фиксация,
+    предоплата, акция) дает ровно тот же результат, что полный run_calculation.
+    """
+    rng = random.Random(20251018)
+    index = _price_index(rng)
+    for service in SERVICES:
+        data = {"period": "окт.25", "service": service, "levels": [{"level": "Эксперт", "accounts": 2}],
+                "prepayment_months": 12, "discount_percent": 0.0, "fixation_months": 0, "promotion_id": None}
+        state = whatif.recalculate(None, data, 1, index, _resolve_promotion)
+        for _ in range(300):
+            field = rng.choice(["levels", "levels", "levels", "discount_percent", "fixation_months", "prepayment_months", "promotion_id"])
+            if field == "levels":
+                update = {"levels": [{"level": rng.choice(LEVELS), "accounts": rng.randint(0, 9)}]}
+            elif field == "discount_percent":
+                update = {"discount_percent": rng.choice([0.0, 5.0, 12.5, 33.33])}
+            elif field == "fixation_months":
+                update = {"fixation_months": rng.randint(0, 12)}
+            elif field == "prepayment_months":
+                update = {"prepayment_months": rng.choice([4, 6, 12])}
+            else:
+                update = {"promotion_id": rng.choice([None, "Акция"])}
+            data = whatif.merge_update(state.data, update)
+            state = whatif.recalculate(state, data, 1, index, _resolve_promotion)
+            expected = run_calculation(data, None, promotion_info=_resolve_promotion(data), price_index=index)
+            assert state.result == expected, (update, data)
+
+
+def test_only_changed_parts_are_recalculated():
+    """Правка одного уровня - один поиск тира; правка скидки - без поиска тиров и акции."""
+    index = _CountingIndex(_price_index(random.Random(1))._buckets)
+    index.lookups = 0
+    data = {"period": "окт.25", "service": SERVICES[0], "prepayment_months": 4, "discount_percent": 5.0, "fixation_months": 3,
+            "levels": [{"level": level, "accounts": 2} for level in LEVELS], "promotion_id": None}
+    state = whatif.recalculate(None, data, 1, index, _resolve_promotion)
+    assert index.lookups == 4
+
+    state = whatif.recalculate(state, whatif.merge_update(state.data, {"levels": [{"level": "Базовый", "accounts": 3}]}), 1, index, _resolve_promotion)
+    assert index.lookups == 5
+    assert state.recalculated == {"tiers": 1, "promotion": 0, "list": 1, "discounted": 1, "fixed": 1}
+
+    state = whatif.recalculate(state, whatif.merge_update(state.data, {"discount_percent": 10.0}), 1, index, _resolve_promotion)
+    assert index.lookups == 5
+    assert state.recalculated == {"tiers": 0, "promotion": 0, "list": 0, "discounted": 4, "fixed": 4}
+
+    # Другая версия данных - все с нуля
+    state = whatif.recalculate(state, state.data, 2, index, _resolve_promotion)
+    assert index.lookups == 9
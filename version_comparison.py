@@ -0,0 +1,237 @@
+# C:\excel-to-web\version_comparison.py
+
+import csv
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import logic
+
+# ================================================================
+# СРАВНЕНИЕ ВЕРСИЙ (ЛИСТ "СРАВНЕНИЕ ВЕРСИЙ")
+# ================================================================
+# "Данные для сравнения.csv" - выгрузка одноименного листа книги:
+#   строка 2      - уровень (ЭКСПЕРТ, ОПТИМАЛЬНЫЙ, ...) в первом столбце группы
+#   строка 3      - версия продукта в каждом столбце группы
+#   строки 4-83   - функции: A - раздел (пусто - как выше), B - название, C - номер,
+#                   в столбцах версий "+", "-", "по запросу" или "+" с пояснением
+# Лист книги выбирает столбец через HLOOKUP(версия, уровень, номер строки); здесь
+# каждая пара (версия, уровень) - столбец кодов значений, а разница любых двух
+# столбцов (номера отличающихся функций) считается один раз при загрузке.
+# "ТП.csv" - описания сервисов для КП: разделы ("Кому", "Наполнение", ...) по
+# сервисам и общие для всех сервисов описания уровней.
+
+MATRIX_FILENAME = "Данные для сравнения.csv"
+DESCRIPTIONS_FILENAME = "ТП.csv"
+MATRIX_LEVEL_ROW, MATRIX_PRODUCT_ROW, MATRIX_FIRST_FEATURE_ROW = 1, 2, 3
+MATRIX_FIRST_VALUE_COLUMN = 4
+LEVEL_NAMES = {level.lower() for level in logic.KNOWN_LEVELS}
+
+# Сервисы прайс-листа, которые называются в матрице иначе (без учета регистра
+# названия совпадают, "(1 пользователь)" - та же версия продукта)
+PRODUCT_ALIASES = {
+    "Пакет Программ Главный Бухгалтер, Podpis (1 пользователь, ЛД)": "Главный Бухгалтер (ИПС ilex, podpis.by)",
+    "Пакет Программ Главный Бухгалтер, Podpis, ilex.Накладные (1 пользователь, ЛД)": "Главный Бухгалтер (ИПС ilex, podpis.by, ilex.Накладные)",
+    "Пакет Программ Главный Бухгалтер ПРОФ, Podpis (1 пользователь, ЛД)": "Главный Бухгалтер ПРОФ (ИПС ilex, podpis.by)",
+    "Пакет Программ Главный Бухгалтер ПРОФ, Podpis, ilex.Накладные (1 пользователь, ЛД)": "Главный Бухгалтер ПРОФ (ИПС ilex, podpis.by, ilex.Накладные)",
+}
+SINGLE_USER_SUFFIX = " (1 пользователь)"
+
+Column = Tuple[str, str]  # (версия, уровень) в нижнем регистре
+
+
+class VersionMatrix:
+    """
+    Матрица функций по версиям и описания сервисов из ТП.csv.
+
+    Значения хранятся кодами (индекс в value_labels) - по одному кортежу на
+    столбец (версия, уровень). Разница пар столбцов посчитана при построении:
+    compare() только собирает ответ по готовым номерам строк.
+    """
+    __slots__ = ('features', 'columns', 'value_labels', '_codes', '_diffs', 'descriptions', 'level_descriptions')
+
+    def __init__(
+        self,
+        features: List[Tuple[str, str, str]],
+        columns: Dict[Column, Tuple[str, str]],
+        value_labels: List[str],
+        codes: Dict[Column, Tuple[int, ...]],
+        descriptions: Dict[str, List[Tuple[str, str]]],
+        level_descriptions: Dict[str, str],
+    ):
+        self.features = tuple(features)
+        self.columns = columns
+        self.value_labels = tuple(value_labels)
+        self._codes = codes
+        self.descriptions = descriptions
+        self.level_descriptions = level_descriptions
+        # Каждый столбец с каждым (пары упорядочены по ключу; обратная - та же разница)
+        ordered = sorted(codes)
+        self._diffs: Dict[Tuple[Column, Column], Tuple[int, ...]] = {}
+        for position, left in enumerate(ordered):
+            left_codes = codes[left]
+            for right in ordered[position:]:
+                right_codes = codes[right]
+                self._diffs[(left, right)] = tuple(
+                    row for row, (a, b) in enumerate(zip(left_codes, right_codes)) if a != b
+                )
+
+    def resolve(self, service: str, level: str) -> Optional[Column]:
+        """Столбец матрицы для сервиса прайс-листа (или названия версии) и уровня; None - нет такого."""
+        level_key = level.strip().lower()
+        candidates = [PRODUCT_ALIASES.get(service, service)]
+        if candidates[0].endswith(SINGLE_USER_SUFFIX):
+            candidates.append(candidates[0][:-len(SINGLE_USER_SUFFIX)])
+        for product in candidates:
+            column = (product.strip().lower(), level_key)
+            if column in self._codes:
+                return column
+        return None
+
+    def feature_diff(self, left: Column, right: Column) -> Tuple[int, ...]:
+        """Номера строк функций, значения которых в двух столбцах различаются."""
+        if left <= right:
+            return self._diffs[(left, right)]
+        return self._diffs[(right, left)]
+
+    def compare(self, left: Column, right: Column) -> Dict[str, Any]:
+        """Отличающиеся функции и разделы описания ТП для двух разрешенных столбцов."""
+        left_codes, right_codes = self._codes[left], self._codes[right]
+        rows = self.feature_diff(left, right)
+        features = [
+            {"section": self.features[row][0], "number": self.features[row][1], "name": self.features[row][2],
+             "left": self.value_labels[left_codes[row]], "right": self.value_labels[right_codes[row]]}
+            for row in rows
+        ]
+
+        left_sections = dict(self.descriptions.get(left[0], []))
+        right_sections = dict(self.descriptions.get(right[0], []))
+        section_names = list(left_sections) + [name for name in right_sections if name not in left_sections]
+        section_names.append("Уровень")
+        left_sections["Уровень"] = self.level_descriptions.get(left[1], "")
+        right_sections["Уровень"] = self.level_descriptions.get(right[1], "")
+        descriptions = [
+            {"section": name, "left": left_sections.get(name, ""), "right": right_sections.get(name, "")}
+            for name in section_names if left_sections.get(name, "") != right_sections.get(name, "")
+        ]
+        return {"features": features, "same_features": len(self.features) - len(rows), "descriptions": descriptions}
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+
+def _read_csv(filepath: Path) -> List[List[str]]:
+    with open(filepath, encoding='utf-8-sig', newline='') as f:
+        return list(csv.reader(f))
+
+
+def read_matrix(filepath: Path) -> Tuple[List[Tuple[str, str, str]], Dict[Column, Tuple[str, str]], List[str], Dict[Column, Tuple[int, ...]]]:
+    """Разбор выгрузки листа "Данные для сравнения": функции, столбцы и коды значений."""
+    rows = _read_csv(filepath)
+    level_row, product_row = rows[MATRIX_LEVEL_ROW], rows[MATRIX_PRODUCT_ROW]
+
+    # Столбцы версий: уровень действует от своей ячейки до пустого столбца-разделителя
+    columns: Dict[Column, Tuple[str, str]] = {}
+    positions: Dict[Column, int] = {}
+    level = None
+    for position in range(MATRIX_FIRST_VALUE_COLUMN, len(product_row)):
+        level_label = level_row[position].strip() if position < len(level_row) else ""
+        product = product_row[position].strip()
+        if level_label:
+            level = level_label
+        if not product:
+            level = None
+            continue
+        if level is None:
+            continue
+        column = (product.lower(), level.lower())
+        if column not in columns:
+            columns[column] = (product, level)
+            positions[column] = position
+
+    features, section = [], ""
+    value_codes: Dict[str, int] = {}
+    column_values: Dict[Column, List[int]] = {column: [] for column in columns}
+    for row in rows[MATRIX_FIRST_FEATURE_ROW:]:
+        if len(row) < 3 or not row[1].strip():
+            continue
+        section = row[0].strip() or section
+        number = row[2].strip()
+        if number.endswith(".0"):
+            number = number[:-2]
+        features.append((section, number, row[1].strip()))
+        for column, position in positions.items():
+            value = row[position].strip() if position < len(row) else ""
+            column_values[column].append(value_codes.setdefault(value, len(value_codes)))
+
+    value_labels = sorted(value_codes, key=value_codes.get)
+    return features, columns, value_labels, {column: tuple(values) for column, values in column_values.items()}
+
+
+def read_descriptions(filepath: Path) -> Tuple[Dict[str, List[Tuple[str, str]]], Dict[str, str]]:
+    """
+    Разбор ТП.csv: ({сервис: [(раздел, текст), ...]}, {уровень: описание}).
+    Строка без названия продолжает предыдущий раздел; "0" - пустая ячейка-формула.
+    Описание уровня в ТП заполнено у одного сервиса и общее для всех.
+    """
+    rows = _read_csv(filepath)
+    services = [name.strip().lower() for name in rows[0][1:]]
+    sections: Dict[str, Dict[str, List[str]]] = {service: {} for service in services if service}
+    levels: Dict[str, str] = {}
+    section = None
+    for row in rows[1:]:
+        label = row[0].strip() if row else ""
+        if label.lower() in LEVEL_NAMES:
+            texts = [text.strip() for text in row[1:] if text.strip() and text.strip() != "0"]
+            if texts:
+                levels[label.lower()] = texts[0]
+            section = None
+            continue
+        if label:
+            section = label
+        if section is None:
+            continue
+        for service, text in zip(services, row[1:]):
+            if service and text.strip() and text.strip() != "0":
+                sections[service].setdefault(section, []).append(text.strip())
+    descriptions = {
+        service: [(name, "\n".join(parts)) for name, parts in service_sections.items()]
+        for service, service_sections in sections.items()
+    }
+    return descriptions, levels
+
+
+def load_version_matrix(data_dir: Path) -> Optional[VersionMatrix]:
+    """Матрица сравнения из data_export/; None - файла матрицы нет или он не читается."""
+    try:
+        features, columns, value_labels, codes = read_matrix(data_dir / MATRIX_FILENAME)
+    except FileNotFoundError:
+        print(f"--- ПРЕДУПРЕЖДЕНИЕ: файл '{MATRIX_FILENAME}' не найден, сравнение версий недоступно.")
+        return None
+    except Exception as e:
+        print(f"!!! ОШИБКА чтения '{MATRIX_FILENAME}': {e}")
+        return None
+
+    descriptions, levels = {}, {}
+    try:
+        descriptions, levels = read_descriptions(data_dir / DESCRIPTIONS_FILENAME)
+    except FileNotFoundError:
+        print(f"--- ПРЕДУПРЕЖДЕНИЕ: файл '{DESCRIPTIONS_FILENAME}' не найден, сравнение без описаний сервисов.")
+    except Exception as e:
+        print(f"!!! ОШИБКА чтения '{DESCRIPTIONS_FILENAME}': {e}")
+    return VersionMatrix(features, columns, value_labels, codes, descriptions, levels)
+
+
+def price_side(price_index: Optional[logic.PriceIndex], service: str, level: str, period: str, accounts: int) -> Dict[str, Any]:
+    """
+    Цена одной стороны через тот же индекс тиров, что /calculate: цена тира без НДС
+    и месячная стоимость по прейскуранту с НДС (list_monthly для одного уровня).
+    """
+    level_prices_info = [] if price_index is None else logic.find_price_tiers(
+        {"service": service, "period": period, "levels": [{"level": level, "accounts": accounts}]}, None, price_index
+    )
+    if not level_prices_info:
+        return {"price_found": False, "price_without_vat_per_user": None, "list_monthly": None}
+    price = level_prices_info[0]['price_without_vat_per_user']
+    list_monthly = logic.round_decimal(Decimal(str(price)) * Decimal(str(accounts)) * logic.VAT_RATE)
+    return {"price_found": True, "price_without_vat_per_user": price, "list_monthly": list_monthly}
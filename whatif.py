@@ -0,0 +1,193 @@
+# C:\excel-to-web\whatif.py
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import logic
+
+# ================================================================
+# ИНКРЕМЕНТАЛЬНЫЙ ПЕРЕСЧЕТ "ЧТО ЕСЛИ"
+# ================================================================
+# Пока пользователь меняет одно поле формы, остальное в расчете не меняется.
+# Состояние сессии хранит все промежуточные результаты logic.run_calculation:
+#   - найденные тиры прайса по ключу (сервис, период, уровень, аккаунтов);
+#   - найденную акцию по ключу, от которого зависит find_applicable_promotion;
+#   - вклад каждого уровня в итоговые суммы ("list", "discounted", "fixed")
+#     вместе с параметрами, от которых этот вклад зависит.
+# При обновлении заново считается только то, чьи входные данные изменились:
+# новое количество аккаунтов на одном уровне - один поиск тира и три слагаемых
+# этого уровня; новая скидка - слагаемые со скидкой, без поиска тиров и акции.
+# Для не-ЛД сервисов итоги - суммы по уровням (каждое слагаемое - та же функция
+# logic, вызванная для одного уровня), поэтому результат совпадает с
+# run_calculation до копейки. У ЛД-сервисов итог округляется после суммирования,
+# для них пересчитывается сводка целиком, но по уже найденным тирам и акции.
+
+# Вызывается, когда изменилось что-то, от чего зависит выбор акции
+PromotionResolver = Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]
+
+TERM_KINDS = ("list", "discounted", "fixed")
+
+
+@dataclass(frozen=True)
+class WhatIfState:
+    """
+    Неизменяемое состояние сессии. Обновление создает новый объект, поэтому
+    параллельные запросы к одной сессии не портят друг другу промежуточные данные.
+    """
+    data_version: int
+    data: Dict[str, Any]
+    result: Dict[str, Any]  # в формате logic.run_calculation
+    tiers: Dict[Tuple[str, str, str, int], Optional[float]] = field(default_factory=dict)
+    promotion_key: Optional[Tuple] = None
+    promotion_info: Optional[Dict[str, Any]] = None
+    terms_params: Dict[str, Tuple] = field(default_factory=dict)
+    terms: Dict[str, Dict[Tuple[str, int, float], Decimal]] = field(default_factory=dict)
+    recalculated: Dict[str, int] = field(default_factory=dict)  # что пересчитано последним обновлением
+
+
+def merge_update(data: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Накладывает изменения на ввод сессии. В update["levels"] - только изменившиеся
+    уровни: они заменяют количество аккаунтов на месте, новые уровни добавляются в конец.
+    """
+    merged = dict(data, **{key: value for key, value in update.items() if key != 'levels'})
+    if update.get('levels'):
+        levels = [dict(level) for level in data.get('levels', [])]
+        positions = {level['level']: position for position, level in enumerate(levels)}
+        for level in update['levels']:
+            if level['level'] in positions:
+                levels[positions[level['level']]]['accounts'] = level['accounts']
+            else:
+                positions[level['level']] = len(levels)
+                levels.append(dict(level))
+        merged['levels'] = levels
+    return merged
+
+
+def _promotion_key(data: Dict[str, Any]) -> Tuple:
+    """Все, от чего зависит find_applicable_promotion, включая текущий месяц."""
+    today = datetime.now()
+    return (
+        today.year, today.month, data['period'], data['service'].lower(), data.get('promotion_id'),
+        data.get('prepayment_months'),
+        frozenset(level['level'].lower() for level in data.get('levels', []) if level['accounts'] > 0),
+    )
+
+
+def _find_price_tiers(
+    data: Dict[str, Any], price_index: logic.PriceIndex, previous_tiers: Dict, recalculated: Dict[str, int]
+) -> Tuple[List[Dict[str, Any]], Dict]:
+    """logic.find_price_tiers, который ищет в индексе только тиры, которых не было в прошлом состоянии."""
+    tiers, level_prices_info = {}, []
+    for level_input in data.get('levels', []):
+        accounts = level_input.get('accounts', 0)
+        if accounts <= 0: continue
+        key = (data['service'], data['period'], level_input['level'], accounts)
+        if key in tiers:
+            price = tiers[key]
+        elif key in previous_tiers:
+            price = tiers[key] = previous_tiers[key]
+        else:
+            price = tiers[key] = price_index.find_price(data['service'], level_input['level'], data['period'], accounts)
+            recalculated["tiers"] += 1
+        if price is not None:
+            level_prices_info.append({
+                "level_name": level_input['level'], "accounts": accounts,
+                "price_without_vat_per_user": price,
+            })
+    return level_prices_info, tiers
+
+
+def _sum_level_terms(
+    kind: str, params: Tuple, compute: Callable[[Dict[str, Any]], Decimal],
+    level_prices_info: List[Dict[str, Any]], previous: Optional[WhatIfState],
+    terms_params: Dict[str, Tuple], terms: Dict[str, Dict], recalculated: Dict[str, int]
+) -> Decimal:
+    """Сумма вкладов уровней; вклад считается заново, только если изменились уровень или params."""
+    reusable = previous.terms.get(kind, {}) if previous is not None and previous.terms_params.get(kind) == params else {}
+    values, total = {}, Decimal('0')
+    for item in level_prices_info:
+        key = (item['level_name'], item['accounts'], item['price_without_vat_per_user'])
+        value = values.get(key)
+        if value is None:
+            value = reusable.get(key)
+            if value is None:
+                value = compute(item)
+                recalculated[kind] += 1
+            values[key] = value
+        total += value
+    terms_params[kind], terms[kind] = params, values
+    return total
+
+
+def recalculate(
+    previous: Optional[WhatIfState],
+    data: Dict[str, Any],
+    data_version: int,
+    price_index: logic.PriceIndex,
+    resolve_promotion: PromotionResolver
+) -> WhatIfState:
+    """
+    Новое состояние для ввода data. previous - прошлое состояние той же сессии
+    (None - считать с нуля); на другой версии данных прошлое состояние не используется.
+    """
+    if previous is not None and previous.data_version != data_version:
+        previous = None
+    recalculated = {"tiers": 0, "promotion": 0, **{kind: 0 for kind in TERM_KINDS}}
+
+    level_prices_info, tiers = _find_price_tiers(data, price_index, previous.tiers if previous else {}, recalculated)
+
+    promotion_key = _promotion_key(data)
+    if previous is not None and previous.promotion_key == promotion_key:
+        promotion_info = previous.promotion_info
+    else:
+        promotion_info = resolve_promotion(data)
+        recalculated["promotion"] = 1
+
+    terms_params: Dict[str, Tuple] = {}
+    terms: Dict[str, Dict] = {}
+    if not level_prices_info:
+        result = {"price_summary": None, "calculation_context": None}
+    else:
+        is_ld_service = "ЛД" in data.get('service', '')
+        prepayment_months = logic.effective_prepayment_months(data, promotion_info)
+        fixation_months = data.get('fixation_months', 0)
+        if is_ld_service:
+            price_summary = logic._calculate_price_summary(
+                level_prices_info, data, promotion_info, is_ld_service, prepayment_months, fixation_months
+            )
+        else:
+            def level_terms(kind, params, compute):
+                return _sum_level_terms(kind, params, compute, level_prices_info, previous, terms_params, terms, recalculated)
+
+            D_prepayment_months = Decimal(str(prepayment_months))
+            list_period = level_terms("list", (), lambda item: logic.list_monthly_term(item, False)) * D_prepayment_months
+            if promotion_info:
+                details, applicable_levels = promotion_info["details"], promotion_info["applicable_levels"]
+                discounted_period = level_terms(
+                    "discounted", ("promotion", promotion_key),
+                    lambda item: logic._calculate_discounted_price_with_promotion([item], data, details, applicable_levels, False)
+                )
+            else:
+                discounted_period = level_terms(
+                    "discounted", ("discount", data.get('discount_percent', 0)),
+                    lambda item: logic.calculate_non_ld_discounted_price([item], data)
+                ) * D_prepayment_months
+            fixed_period = discounted_period
+            if fixation_months > 0:
+                fixed_period = level_terms(
+                    "fixed", (data.get('discount_percent', 0), fixation_months),
+                    lambda item: logic.calculate_non_ld_fixed_price([item], data)
+                ) * D_prepayment_months
+            price_summary = logic.price_summary_from_periods(
+                logic.round_decimal(list_period / D_prepayment_months), list_period, discounted_period, fixed_period, D_prepayment_months
+            )
+        result = logic.build_calculation_result(data, level_prices_info, price_summary, prepayment_months, fixation_months)
+
+    return WhatIfState(
+        data_version=data_version, data=data, result=result, tiers=tiers,
+        promotion_key=promotion_key, promotion_info=promotion_info,
+        terms_params=terms_params, terms=terms, recalculated=recalculated,
+    )
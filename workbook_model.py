@@ -0,0 +1,338 @@
+# C:\excel-to-web\workbook_model.py
+
+import os
+import pickle
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import data_loader
+import formula_engine
+from formula_engine import CellKey, CompiledWorkbook, PivotSource, WorkbookModel, WorkbookState
+from price_store import PriceTable, is_missing
+
+# ================================================================
+# ЛИСТЫ CALC.XLSM НА СЕРВЕРЕ
+# ================================================================
+# Формулы берутся из formulas_map.txt (выгрузка parser.py), значения ячеек без
+# формул, именованные диапазоны и умные таблицы - из calc.xlsm. Сводные таблицы
+# книги (GETPIVOTDATA) не пересчитываются по листу "Прейскурант НМВ": они
+# привязаны к загруженному прайс-листу (PriceTable), поэтому листы считаются по
+# той же версии данных, что и /calculate.
+#
+# Разбор calc.xlsm через openpyxl занимает секунды, поэтому результат сохраняется
+# в pickle-снимок рядом со снимком данных (ключ - хэши обоих файлов); формулы
+# компилируются при старте процесса один раз, до fork воркеров.
+
+WORKBOOK_FILENAME = "calc.xlsm"
+FORMULAS_FILENAME = "formulas_map.txt"
+
+# Листы, которые отдает /sheets/{sheet_name}
+SERVED_SHEETS = ("Расчет РС", "Сравнение версий")
+
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_FILENAME = "workbook_snapshot.pkl"
+
+
+@dataclass(frozen=True)
+class WorkbookSource:
+    """Все, что нужно для компиляции книги, без openpyxl."""
+    constants: Dict[CellKey, Any]
+    formulas: Dict[CellKey, str]
+    defined_names: Dict[str, Tuple[str, int, int, int, int]] = field(default_factory=dict)
+    tables: Dict[str, Tuple[str, int, int, int, List[str]]] = field(default_factory=dict)
+    date_cells: FrozenSet[CellKey] = frozenset()
+
+
+# --- Чтение исходных файлов ---
+_SHEET_HEADER_RE = re.compile(r"^=+ ЛИСТ: (.*?) =+$")
+_FORMULA_LINE_RE = re.compile(r"^Ячейка: (\S+)\tФормула: (.*)$")
+
+
+def read_formulas_map(filepath: Path) -> Dict[CellKey, str]:
+    """
+    Разбирает formulas_map.txt: заголовки "=== ЛИСТ: имя ===" и строки
+    "Ячейка: A1<TAB>Формула: =...". Строки без префикса продолжают предыдущую
+    формулу (перевод строки внутри формулы).
+    """
+    formulas: Dict[CellKey, str] = {}
+    sheet, last_key = None, None
+    with open(filepath, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            header = _SHEET_HEADER_RE.match(line)
+            if header:
+                sheet, last_key = header.group(1), None
+                continue
+            formula = _FORMULA_LINE_RE.match(line)
+            if formula and sheet is not None:
+                row, col = formula_engine.parse_cell(formula.group(1))
+                last_key = (sheet, row, col)
+                formulas[last_key] = formula.group(2)
+            elif last_key is not None and line.strip():
+                formulas[last_key] += "\n" + line
+    return formulas
+
+
+def _range_key(sheet: str, reference: str) -> Tuple[str, int, int, int, int]:
+    first, _, last = reference.replace('$', '').partition(':')
+    row1, col1 = formula_engine.parse_cell(first)
+    row2, col2 = formula_engine.parse_cell(last or first)
+    return (sheet, row1, col1, row2, col2)
+
+
+def read_workbook(filepath: Path, formulas: Dict[CellKey, str]) -> WorkbookSource:
+    """Значения ячеек без формул, имена, таблицы и ячейки с форматом даты из calc.xlsm."""
+    import warnings
+    import openpyxl
+    from openpyxl.styles.numbers import is_date_format
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # "Data Validation extension is not supported"
+        workbook = openpyxl.load_workbook(filepath)
+
+    constants: Dict[CellKey, Any] = {}
+    date_cells = set()
+    tables = {}
+    for worksheet in workbook.worksheets:
+        sheet = worksheet.title
+        for row in worksheet.iter_rows():
+            for cell in row:
+                if cell.value is None:
+                    continue
+                key = (sheet, cell.row, cell.column)
+                if is_date_format(cell.number_format):
+                    date_cells.add(key)
+                if cell.data_type == 'f' or key in formulas:
+                    continue
+                value = cell.value
+                if isinstance(value, (datetime, date)):
+                    value = formula_engine.to_serial(value)
+                elif isinstance(value, float) and value == int(value):
+                    value = int(value)
+                constants[key] = value
+        for table in worksheet.tables.values():
+            _, header_row, first_col, last_row, _ = _range_key(sheet, table.ref)
+            columns = [column.name for column in table.tableColumns]
+            tables[table.name] = (sheet, header_row, first_col, last_row, columns)
+
+    defined_names = {}
+    for name, definition in workbook.defined_names.items():
+        destinations = list(definition.destinations)
+        if len(destinations) == 1:
+            sheet, reference = destinations[0]
+            defined_names[name] = _range_key(sheet, reference)
+    return WorkbookSource(constants, formulas, defined_names, tables, frozenset(date_cells))
+
+
+# --- Снимок ---
+def source_key(base_dir: Path) -> str:
+    return "|".join([
+        f"v{SNAPSHOT_FORMAT_VERSION}",
+        data_loader._file_sha256(base_dir / WORKBOOK_FILENAME), data_loader._file_sha256(base_dir / FORMULAS_FILENAME),
+    ])
+
+
+def load_workbook_source(base_dir: Path, data_dir: Path) -> Optional[WorkbookSource]:
+    """
+    Исходные данные книги: из снимка, если он соответствует файлам, иначе из
+    calc.xlsm и formulas_map.txt (с пересборкой снимка). None - файлов нет или они не читаются.
+    """
+    key = source_key(base_dir)
+    snapshot_path = data_loader.snapshot_dir(data_dir) / SNAPSHOT_FILENAME
+    try:
+        with open(snapshot_path, 'rb') as f:
+            snapshot = pickle.load(f)
+        if isinstance(snapshot, dict) and snapshot.get("key") == key:
+            print(f"✓ Книга {WORKBOOK_FILENAME} загружена из снимка '{snapshot_path}'.")
+            return snapshot["source"]
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"--- ПРЕДУПРЕЖДЕНИЕ: снимок книги '{snapshot_path}' поврежден и будет пересобран: {e}")
+
+    try:
+        formulas = read_formulas_map(base_dir / FORMULAS_FILENAME)
+        source = read_workbook(base_dir / WORKBOOK_FILENAME, formulas)
+    except Exception as e:
+        print(f"--- ПРЕДУПРЕЖДЕНИЕ: книга {WORKBOOK_FILENAME} не загружена, листы недоступны: {e}")
+        return None
+    print(f"✓ Книга {WORKBOOK_FILENAME} прочитана: формул {len(source.formulas)}, значений {len(source.constants)}.")
+
+    try:
+        snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = snapshot_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({"key": key, "source": source}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, snapshot_path)
+    except OSError as e:
+        print(f"--- ПРЕДУПРЕЖДЕНИЕ: не удалось сохранить снимок книги '{snapshot_path}': {e}")
+    return source
+
+
+def compile_workbook(source: WorkbookSource) -> CompiledWorkbook:
+    started = time.perf_counter()
+    compiled = CompiledWorkbook(source.constants, source.formulas, source.defined_names, source.tables)
+    if compiled.compile_errors:
+        print(f"--- ПРЕДУПРЕЖДЕНИЕ: формул с ошибками компиляции: {len(compiled.compile_errors)}.")
+    print(f"✓ Формулы книги скомпилированы за {time.perf_counter() - started:.3f} с ({len(compiled.formulas)} ячеек).")
+    return compiled
+
+# ================================================================
+# СВОДНЫЕ ТАБЛИЦЫ ПО ЗАГРУЖЕННОМУ ПРАЙС-ЛИСТУ
+# ================================================================
+
+PIVOT_FIELDS = ('Период', 'Сервис', 'Уровень', 'Аккаунтов')
+
+
+def _pivot_item(field_name: str, value: Any) -> Any:
+    """Значение поля сводной в сравнимом виде: период "июл.25" из даты Excel, строки без регистра."""
+    if field_name == 'Период' and not isinstance(value, str):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = formula_engine.from_serial(value)
+        if isinstance(value, (date, datetime)):
+            return f"{data_loader.RU_MONTHS_MAP[value.month]}.{value.strftime('%y')}"
+    if isinstance(value, str):
+        return value.strip().lower()
+    if isinstance(value, float) and value == int(value):
+        return int(value)
+    return value
+
+
+class PricePivot(PivotSource):
+    """
+    Сводная по прайс-листу: поле данных - сумма (или количество) значений строк,
+    отфильтрованных по полям PIVOT_FIELDS. Как в Excel, несуществующая
+    комбинация элементов дает #REF!. Индекс под каждый набор полей строится при первом запросе.
+    """
+
+    def __init__(self, prices: PriceTable, data_field: str, values: List[Any], count: bool = False):
+        self.data_field = data_field
+        self._count = count
+        self._rows = [
+            tuple(_pivot_item(name, prices[name][position]) for name in PIVOT_FIELDS)
+            for position in range(len(prices))
+        ]
+        self._values = values
+        self._indexes: Dict[Tuple[int, ...], Dict[Tuple, Any]] = {}
+
+    def _index(self, positions: Tuple[int, ...]) -> Dict[Tuple, Any]:
+        index = self._indexes.get(positions)
+        if index is None:
+            index = {}
+            for row, value in zip(self._rows, self._values):
+                if is_missing(value):
+                    continue
+                key = tuple(row[position] for position in positions)
+                index[key] = index.get(key, 0) + (1 if self._count else value)
+            self._indexes[positions] = index
+        return index
+
+    def get(self, data_field: str, items: Dict[str, Any]) -> Any:
+        if data_field.strip().lower() != self.data_field.lower():
+            return formula_engine.ERROR_REF
+        lookup = {}
+        for name, value in items.items():
+            canonical = next((field_name for field_name in PIVOT_FIELDS if field_name.lower() == name.strip().lower()), None)
+            if canonical is None:
+                return formula_engine.ERROR_REF
+            lookup[PIVOT_FIELDS.index(canonical)] = _pivot_item(canonical, value)
+        positions = tuple(sorted(lookup))
+        result = self._index(positions).get(tuple(lookup[position] for position in positions))
+        return formula_engine.ERROR_REF if result is None else result
+
+
+def build_pivots(prices: PriceTable) -> Dict[str, PivotSource]:
+    """Сводные книги (по именам диапазонов, на которые ссылается GETPIVOTDATA)."""
+    prices_without_vat = list(prices['Стоимость без НДС'])
+    return {
+        # "цена1": сумма стоимости без НДС, строки Период/Сервис/Уровень, столбцы Аккаунтов
+        "НМВ_безНДС": PricePivot(prices, "цена1", prices_without_vat),
+        # "Пользователей": количество тиров (строк с аккаунтами) для Период/Сервис/Уровень
+        "НМВ_Пользователей": PricePivot(prices, "Пользователей", list(prices['Аккаунтов']), count=True),
+        # "цена": стоимость одного аккаунта с НДС (в книге - округленная до копеек)
+        "НМВ": PricePivot(prices, "цена", [
+            None if is_missing(price) else formula_engine.round_half_up(price * 1.2, 2) for price in prices_without_vat
+        ]),
+    }
+
+# ================================================================
+# МОДЕЛЬ ЛИСТОВ ДЛЯ ВЕРСИИ ДАННЫХ
+# ================================================================
+
+class SheetModel:
+    """Скомпилированная книга + сводные текущей версии прайса + базовые значения отдаваемых листов."""
+
+    def __init__(self, compiled: CompiledWorkbook, source: WorkbookSource, prices: PriceTable):
+        self.compiled = compiled
+        self.date_cells = source.date_cells
+        self.model = WorkbookModel(compiled, build_pivots(prices))
+        self.sheet_cells = {sheet: compiled.sheet_formulas(sheet) for sheet in SERVED_SHEETS}
+        for sheet, cells in self.sheet_cells.items():
+            self.model.warm_up(cells)
+
+    def input_value(self, key: CellKey, value: Any) -> Any:
+        """Значение из JSON для ячейки: даты принимаются как "2025-07-01" или "июл.25"."""
+        if key in self.date_cells and isinstance(value, str):
+            text = value.strip()
+            month = next((number for number, name in data_loader.RU_MONTHS_MAP.items() if text.lower().startswith(name + ".")), None)
+            try:
+                if month is not None:
+                    parsed = datetime(2000 + int(text.split(".", 1)[1]), month, 1)
+                else:
+                    parsed = datetime.fromisoformat(text)
+            except ValueError:
+                raise ValueError(f"Ячейка {formula_engine.cell_address(key[1], key[2])}: ожидается дата, получено '{value}'.")
+            return formula_engine.to_serial(parsed)
+        if isinstance(value, float) and value == int(value):
+            return int(value)
+        return value
+
+    def output_value(self, key: CellKey, value: Any) -> Any:
+        if isinstance(value, formula_engine.CellError):
+            return value.code
+        if key in self.date_cells and isinstance(value, (int, float)) and not isinstance(value, bool):
+            return formula_engine.from_serial(value).date().isoformat()
+        return value
+
+    def evaluate(self, sheet: str, inputs: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+        """
+        Значения формул листа после подстановки inputs ({"E3": ...}); входными
+        могут быть только ячейки листа без формул. Возвращает (значения по адресам, число пересчитанных формул).
+        """
+        if sheet not in self.sheet_cells:
+            raise KeyError(sheet)
+        changes = {}
+        for address, value in inputs.items():
+            try:
+                row, col = formula_engine.parse_cell(address)
+            except ValueError as e:
+                raise ValueError(str(e))
+            key = (sheet, row, col)
+            if key in self.compiled.formulas:
+                raise ValueError(f"Ячейка {address} содержит формулу и не может быть входной.")
+            changes[key] = self.input_value(key, value)
+
+        state: WorkbookState = self.model.new_state()
+        state.set_inputs(changes)
+        values = state.evaluate(self.sheet_cells[sheet])
+        result = {formula_engine.cell_address(row, col): self.output_value((sheet, row, col), value) for (_, row, col), value in values.items()}
+        return result, state.evaluations
+
+
+if __name__ == "__main__":
+    # Предварительная сборка снимка книги (например, при сборке Docker-образа):
+    #   python workbook_model.py [путь к data_export]
+    # Импорт по имени модуля: иначе WorkbookSource попадет в снимок как __main__.WorkbookSource
+    import workbook_model
+    base_dir = Path(__file__).resolve().parent
+    target = Path(sys.argv[1]) if len(sys.argv) > 1 else base_dir / "data_export"
+    started = time.perf_counter()
+    source = workbook_model.load_workbook_source(base_dir, target)
+    if source is None:
+        sys.exit(1)
+    workbook_model.compile_workbook(source)
+    print(f"✓ Снимок книги готов ({time.perf_counter() - started:.3f} с).")